@@ -6,8 +6,12 @@
  */
 
 export type JygMsgV0Schema = AnyMessage;
-export type AnyMessage = AnyRequest | AnyResponse;
-export type AnyRequest = AppInfoRequest | RunRequest;
+export type AnyMessage = AnyRequest | AnyResponse | AnyEvent;
+export type AnyRequest =
+  | AppInfoRequest
+  | RunRequest
+  | RunBatchRequest
+  | CommandInfoRequest;
 export type AnyContent =
   | {
       [k: string]: unknown;
@@ -20,14 +24,43 @@ export type AnyContent =
 export type MessageTypeAppInfo = 'app_info';
 export type MessageTypeRun = 'run';
 export type AnyResponse = AnyValidResponse | ErrorResponse;
-export type AnyValidResponse = AppInfoResponse | RunResponse;
-export type AnyMessageType = MessageTypeRun | MessageTypeAppInfo;
+export type AnyValidResponse =
+  | AppInfoResponse
+  | RunResponse
+  | RunBatchResponse
+  | CommandInfoResponse;
+export type AnyMessageType =
+  | MessageTypeRun
+  | MessageTypeAppInfo
+  | MessageTypeAppInfoChanged
+  | MessageTypeCommandsChanged
+  | MessageTypeRunBatch
+  | MessageTypeCommandInfo;
+export type MessageTypeAppInfoChanged = 'app_info_changed';
+export type MessageTypeCommandsChanged = 'commands_changed';
+export type MessageTypeRunBatch = 'run_batch';
+export type MessageTypeCommandInfo = 'command_info';
+/**
+ * run each command after the previous one finishes, or all at once
+ */
+export type RunBatchMode = 'sequential' | 'concurrent';
+export type AnyEvent = AppInfoChangedEvent | CommandsChangedEvent;
 
 export interface AppInfoRequest {
-  content?: AnyContent;
+  content?: AppInfoRequestContent;
   request_id: string;
   request_type: MessageTypeAppInfo;
 }
+export interface AppInfoRequestContent {
+  /**
+   * only get these fields of each command, rather than all of them
+   */
+  fields?: string[];
+  /**
+   * hashes of icons the server already has, which the app may leave out of `icons`
+   */
+  known_icons?: string[];
+}
 export interface RunRequest {
   content: RunRequestContent;
   request_id: string;
@@ -46,6 +79,11 @@ export interface AppInfoResponse {
 }
 export interface AppInfo {
   commands: CommandsInfo;
+  icons?: IconsInfo;
+  /**
+   * a stable id for this app, added by the server
+   */
+  id?: string;
   name: string;
   plugins: string[];
   title: string;
@@ -61,6 +99,9 @@ export interface CommandInfo {
   dataset?: {
     [k: string]: unknown;
   };
+  /**
+   * the first 16 hex digits of the SHA-256 of the command's SVG icon, in `icons`
+   */
   icon?: string | null;
   iconClass?: string;
   iconLabel?: string;
@@ -72,6 +113,12 @@ export interface CommandInfo {
   mnemonic?: string | number;
   usage?: string;
 }
+/**
+ * SVG icons, by the hash of their content
+ */
+export interface IconsInfo {
+  [k: string]: string;
+}
 export interface RunResponse {
   content: AnyContent;
   request_id: string;
@@ -82,3 +129,77 @@ export interface ErrorResponse {
   request_id: string;
   request_type: AnyMessageType;
 }
+/**
+ * sent by an app when its commands may have changed since the last app info
+ */
+export interface AppInfoChangedEvent {
+  content?: AnyContent;
+  request_id?: string;
+  request_type: MessageTypeAppInfoChanged;
+}
+export interface CommandsChangedEvent {
+  content: CommandsChangedContent;
+  request_id?: string;
+  request_type: MessageTypeCommandsChanged;
+}
+/**
+ * only the fields of commands which changed since last reported
+ */
+export interface CommandsChangedContent {
+  changed?: {
+    /**
+     * changed command info fields, where `null` removes a field
+     */
+    [k: string]: {
+      [k: string]: unknown;
+    };
+  };
+  icons?: IconsInfo;
+  removed?: string[];
+}
+export interface RunBatchRequest {
+  content: RunBatchRequestContent;
+  request_id: string;
+  request_type: MessageTypeRunBatch;
+}
+export interface RunBatchRequestContent {
+  items: RunRequestContent[];
+  mode?: RunBatchMode;
+}
+export interface RunBatchResponse {
+  content: RunBatchResult[];
+  request_id: string;
+  request_type: MessageTypeRunBatch;
+}
+export interface RunBatchResult {
+  content?: AnyContent;
+  error?: string;
+  /**
+   * the HTTP status of an error from the server, rather than the app
+   */
+  status?: number;
+}
+export interface CommandInfoRequest {
+  content: CommandInfoRequestContent;
+  request_id: string;
+  request_type: MessageTypeCommandInfo;
+}
+export interface CommandInfoRequestContent {
+  /**
+   * only get these fields of each command, rather than all of them
+   */
+  fields?: string[];
+  ids: string[];
+}
+export interface CommandInfoResponse {
+  content: CommandInfoResponseContent;
+  request_id: string;
+  request_type: MessageTypeCommandInfo;
+}
+/**
+ * the info of the requested commands which exist, and their icons
+ */
+export interface CommandInfoResponseContent {
+  commands: CommandsInfo;
+  icons?: IconsInfo;
+}
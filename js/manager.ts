@@ -1,34 +1,78 @@
 import { JupyterFrontEnd } from '@jupyterlab/application';
 import type { LabIcon } from '@jupyterlab/ui-components';
+import type { CommandRegistry } from '@lumino/commands';
 import { JSONExt } from '@lumino/coreutils';
+import { Debouncer } from '@lumino/polling';
+import { ISignal, Signal } from '@lumino/signaling';
 
 const { emptyObject } = JSONExt;
 
 const emptyString = Object.freeze('');
 
 import * as M from './_msgV0';
+import { sha256Hex } from './sha256';
 import {
   IRemoteCommandManager,
   IRemoteCommandSource,
   INFO_METHODS,
   EMOJI,
+  CHANGED_DEBOUNCE,
+  CHANGED_MAX_FRACTION,
 } from './tokens';
 
 export interface IOptions {
   app: JupyterFrontEnd;
 }
 
+/**
+ * Hash an SVG icon to 16 hex digits of its SHA-256, which the server checks.
+ */
+export function hashIcon(svgstr: string): string {
+  return sha256Hex(svgstr).slice(0, 16);
+}
+
 export class RemoteCommandManager implements IRemoteCommandManager {
   protected _app: JupyterFrontEnd;
   protected _sources = new Map<string, IRemoteCommandSource>();
   protected _commandsInfo: M.CommandsInfo = {};
   protected _skipCommandMethod = new Map<[string, string], boolean>();
+  /** SVG icons by the hash of their content */
+  protected _icons = new Map<string, string>();
+  /** hashes of SVG icons, memoized by their content */
+  protected _iconHashes = new Map<string, string>();
+  protected _appInfoChanged = new Signal<IRemoteCommandManager, void>(this);
+  protected _commandsChanged = new Signal<
+    IRemoteCommandManager,
+    M.CommandsChangedContent
+  >(this);
+  /** the commands info as last reported to sources, for computing deltas */
+  protected _baseline: M.CommandsInfo | null = null;
+  protected _changedIds = new Set<string>();
+  protected _allChanged = false;
+  protected _flushChanged = new Debouncer(
+    () => this.flushCommandsChanged(),
+    CHANGED_DEBOUNCE
+  );
 
   constructor(options: IOptions) {
     this._app = options.app;
     this._initialize().catch(this.onInitFail);
   }
 
+  /**
+   * A signal that the app info may have changed in ways a delta can't describe.
+   */
+  get appInfoChanged(): ISignal<IRemoteCommandManager, void> {
+    return this._appInfoChanged;
+  }
+
+  /**
+   * A (debounced) signal with only the fields of commands changed since last reported.
+   */
+  get commandsChanged(): ISignal<IRemoteCommandManager, M.CommandsChangedContent> {
+    return this._commandsChanged;
+  }
+
   /* istanbul ignore next */
   protected onInitFail = (error: any) => {
     console.error(EMOJI, `failed to initialize`, error);
@@ -36,6 +80,86 @@ export class RemoteCommandManager implements IRemoteCommandManager {
 
   protected async _initialize() {
     await this._app.started;
+    this._app.commands.commandChanged.connect(this.onCommandChanged, this);
+  }
+
+  protected onCommandChanged(
+    commands: CommandRegistry,
+    change: CommandRegistry.ICommandChangedArgs
+  ): void {
+    if (this._baseline == null) {
+      return;
+    }
+    if (change.id == null || change.type === 'many-changed') {
+      this._allChanged = true;
+    } else {
+      this._changedIds.add(change.id);
+    }
+    this._flushChanged.invoke().catch(console.warn);
+  }
+
+  /**
+   * Emit the fields which changed since the last report, if any.
+   */
+  public flushCommandsChanged(): void {
+    const baseline = this._baseline;
+    const { commands } = this._app;
+    const ids = this._allChanged
+      ? new Set([...commands.listCommands(), ...Object.keys(baseline || {})])
+      : this._changedIds;
+
+    this._allChanged = false;
+    this._changedIds = new Set();
+
+    if (baseline == null || !ids.size) {
+      return;
+    }
+
+    const changed: Record<string, Record<string, any>> = {};
+    const removed: string[] = [];
+    const icons: M.IconsInfo = {};
+    let changedCount = 0;
+
+    for (const id of ids) {
+      if (!commands.hasCommand(id)) {
+        if (baseline[id]) {
+          removed.push(id);
+          delete baseline[id];
+        }
+        continue;
+      }
+      const info = this.getCommandInfo(id);
+      const old = baseline[id] || {};
+      const fields: Record<string, any> = {};
+      let fieldCount = 0;
+      for (const method of INFO_METHODS) {
+        if (!JSONExt.deepEqual(info[method] as any, old[method] as any)) {
+          fields[method] = info[method] == null ? null : info[method];
+          fieldCount++;
+        }
+      }
+      if (fieldCount) {
+        changed[id] = fields;
+        changedCount++;
+        if (fields.icon && this._icons.has(fields.icon)) {
+          icons[fields.icon] = this._icons.get(fields.icon) as string;
+        }
+      }
+      baseline[id] = info;
+    }
+
+    if (!changedCount && !removed.length) {
+      return;
+    }
+
+    if (changedCount > Object.keys(baseline).length * CHANGED_MAX_FRACTION) {
+      this._appInfoChanged.emit(void 0);
+      return;
+    }
+
+    this._commandsChanged.emit(
+      Object.keys(icons).length ? { changed, removed, icons } : { changed, removed }
+    );
   }
 
   public addSource(id: string, source: IRemoteCommandSource) {
@@ -46,82 +170,158 @@ export class RemoteCommandManager implements IRemoteCommandManager {
     this._sources.set(id, source);
   }
 
-  public getAppInfo = async (): Promise<M.AppInfo> => {
-    const commands = await this.getCommandsInfo();
+  public getAppInfo = async (
+    content?: M.AppInfoRequestContent | null
+  ): Promise<M.AppInfo> => {
+    this.flushCommandsChanged();
+    const fields = content?.fields;
+    const commands = await this.getCommandsInfo(fields);
+    if (!fields) {
+      // only a full report is a baseline for deltas
+      this._baseline = JSONExt.deepCopy(commands as any) as M.CommandsInfo;
+    }
     const appInfo = {
-      url: `${window.location.origin}${window.location.pathname}`,
-      version: this._app.version,
+      ...this.getAppMetadata(),
       plugins: this._app.listPlugins(),
-      name: this._app.name,
-      title: document.title,
       commands,
+      icons: this.getIconsInfo(commands, content?.known_icons),
     };
     return appInfo;
   };
 
+  /**
+   * Get the SVG icons of some commands, skipping those the requester already has.
+   */
+  public getIconsInfo(commands: M.CommandsInfo, knownIcons?: string[]): M.IconsInfo {
+    const known = new Set(knownIcons || []);
+    const icons: M.IconsInfo = {};
+    for (const { icon } of Object.values(commands)) {
+      if (icon && !known.has(icon) && !icons[icon] && this._icons.has(icon)) {
+        icons[icon] = this._icons.get(icon) as string;
+      }
+    }
+    return icons;
+  }
+
+  /**
+   * Get the hash of an SVG icon, remembering the icon.
+   */
+  public addIcon(svgstr: string): string {
+    let hash = this._iconHashes.get(svgstr);
+    if (hash == null) {
+      hash = hashIcon(svgstr);
+      this._iconHashes.set(svgstr, hash);
+      this._icons.set(hash, svgstr);
+    }
+    return hash;
+  }
+
+  /**
+   * Get the cheap-to-compute metadata of the app.
+   */
+  public getAppMetadata(): IRemoteCommandManager.IAppMetadata {
+    return {
+      url: `${window.location.origin}${window.location.pathname}`,
+      version: this._app.version,
+      name: this._app.name,
+      title: document.title,
+    };
+  }
+
   public run = async (commandId: string, args?: any): Promise<any> => {
     return await this._app.commands.execute(commandId, args);
   };
 
-  public async getCommandsInfo(): Promise<M.CommandsInfo> {
+  /**
+   * Get the info of only some commands, and their icons.
+   */
+  public getSomeCommandsInfo = async (
+    content: M.CommandInfoRequestContent
+  ): Promise<M.CommandInfoResponseContent> => {
+    const commands = await this.getCommandsInfo(content.fields, content.ids);
+    return { commands, icons: this.getIconsInfo(commands) };
+  };
+
+  /**
+   * Get the info of all commands, or only some, with only some fields, if given.
+   */
+  public async getCommandsInfo(
+    fields?: string[] | null,
+    ids?: string[] | null
+  ): Promise<M.CommandsInfo> {
     const { commands } = this._app;
     const commandsInfo: M.CommandsInfo = {};
+    const methods = fields
+      ? INFO_METHODS.filter((method) => fields.includes(method))
+      : INFO_METHODS;
 
-    for (const id of commands.listCommands()) {
-      const info: M.CommandInfo = (commandsInfo[id] = {});
-      for (const method of INFO_METHODS) {
-        if (this._skipCommandMethod.get([id, method])) {
-          continue;
-        }
-        let value: any = null;
-        try {
-          value = commands[method](id, emptyObject) as any;
-        } catch (error) {
-          this._skipCommandMethod.set([id, method], true);
-          continue;
-        }
+    for (const id of ids || commands.listCommands()) {
+      if (ids && !commands.hasCommand(id)) {
+        continue;
+      }
+      commandsInfo[id] = this.getCommandInfo(id, methods);
+    }
+    return commandsInfo;
+  }
 
-        switch (value) {
-          case null:
-          case undefined:
-          case emptyObject:
-          case emptyString:
-            continue;
-          default:
-            break;
-        }
+  public getCommandInfo(
+    id: string,
+    methods: (keyof M.CommandInfo)[] = INFO_METHODS
+  ): M.CommandInfo {
+    const { commands } = this._app;
+    const info: M.CommandInfo = {};
+    for (const method of methods) {
+      if (this._skipCommandMethod.get([id, method])) {
+        continue;
+      }
+      let value: any = null;
+      try {
+        value = commands[method](id, emptyObject) as any;
+      } catch (error) {
+        this._skipCommandMethod.set([id, method], true);
+        continue;
+      }
 
-        switch (method) {
-          case 'isToggled':
-          case 'isToggleable':
-          case 'isVisible':
-          case 'isEnabled':
-            if (value == false) {
-              continue;
-            }
-            break;
-          case 'mnemonic':
-            if (value == -1) {
-              continue;
-            }
-            break;
-          case 'dataset':
-            if (!Object.keys(value).length) {
-              continue;
-            }
-            break;
-          case 'icon':
-            if ((value as LabIcon).svgstr) {
-              value = value.svgstr;
-            }
-            break;
-          default:
-            break;
-        }
+      switch (value) {
+        case null:
+        case undefined:
+        case emptyObject:
+        case emptyString:
+          continue;
+        default:
+          break;
+      }
 
-        info[method] = value;
+      switch (method) {
+        case 'isToggled':
+        case 'isToggleable':
+        case 'isVisible':
+        case 'isEnabled':
+          if (value == false) {
+            continue;
+          }
+          break;
+        case 'mnemonic':
+          if (value == -1) {
+            continue;
+          }
+          break;
+        case 'dataset':
+          if (!Object.keys(value).length) {
+            continue;
+          }
+          break;
+        case 'icon':
+          if ((value as LabIcon).svgstr) {
+            value = this.addIcon(value.svgstr);
+          }
+          break;
+        default:
+          break;
       }
+
+      info[method] = value;
     }
-    return commandsInfo;
+    return info;
   }
 }
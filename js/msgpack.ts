@@ -0,0 +1,310 @@
+/**
+ * A minimal MessagePack codec, for the JSON-compatible values sent to the server.
+ *
+ * Values are encoded as `JSON.stringify` would see them: `undefined`, functions and
+ * symbols are dropped from objects, and become `null` in arrays.
+ */
+
+const encoder = new TextEncoder();
+const decoder = new TextDecoder();
+
+class Writer {
+  protected _bytes = new Uint8Array(256);
+  protected _view = new DataView(this._bytes.buffer);
+  protected _offset = 0;
+
+  get bytes(): Uint8Array {
+    return this._bytes.subarray(0, this._offset);
+  }
+
+  /**
+   * Make room for some bytes, returning where to write them.
+   */
+  reserve(size: number): number {
+    const offset = this._offset;
+    if (offset + size > this._bytes.length) {
+      const bytes = new Uint8Array(Math.max(this._bytes.length * 2, offset + size));
+      bytes.set(this._bytes);
+      this._bytes = bytes;
+      this._view = new DataView(bytes.buffer);
+    }
+    this._offset += size;
+    return offset;
+  }
+
+  u8(value: number): void {
+    const offset = this.reserve(1);
+    this._view.setUint8(offset, value);
+  }
+
+  u16(value: number): void {
+    const offset = this.reserve(2);
+    this._view.setUint16(offset, value);
+  }
+
+  u32(value: number): void {
+    const offset = this.reserve(4);
+    this._view.setUint32(offset, value);
+  }
+
+  i8(value: number): void {
+    const offset = this.reserve(1);
+    this._view.setInt8(offset, value);
+  }
+
+  i16(value: number): void {
+    const offset = this.reserve(2);
+    this._view.setInt16(offset, value);
+  }
+
+  i32(value: number): void {
+    const offset = this.reserve(4);
+    this._view.setInt32(offset, value);
+  }
+
+  f64(value: number): void {
+    const offset = this.reserve(8);
+    this._view.setFloat64(offset, value);
+  }
+
+  raw(value: Uint8Array): void {
+    const offset = this.reserve(value.length);
+    this._bytes.set(value, offset);
+  }
+
+  /**
+   * Write a type byte and length, for lengths which need more than a `fix` type.
+   */
+  length(length: number, u8: number, u16: number, u32: number): void {
+    if (length < 0x100 && u8) {
+      this.u8(u8);
+      this.u8(length);
+    } else if (length < 0x10000) {
+      this.u8(u16);
+      this.u16(length);
+    } else {
+      this.u8(u32);
+      this.u32(length);
+    }
+  }
+}
+
+function isDropped(value: any): boolean {
+  return (
+    value === undefined || typeof value === 'function' || typeof value === 'symbol'
+  );
+}
+
+function writeNumber(writer: Writer, value: number): void {
+  if (!Number.isFinite(value)) {
+    // like JSON
+    writer.u8(0xc0);
+  } else if (!Number.isSafeInteger(value)) {
+    writer.u8(0xcb);
+    writer.f64(value);
+  } else if (value > 0xffffffff || value < -0x80000000) {
+    const high = Math.floor(value / 0x100000000);
+    writer.u8(value > 0 ? 0xcf : 0xd3);
+    writer.i32(high);
+    writer.u32(value - high * 0x100000000);
+  } else if (value >= 0) {
+    if (value < 0x80) {
+      writer.u8(value);
+    } else if (value < 0x100) {
+      writer.u8(0xcc);
+      writer.u8(value);
+    } else if (value < 0x10000) {
+      writer.u8(0xcd);
+      writer.u16(value);
+    } else {
+      writer.u8(0xce);
+      writer.u32(value);
+    }
+  } else if (value >= -0x20) {
+    writer.i8(value);
+  } else if (value >= -0x80) {
+    writer.u8(0xd0);
+    writer.i8(value);
+  } else if (value >= -0x8000) {
+    writer.u8(0xd1);
+    writer.i16(value);
+  } else {
+    writer.u8(0xd2);
+    writer.i32(value);
+  }
+}
+
+function write(writer: Writer, value: any): void {
+  if (value === null || isDropped(value)) {
+    writer.u8(0xc0);
+  } else if (value === true || value === false) {
+    writer.u8(value ? 0xc3 : 0xc2);
+  } else if (typeof value === 'number') {
+    writeNumber(writer, value);
+  } else if (typeof value === 'string') {
+    const bytes = encoder.encode(value);
+    if (bytes.length < 0x20) {
+      writer.u8(0xa0 | bytes.length);
+    } else {
+      writer.length(bytes.length, 0xd9, 0xda, 0xdb);
+    }
+    writer.raw(bytes);
+  } else if (typeof value.toJSON === 'function') {
+    write(writer, value.toJSON());
+  } else if (Array.isArray(value)) {
+    if (value.length < 0x10) {
+      writer.u8(0x90 | value.length);
+    } else {
+      writer.length(value.length, 0, 0xdc, 0xdd);
+    }
+    for (const item of value) {
+      write(writer, item);
+    }
+  } else {
+    const entries = Object.entries(value).filter(([, v]) => !isDropped(v));
+    if (entries.length < 0x10) {
+      writer.u8(0x80 | entries.length);
+    } else {
+      writer.length(entries.length, 0, 0xde, 0xdf);
+    }
+    for (const [k, v] of entries) {
+      write(writer, k);
+      write(writer, v);
+    }
+  }
+}
+
+/**
+ * Encode a JSON-compatible value as MessagePack.
+ */
+export function encode(value: any): Uint8Array {
+  const writer = new Writer();
+  write(writer, value);
+  return writer.bytes;
+}
+
+class Reader {
+  protected _bytes: Uint8Array;
+  protected _view: DataView;
+  protected _offset = 0;
+
+  constructor(bytes: Uint8Array) {
+    this._bytes = bytes;
+    this._view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  }
+
+  advance(size: number): number {
+    const offset = this._offset;
+    if (offset + size > this._bytes.length) {
+      throw new Error('unexpected end of MessagePack data');
+    }
+    this._offset += size;
+    return offset;
+  }
+
+  read(): any {
+    const type = this._view.getUint8(this.advance(1));
+    if (type < 0x80) {
+      return type;
+    } else if (type < 0x90) {
+      return this.map(type & 0x0f);
+    } else if (type < 0xa0) {
+      return this.array(type & 0x0f);
+    } else if (type < 0xc0) {
+      return this.str(type & 0x1f);
+    } else if (type >= 0xe0) {
+      return type - 0x100;
+    }
+    const view = this._view;
+    switch (type) {
+      case 0xc0:
+        return null;
+      case 0xc2:
+        return false;
+      case 0xc3:
+        return true;
+      case 0xc4:
+        return this.bin(view.getUint8(this.advance(1)));
+      case 0xc5:
+        return this.bin(view.getUint16(this.advance(2)));
+      case 0xc6:
+        return this.bin(view.getUint32(this.advance(4)));
+      case 0xca:
+        return view.getFloat32(this.advance(4));
+      case 0xcb:
+        return view.getFloat64(this.advance(8));
+      case 0xcc:
+        return view.getUint8(this.advance(1));
+      case 0xcd:
+        return view.getUint16(this.advance(2));
+      case 0xce:
+        return view.getUint32(this.advance(4));
+      case 0xcf:
+        return this.int64(view.getUint32(this.advance(4)));
+      case 0xd0:
+        return view.getInt8(this.advance(1));
+      case 0xd1:
+        return view.getInt16(this.advance(2));
+      case 0xd2:
+        return view.getInt32(this.advance(4));
+      case 0xd3:
+        return this.int64(view.getInt32(this.advance(4)));
+      case 0xd9:
+        return this.str(view.getUint8(this.advance(1)));
+      case 0xda:
+        return this.str(view.getUint16(this.advance(2)));
+      case 0xdb:
+        return this.str(view.getUint32(this.advance(4)));
+      case 0xdc:
+        return this.array(view.getUint16(this.advance(2)));
+      case 0xdd:
+        return this.array(view.getUint32(this.advance(4)));
+      case 0xde:
+        return this.map(view.getUint16(this.advance(2)));
+      case 0xdf:
+        return this.map(view.getUint32(this.advance(4)));
+    }
+    throw new Error(`unsupported MessagePack type 0x${type.toString(16)}`);
+  }
+
+  /**
+   * Read the low half of a 64-bit integer, which may lose precision, like JSON.
+   */
+  int64(high: number): number {
+    return high * 0x100000000 + this._view.getUint32(this.advance(4));
+  }
+
+  str(length: number): string {
+    const offset = this.advance(length);
+    return decoder.decode(this._bytes.subarray(offset, offset + length));
+  }
+
+  bin(length: number): Uint8Array {
+    const offset = this.advance(length);
+    return this._bytes.slice(offset, offset + length);
+  }
+
+  array(length: number): any[] {
+    const value = new Array(length);
+    for (let i = 0; i < length; i++) {
+      value[i] = this.read();
+    }
+    return value;
+  }
+
+  map(length: number): Record<string, any> {
+    const value: Record<string, any> = {};
+    for (let i = 0; i < length; i++) {
+      const key = this.read();
+      value[`${key}`] = this.read();
+    }
+    return value;
+  }
+}
+
+/**
+ * Decode MessagePack, as sent by the server.
+ */
+export function decode(bytes: Uint8Array): any {
+  return new Reader(bytes).read();
+}
@@ -36,7 +36,12 @@ export class BaseCommandSource<T extends any = any, U extends IOptions = any> {
 
     switch (request_type) {
       case 'app_info':
-        responseContent = await this._remoteCommands.getAppInfo();
+        responseContent = await this._remoteCommands.getAppInfo(request.content);
+        break;
+      case 'command_info':
+        responseContent = await this._remoteCommands.getSomeCommandsInfo(
+          request.content
+        );
         break;
       case 'run':
         try {
@@ -48,10 +53,19 @@ export class BaseCommandSource<T extends any = any, U extends IOptions = any> {
           error = err;
         }
         break;
+      case 'run_batch':
+        try {
+          responseContent = await this.runBatch(request.content);
+        } catch (err) {
+          error = err;
+        }
+        break;
       /* istanbul ignore next */
       default:
         console.warn(EMOJI, 'unexpected request', request);
-        return {};
+        // answer, so the server doesn't wait for a newer request type
+        error = `unexpected request type ${request_type}`;
+        break;
     }
 
     try {
@@ -71,11 +85,53 @@ export class BaseCommandSource<T extends any = any, U extends IOptions = any> {
     }
   };
 
+  /**
+   * Run many commands, capturing the result or error of each.
+   */
+  protected async runBatch(
+    content: M.RunBatchRequestContent
+  ): Promise<M.RunBatchResult[]> {
+    const { items, mode } = content;
+
+    if (mode === 'concurrent') {
+      return await Promise.all(items.map(this.runBatchItem));
+    }
+
+    const results: M.RunBatchResult[] = [];
+    for (const item of items) {
+      results.push(await this.runBatchItem(item));
+    }
+    return results;
+  }
+
+  protected runBatchItem = async (
+    item: M.RunRequestContent
+  ): Promise<M.RunBatchResult> => {
+    let content: any;
+    try {
+      content = await this._remoteCommands.run(item.id, item.args || {});
+    } catch (err) {
+      return { error: `${err}` };
+    }
+    try {
+      // many commands return widgets, etc. which can't be sent
+      JSON.stringify(content);
+    } catch {
+      content = null;
+    }
+    return { content: content == null ? null : (content as M.AnyContent) };
+  };
+
   /* istanbul ignore next */
   protected async sendError(error: M.ErrorResponse, source: T): Promise<void> {
     // nothing here
   }
 
+  /* istanbul ignore next */
+  protected async sendEvent(event: M.AnyEvent, source: T): Promise<void> {
+    // nothing here
+  }
+
   /* istanbul ignore next */
   protected async sendResponse(response: M.AnyValidResponse, source: T): Promise<void> {
     // nothing here
@@ -1,14 +1,47 @@
 import { URLExt, PageConfig } from '@jupyterlab/coreutils';
 import { ServerConnection } from '@jupyterlab/services';
-import { PromiseDelegate } from '@lumino/coreutils';
+import { PromiseDelegate, UUID } from '@lumino/coreutils';
 
 import * as M from '../_msgV0';
-import { EMOJI, IRemoteCommandManager, IRemoteCommandSource } from '../tokens';
+import * as msgpack from '../msgpack';
+import { EMOJI, IRemoteCommandManager, IRemoteCommandSource, NS } from '../tokens';
 
 import { BaseCommandSource } from './_base';
 
 export const API_URL = URLExt.join(PageConfig.getBaseUrl(), 'jyg');
 export const WS_URL = URLExt.join(API_URL, 'ws').replace(/^http/, 'ws');
+export const APP_ID_KEY = `${NS}:app-id`;
+export const MSGPACK_SUBPROTOCOL = 'jyg.v0.msgpack';
+export const JSON_SUBPROTOCOL = 'jyg.v0.json';
+/** WebSocket subprotocols, in the order they are preferred */
+export const SUBPROTOCOLS = [MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL];
+
+/**
+ * Get an id for this browser tab which survives reloading.
+ */
+export function getAppId(): string {
+  let appId = window.sessionStorage.getItem(APP_ID_KEY);
+  if (!appId) {
+    appId = UUID.uuid4();
+    window.sessionStorage.setItem(APP_ID_KEY, appId);
+  }
+  return appId;
+}
+
+/**
+ * Serialize a response with its envelope first, and `content` last, so the server
+ * can pass the content through without decoding it.
+ */
+export function serializeResponse(response: M.AnyResponse): string {
+  const { content, ...envelope } = response as M.AnyValidResponse;
+  if (!('content' in response)) {
+    return JSON.stringify(envelope);
+  }
+  const head = JSON.stringify(envelope).slice(0, -1);
+  const sep = head.length > 1 ? ',' : '';
+  const body = JSON.stringify(content === undefined ? null : content) ?? 'null';
+  return `${head}${sep}"content":${body}}`;
+}
 
 export interface IOptions {
   serverSettings: ServerConnection.ISettings;
@@ -22,28 +55,71 @@ export class WebSocketCommandSource
   protected _ready = new PromiseDelegate<void>();
 
   async initClient(options: IOptions): Promise<WebSocket> {
-    const ws = new options.serverSettings.WebSocket(WS_URL);
+    const query = URLExt.objectToQueryString({
+      app_id: getAppId(),
+      ...this._remoteCommands.getAppMetadata(),
+    });
+    const ws = new options.serverSettings.WebSocket(`${WS_URL}${query}`, SUBPROTOCOLS);
+    ws.binaryType = 'arraybuffer';
     ws.onopen = () => this._ready.resolve();
     ws.onmessage = this.onMessage;
     ws.onclose = this.onClose;
     ws.onerror = this.onError;
+    this._remoteCommands.appInfoChanged.connect(this.onAppInfoChanged, this);
+    this._remoteCommands.commandsChanged.connect(this.onCommandsChanged, this);
     return ws;
   }
 
+  protected onAppInfoChanged(): void {
+    if (this._client?.readyState !== WebSocket.OPEN) {
+      return;
+    }
+    this.sendEvent({ request_type: 'app_info_changed' }).catch(this.onError);
+  }
+
+  protected onCommandsChanged(
+    sender: IRemoteCommandManager,
+    content: M.CommandsChangedContent
+  ): void {
+    if (this._client?.readyState !== WebSocket.OPEN) {
+      return;
+    }
+    this.sendEvent({ request_type: 'commands_changed', content }).catch(this.onError);
+  }
+
+  /**
+   * Whether the server chose to exchange MessagePack, rather than JSON.
+   */
+  get isMsgpack(): boolean {
+    return this._client?.protocol === MSGPACK_SUBPROTOCOL;
+  }
+
+  async sendEvent(event: M.AnyEvent): Promise<void> {
+    this._client!.send(this.isMsgpack ? msgpack.encode(event) : JSON.stringify(event));
+  }
+
   protected onMessage = async (ev: MessageEvent<any>): Promise<void> => {
-    this.onRequest(JSON.parse(ev.data), this._client!).catch(this.onError);
+    const request =
+      ev.data instanceof ArrayBuffer
+        ? msgpack.decode(new Uint8Array(ev.data))
+        : JSON.parse(ev.data);
+    this.onRequest(request, this._client!).catch(this.onError);
   };
 
   async sendResponse(response: M.AnyResponse): Promise<void> {
-    this._client!.send(JSON.stringify(response));
+    this._client!.send(
+      this.isMsgpack ? msgpack.encode(response) : serializeResponse(response)
+    );
   }
 
   async sendError(error: M.ErrorResponse): Promise<void> {
-    this._client!.send(JSON.stringify(error));
+    this._client!.send(this.isMsgpack ? msgpack.encode(error) : JSON.stringify(error));
   }
 
   /* istanbul ignore next */
   protected onClose = async (ev: Event) => {
+    this._remoteCommands.appInfoChanged.disconnect(this.onAppInfoChanged, this);
+    this._remoteCommands.commandsChanged.disconnect(this.onCommandsChanged, this);
     console.warn(EMOJI, 'websocket was closed', ev);
   };
 
@@ -29,8 +29,18 @@ export interface IWindowProxyCommandSource {
 
 export interface IRemoteCommandManager {
   addSource(id: string, options: IRemoteCommandSource): void;
-  getAppInfo(): Promise<M.AppInfo>;
+  getAppInfo(content?: M.AppInfoRequestContent | null): Promise<M.AppInfo>;
+  getSomeCommandsInfo(
+    content: M.CommandInfoRequestContent
+  ): Promise<M.CommandInfoResponseContent>;
   run(commandId: string, args: any): Promise<any>;
+  appInfoChanged: ISignal<IRemoteCommandManager, void>;
+  commandsChanged: ISignal<IRemoteCommandManager, M.CommandsChangedContent>;
+  getAppMetadata(): IRemoteCommandManager.IAppMetadata;
+}
+
+export namespace IRemoteCommandManager {
+  export type IAppMetadata = Pick<M.AppInfo, 'url' | 'version' | 'name' | 'title'>;
 }
 
 export interface IBoardManager {
@@ -65,6 +75,12 @@ export const INFO_METHODS: (keyof M.CommandInfo)[] = [
 
 export const EMOJI = '📺';
 
+/** milliseconds to wait for command changes to settle before notifying sources */
+export const CHANGED_DEBOUNCE = 200;
+
+/** above this fraction of changed commands, ask the server to refetch everything */
+export const CHANGED_MAX_FRACTION = 0.5;
+
 export const CommandIds = {
   openBoard: 'jyg:open-board',
   closeAllBoards: 'jyg:close-all-boards',
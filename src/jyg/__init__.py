@@ -1,8 +1,6 @@
 """run Jupyter browser client commands from a CLI, REST API, or browser windows."""
 
-from typing import Dict, List
-
-from ._version import __js__, __package_json__, __version__
+from typing import Any, Dict, List
 
 __all__ = [
     "__version__",
@@ -12,8 +10,19 @@ __all__ = [
 ]
 
 
+def __getattr__(name: str) -> Any:
+    """Read the version from ``package.json`` only when first needed."""
+    if name in ("__version__", "__js__", "__package_json__"):
+        from . import _version
+
+        return getattr(_version, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def _jupyter_labextension_paths() -> List[Dict[str, str]]:
     """Fetch the paths to JupyterLab extensions."""
+    from ._version import __js__, __package_json__
+
     return [dict(src=(str(__package_json__.parent)), dest=__js__["name"])]
 
 
@@ -1,5 +1,20 @@
 """A main entry point for jyg."""
-from .jygapp import main
+import sys
+from typing import List, Optional
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Launch the CLI, answering ``--version`` without importing the apps."""
+    if (sys.argv[1:] if argv is None else argv) == ["--version"]:
+        from ._version import __version__
+
+        print(__version__)
+        return
+
+    from .jygapp import main as launch
+
+    launch(argv)
+
 
 if __name__ == "__main__":
     main()
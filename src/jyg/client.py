@@ -0,0 +1,642 @@
+"""HTTP clients for the jyg REST API."""
+import asyncio
+import http.client
+import json
+import select
+import socket
+import threading
+import urllib.parse
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Sequence, Tuple, cast
+from urllib.error import HTTPError
+
+from . import constants as C
+from .schema import msg_v0 as M
+
+#: a scheme, host and port
+PoolKey = Tuple[str, str, Optional[int]]
+
+#: a command to run, like ``{"id": "help:about", "args": {}}``
+RunItem = Dict[str, Any]
+
+#: the most commands to send in one batch request, by default
+DEFAULT_BATCH_SIZE = 100
+
+#: methods which may be sent again if a reused connection fails
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+_DEFAULT_POOL: Optional["ConnectionPool"] = None
+_DEFAULT_POOL_LOCK = threading.Lock()
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections, kept per server and reused across requests.
+
+    Safe to share between threads: each request takes an idle connection, or opens a
+    new one, and returns it when the response has been read.
+    """
+
+    max_idle: int
+    timeout: Optional[float]
+
+    _idle: Dict[PoolKey, List[http.client.HTTPConnection]]
+    _lock: threading.Lock
+
+    def __init__(self, max_idle: int = 8, timeout: Optional[float] = None) -> None:
+        """Prepare an empty pool."""
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """Make a request, returning the status, headers and body.
+
+        Idle connections which the server has since closed are not reused. If a
+        reused connection still fails, ``GET`` and ``HEAD`` requests are retried once
+        on a new connection, but other requests only if they couldn't be sent, so a
+        command the server may have received is never run twice.
+        """
+        parsed = urllib.parse.urlsplit(url)
+        key: PoolKey = (parsed.scheme, parsed.hostname or "localhost", parsed.port)
+        path = urllib.parse.urlunsplit(("", "", parsed.path or "/", parsed.query, ""))
+
+        for attempt in range(2):
+            conn, reused = self._acquire(key)
+            sent = False
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                sent = True
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as err:
+                conn.close()
+                if reused and attempt == 0 and can_retry(method, err, sent):
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return response.status, dict(response.getheaders()), data
+
+        raise RuntimeError("unreachable")  # pragma: no cover
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _acquire(self, key: PoolKey) -> Tuple[http.client.HTTPConnection, bool]:
+        while True:
+            with self._lock:
+                conns = self._idle.get(key)
+                conn = conns.pop() if conns else None
+            if conn is None:
+                break
+            if not is_dropped(conn):
+                return conn, True
+            conn.close()
+        scheme, host, port = key
+        klass = (
+            http.client.HTTPSConnection
+            if scheme == "https"
+            else http.client.HTTPConnection
+        )
+        return klass(host, port, timeout=self.timeout), False
+
+    def _release(self, key: PoolKey, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+
+def can_retry(method: str, err: Exception, sent: bool) -> bool:
+    """Decide whether a request which failed on a reused connection can be resent."""
+    if isinstance(err, socket.timeout):
+        return False
+    if method in IDEMPOTENT_METHODS:
+        return True
+    return not sent and isinstance(err, (BrokenPipeError, ConnectionResetError))
+
+
+def is_dropped(conn: http.client.HTTPConnection) -> bool:
+    """Check whether an idle connection was closed, or sent something unexpected."""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+def get_default_pool() -> ConnectionPool:
+    """Get the connection pool shared by all clients in this process."""
+    global _DEFAULT_POOL
+    with _DEFAULT_POOL_LOCK:
+        if _DEFAULT_POOL is None:
+            _DEFAULT_POOL = ConnectionPool()
+        return _DEFAULT_POOL
+
+
+class AsyncConnectionPool:
+    """Keep-alive HTTP connections for ``asyncio``, kept per server and reused.
+
+    At most ``max_connections`` requests are made at once, and as many idle
+    connections are kept. Connections belong to the event loop which opened them.
+    """
+
+    max_connections: int
+    timeout: Optional[float]
+
+    _idle: Dict[PoolKey, List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]]
+    _limit: asyncio.Semaphore
+
+    def __init__(
+        self, max_connections: int = 8, timeout: Optional[float] = None
+    ) -> None:
+        """Prepare an empty pool, in the running event loop."""
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle = {}
+        self._limit = asyncio.Semaphore(max_connections)
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """Make a request, returning the status, headers and body.
+
+        Waits at most ``timeout`` seconds for each attempt, raising
+        ``asyncio.TimeoutError``. Failed requests on reused connections are retried
+        like ``ConnectionPool.request``.
+        """
+        parsed = urllib.parse.urlsplit(url)
+        key: PoolKey = (parsed.scheme, parsed.hostname or "localhost", parsed.port)
+        path = urllib.parse.urlunsplit(("", "", parsed.path or "/", parsed.query, ""))
+        message = encode_request(method, parsed.netloc, path, body, headers or {})
+
+        async with self._limit:
+            for attempt in range(2):
+                (reader, writer), reused = await self._acquire(key)
+                sent = False
+                try:
+                    writer.write(message)
+                    await writer.drain()
+                    sent = True
+                    status, response_headers, data, will_close = await asyncio.wait_for(
+                        read_response(reader, method), self.timeout
+                    )
+                except (http.client.HTTPException, OSError, EOFError) as err:
+                    writer.close()
+                    if reused and attempt == 0 and can_retry(method, err, sent):
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if will_close:
+                    writer.close()
+                else:
+                    self._release(key, (reader, writer))
+                return status, response_headers, data
+
+        raise RuntimeError("unreachable")  # pragma: no cover
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for reader, writer in conns:
+                writer.close()
+
+    async def _acquire(
+        self, key: PoolKey
+    ) -> Tuple[Tuple[asyncio.StreamReader, asyncio.StreamWriter], bool]:
+        conns = self._idle.get(key)
+        while conns:
+            reader, writer = conns.pop()
+            if not (reader.at_eof() or writer.is_closing()):
+                return (reader, writer), True
+            writer.close()
+        scheme, host, port = key
+        https = scheme == "https"
+        connect = asyncio.open_connection(
+            host, port or (443 if https else 80), ssl=True if https else None
+        )
+        return await asyncio.wait_for(connect, self.timeout), False
+
+    def _release(
+        self, key: PoolKey, conn: Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+    ) -> None:
+        conns = self._idle.setdefault(key, [])
+        if len(conns) < self.max_connections:
+            conns.append(conn)
+            return
+        conn[1].close()
+
+
+def encode_request(
+    method: str, host: str, path: str, body: Optional[bytes], headers: Dict[str, str]
+) -> bytes:
+    """Encode an HTTP/1.1 request."""
+    lines = [f"{method} {path} HTTP/1.1", f"Host: {host}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    if body is not None:
+        lines += [f"Content-Length: {len(body)}"]
+    return "\r\n".join([*lines, "", ""]).encode("latin-1") + (body or b"")
+
+
+async def read_response(
+    reader: asyncio.StreamReader, method: str
+) -> Tuple[int, Dict[str, str], bytes, bool]:
+    """Read an HTTP/1.1 response: its status, headers, body and whether it closes."""
+    line = await reader.readline()
+    if not line:
+        raise http.client.RemoteDisconnected("closed without a response")
+    version, _, rest = line.decode("latin-1").partition(" ")
+    try:
+        status = int(rest[:3])
+    except ValueError:
+        raise http.client.BadStatusLine(line.decode("latin-1"))
+
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    connection = headers.get("connection", "").lower()
+    will_close = connection == "close" or (
+        version == "HTTP/1.0" and connection != "keep-alive"
+    )
+    if method == "HEAD" or status in (204, 304) or status < 200:
+        body = b""
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            chunk = await reader.readexactly(size + 2)
+            if not size:
+                break
+            chunks += [chunk[:-2]]
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body, will_close = await reader.read(), True
+    return status, headers, body, will_close
+
+
+class BaseClient:
+    """The URL and token of a server, shared by its synchronous and async clients."""
+
+    url: str
+    token: str
+
+    def __init__(self, url: str, token: str = "") -> None:
+        """Prepare a client for a server."""
+        self.url = url
+        self.token = token
+
+    def api_url(self, *bits: str, query: Optional[Dict[str, str]] = None) -> str:
+        """Get the URL of a jyg API endpoint.
+
+        The token is sent as an ``Authorization`` header, rather than in the URL.
+        """
+        path = "/".join(
+            [
+                self.url.rstrip("/"),
+                "jyg",
+                *(urllib.parse.quote(b, safe=":/@") for b in bits),
+            ]
+        )
+        return f"{path}?{urllib.parse.urlencode(query)}" if query else path
+
+    def auth_headers(self) -> Dict[str, str]:
+        """Get the headers which authenticate a request, if there is a token."""
+        return {"Authorization": f"token {self.token}"} if self.token else {}
+
+
+class Client(BaseClient):
+    """A synchronous client for the jyg REST API of one server."""
+
+    pool: ConnectionPool
+
+    def __init__(
+        self, url: str, token: str = "", pool: Optional[ConnectionPool] = None
+    ) -> None:
+        """Prepare a client, by default sharing the process-wide connection pool."""
+        super().__init__(url, token)
+        self.pool = pool or get_default_pool()
+
+    def request(
+        self,
+        *bits: str,
+        method: str = "GET",
+        data: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        query: Optional[Dict[str, str]] = None,
+    ) -> Any:
+        """Make a request, and parse the JSON response.
+
+        Raises ``urllib.error.HTTPError`` for error statuses, like ``urlopen``.
+        """
+        url = self.api_url(*bits, query=query)
+        status, response_headers, body = self.pool.request(
+            method, url, body=data, headers={**self.auth_headers(), **(headers or {})}
+        )
+        return parse_response(url, status, body)
+
+    def post_json(self, *bits: str, body: Any, **kwargs: Any) -> Any:
+        """POST a JSON body, and parse the JSON response."""
+        return self.request(
+            *bits,
+            method="POST",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json; charset=utf-8"},
+            **kwargs,
+        )
+
+    def list_apps(
+        self,
+        refresh: bool = False,
+        timeout: Optional[float] = None,
+        first: bool = False,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[M.AppInfo]:
+        """Get the info of all apps, including their commands, or only some fields."""
+        query = list_apps_query(refresh, timeout, first, fields)
+        return cast(List[M.AppInfo], self.request("commands", query=query)["apps"])
+
+    def search_commands(
+        self, query: str, match: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Find commands by id or label, like ``{id, label, score, apps}``."""
+        params = search_query(query, match, limit)
+        return cast(
+            List[Dict[str, Any]], self.request("commands", query=params)["commands"]
+        )
+
+    def get_command(self, command_id: str, app_id: str = "") -> M.CommandInfo:
+        """Get the info of one command.
+
+        Raises ``urllib.error.HTTPError`` if there is no such command.
+        """
+        query = {"app": app_id} if app_id else None
+        return cast(M.CommandInfo, self.request("commands", command_id, query=query))
+
+    def run(
+        self, command_id: str, args: Optional[Dict[str, Any]] = None, app_id: str = ""
+    ) -> M.RunBatchResult:
+        """Run a command, returning its ``content``, or an ``error``."""
+        query = {"app": app_id} if app_id else None
+        response = self.post_json("commands", command_id, body=args or {}, query=query)
+        return to_result(response["response"])
+
+    def run_many(
+        self,
+        items: Sequence[RunItem],
+        mode: M.RunBatchMode = C.SEQUENTIAL,
+        app_id: str = "",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> List[M.RunBatchResult]:
+        """Run many commands, in batches, returning a result for each, in order."""
+        results: List[M.RunBatchResult] = []
+        for batch in batched(items, batch_size):
+            results += self.run_batch(batch, mode, app_id)
+        return results
+
+    def run_batch(
+        self, items: Sequence[RunItem], mode: M.RunBatchMode, app_id: str = ""
+    ) -> List[M.RunBatchResult]:
+        """Run commands in one batch request to an app."""
+        query = {"app": app_id} if app_id else None
+        body = {"items": list(items), "mode": mode}
+        response = self.post_json("batch", body=body, query=query)
+        return to_results(response, items)
+
+
+class AsyncClient(BaseClient):
+    """An ``asyncio`` client for the jyg REST API of one server.
+
+    Requests reuse the keep-alive connections of an ``AsyncConnectionPool``, making at
+    most ``max_concurrency`` requests at once. The pool is replaced if the client is
+    used in another event loop, such as by a later ``asyncio.run``.
+    """
+
+    max_concurrency: int
+    timeout: Optional[float]
+
+    _pool: Optional[Tuple[asyncio.AbstractEventLoop, AsyncConnectionPool]]
+
+    def __init__(
+        self,
+        url: str,
+        token: str = "",
+        max_concurrency: int = 8,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """Prepare a client, waiting at most ``timeout`` seconds for each request."""
+        super().__init__(url, token)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._pool = None
+
+    async def __aenter__(self) -> "AsyncClient":
+        """Use the client in an ``async with`` block."""
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        """Close the client at the end of an ``async with`` block."""
+        self.close()
+
+    def close(self) -> None:
+        """Close the idle connections of the pool, if its event loop is still open."""
+        if self._pool is not None:
+            loop, pool = self._pool
+            self._pool = None
+            if not loop.is_closed():
+                pool.close()
+
+    async def request(
+        self,
+        *bits: str,
+        method: str = "GET",
+        data: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        query: Optional[Dict[str, str]] = None,
+    ) -> Any:
+        """Make a request, and parse the JSON response.
+
+        Raises ``urllib.error.HTTPError`` for error statuses, like ``Client``.
+        """
+        url = self.api_url(*bits, query=query)
+        status, response_headers, body = await self.pool().request(
+            method, url, body=data, headers={**self.auth_headers(), **(headers or {})}
+        )
+        return parse_response(url, status, body)
+
+    async def post_json(self, *bits: str, body: Any, **kwargs: Any) -> Any:
+        """POST a JSON body, and parse the JSON response."""
+        return await self.request(
+            *bits,
+            method="POST",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json; charset=utf-8"},
+            **kwargs,
+        )
+
+    def pool(self) -> AsyncConnectionPool:
+        """Get the connection pool for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._pool is None or self._pool[0] is not loop:
+            self.close()
+            self._pool = loop, AsyncConnectionPool(self.max_concurrency, self.timeout)
+        return self._pool[1]
+
+    async def list_apps(
+        self,
+        refresh: bool = False,
+        timeout: Optional[float] = None,
+        first: bool = False,
+        fields: Optional[Sequence[str]] = None,
+    ) -> List[M.AppInfo]:
+        """Get the info of all apps, including their commands, or only some fields."""
+        query = list_apps_query(refresh, timeout, first, fields)
+        response = await self.request("commands", query=query)
+        return cast(List[M.AppInfo], response["apps"])
+
+    async def search_commands(
+        self, query: str, match: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Find commands by id or label, like ``{id, label, score, apps}``."""
+        params = search_query(query, match, limit)
+        response = await self.request("commands", query=params)
+        return cast(List[Dict[str, Any]], response["commands"])
+
+    async def get_command(self, command_id: str, app_id: str = "") -> M.CommandInfo:
+        """Get the info of one command."""
+        query = {"app": app_id} if app_id else None
+        response = await self.request("commands", command_id, query=query)
+        return cast(M.CommandInfo, response)
+
+    async def run(
+        self, command_id: str, args: Optional[Dict[str, Any]] = None, app_id: str = ""
+    ) -> M.RunBatchResult:
+        """Run a command, returning its ``content``, or an ``error``."""
+        query = {"app": app_id} if app_id else None
+        response = await self.post_json(
+            "commands", command_id, body=args or {}, query=query
+        )
+        return to_result(response["response"])
+
+    async def run_many(
+        self,
+        items: Sequence[RunItem],
+        mode: M.RunBatchMode = C.SEQUENTIAL,
+        app_id: str = "",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> List[M.RunBatchResult]:
+        """Run many commands, in batches, returning a result for each, in order.
+
+        In ``concurrent`` mode, the batches are also sent concurrently.
+        """
+        requests = [
+            self.run_batch(batch, mode, app_id) for batch in batched(items, batch_size)
+        ]
+        if mode == C.CONCURRENT:
+            batches = await asyncio.gather(*requests)
+        else:
+            batches = [await request for request in requests]
+        return [result for batch in batches for result in batch]
+
+    async def run_batch(
+        self, items: Sequence[RunItem], mode: M.RunBatchMode, app_id: str = ""
+    ) -> List[M.RunBatchResult]:
+        """Run commands in one batch request to an app."""
+        query = {"app": app_id} if app_id else None
+        body = {"items": list(items), "mode": mode}
+        response = await self.post_json("batch", body=body, query=query)
+        return to_results(response, items)
+
+
+def parse_response(url: str, status: int, body: bytes) -> Any:
+    """Parse a JSON response, raising ``urllib.error.HTTPError`` for error statuses."""
+    if status >= 400:
+        raise HTTPError(
+            url,
+            status,
+            http.client.responses.get(status, ""),
+            http.client.HTTPMessage(),
+            BytesIO(body),
+        )
+    return json.loads(body.decode("utf-8"))
+
+
+def list_apps_query(
+    refresh: bool = False,
+    timeout: Optional[float] = None,
+    first: bool = False,
+    fields: Optional[Sequence[str]] = None,
+) -> Dict[str, str]:
+    """Get the query to list apps."""
+    query: Dict[str, str] = {}
+    if refresh:
+        query["refresh"] = "1"
+    if timeout is not None:
+        query["timeout"] = str(timeout)
+    if first:
+        query["first"] = "1"
+    if fields is not None:
+        query["fields"] = ",".join(fields)
+    return query
+
+
+def search_query(
+    query: str, match: Optional[str] = None, limit: Optional[int] = None
+) -> Dict[str, str]:
+    """Get the query to search commands."""
+    params: Dict[str, str] = {"q": query}
+    if match is not None:
+        params["match"] = match
+    if limit is not None:
+        params["limit"] = str(limit)
+    return params
+
+
+def to_result(response: Any) -> M.RunBatchResult:
+    """Get the result of running a command from the server's ``response``."""
+    if isinstance(response, dict) and [*response] == ["error"]:
+        return {"error": response["error"]}
+    return {"content": response}
+
+
+def to_results(response: Any, items: Sequence[RunItem]) -> List[M.RunBatchResult]:
+    """Get the results of a batch, or its error for every item if it failed."""
+    if "error" in response:
+        return [{"error": response["error"]} for item in items]
+    return cast(List[M.RunBatchResult], response["responses"])
+
+
+def batched(items: Sequence[RunItem], size: int) -> List[Sequence[RunItem]]:
+    """Split items into batches of at most ``size``."""
+    return [items[i : i + size] for i in range(0, len(items), max(1, size))]
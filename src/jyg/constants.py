@@ -4,3 +4,52 @@ from .schema import msg_v0 as M
 
 APP_INFO: M.MessageTypeAppInfo = "app_info"
 RUN: M.MessageTypeRun = "run"
+RUN_BATCH: M.MessageTypeRunBatch = "run_batch"
+COMMAND_INFO: M.MessageTypeCommandInfo = "command_info"
+
+SEQUENTIAL: M.RunBatchMode = "sequential"
+CONCURRENT: M.RunBatchMode = "concurrent"
+RUN_BATCH_MODES = (SEQUENTIAL, CONCURRENT)
+
+APP_INFO_CHANGED: M.MessageTypeAppInfoChanged = "app_info_changed"
+COMMANDS_CHANGED: M.MessageTypeCommandsChanged = "commands_changed"
+
+#: the fields of command info, which may be requested with ``fields``
+COMMAND_INFO_FIELDS = (
+    "caption",
+    "className",
+    "dataset",
+    "icon",
+    "iconClass",
+    "iconLabel",
+    "isEnabled",
+    "isToggleable",
+    "isToggled",
+    "isVisible",
+    "label",
+    "mnemonic",
+    "usage",
+)
+
+#: message types which an app may send without being asked
+EVENTS = (APP_INFO_CHANGED, COMMANDS_CHANGED)
+
+#: WebSocket subprotocols, in the order the server prefers them
+MSGPACK_SUBPROTOCOL = "jyg.v0.msgpack"
+JSON_SUBPROTOCOL = "jyg.v0.json"
+SUBPROTOCOLS = (MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL)
+
+#: icons are addressed by the hash of their content, so may be kept for a year
+ICON_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+#: app info may be kept, but must be revalidated with its ``ETag`` before each use
+APP_INFO_CACHE_CONTROL = "private, no-cache"
+
+#: ways to match a command search query: by id or word prefix, glob, or fuzzily
+PREFIX = "prefix"
+GLOB = "glob"
+FUZZY = "fuzzy"
+SEARCH_MATCHES = (PREFIX, GLOB, FUZZY)
+
+#: the most command search results to return, by default
+SEARCH_LIMIT = 50
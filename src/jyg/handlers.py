@@ -1,6 +1,19 @@
 """Tornado handlers for jyg."""
 import asyncio
-from typing import TYPE_CHECKING, Any, Dict, cast
+import time
+from datetime import datetime, timezone
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 from uuid import uuid4
 
 from jupyter_server.base.handlers import APIHandler, JupyterHandler
@@ -8,16 +21,29 @@ from jupyter_server.base.zmqhandlers import WebSocketHandler, WebSocketMixin
 from jupyter_server.serverapp import ServerApp
 from jupyter_server.utils import url_path_join as ujoin
 from tornado.escape import json_decode
-from tornado.web import authenticated
+from tornado.web import HTTPError, authenticated
+from tornado.websocket import WebSocketClosedError
 
+from . import constants as C
+from .messages import (
+    RawJSON,
+    decode_message,
+    encode_message,
+    hash_json,
+    select_subprotocol,
+)
+from .registry import CONNECT_FIELDS
 from .schema import msg_v0 as M
 
 if TYPE_CHECKING:  # pragma: no cover
     from .manager import CommandManager
 
+#: query argument values which are considered ``False``
+FALSY = ("0", "false", "no", "off")
 
-class CommandListHandler(APIHandler):
-    """List commands."""
+
+class _BaseAPIHandler(APIHandler):
+    """A base for jyg REST API handlers."""
 
     command_manager: "CommandManager"
 
@@ -28,47 +54,232 @@ class CommandListHandler(APIHandler):
         self.command_manager = command_manager
         super().initialize(*args, **kwargs)
 
+    def get_bool_argument(self, name: str, default: bool = False) -> bool:
+        """Get a query argument like ``?refresh``, ``?refresh=1`` or ``?refresh=true``."""
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        return value.lower() not in FALSY
+
+    def get_float_argument(self, name: str) -> Optional[float]:
+        """Get a query argument like ``?timeout=0.5``."""
+        value = self.get_argument(name, None)
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            raise HTTPError(400, f"expected a number for {name}, not {value}")
+
+    def get_count_argument(self, name: str) -> Optional[int]:
+        """Get a query argument like ``?limit=10``, which can't be negative."""
+        value = self.get_argument(name, None)
+        if value is None:
+            return None
+        if not (value.isascii() and value.isdigit()):
+            raise HTTPError(400, f"expected a whole number for {name}, not {value}")
+        return int(value)
+
+    def get_fields_argument(self) -> Optional[Set[str]]:
+        """Get the command info fields to return, like ``?fields=label,caption``."""
+        value = self.get_argument("fields", None)
+        if value is None:
+            return None
+        fields = {field.strip() for field in value.split(",") if field.strip()}
+        unknown = sorted(fields - set(C.COMMAND_INFO_FIELDS))
+        if unknown:
+            raise HTTPError(
+                400, f"unknown fields {unknown}, not in {C.COMMAND_INFO_FIELDS}"
+            )
+        return fields
+
+    def finish_error(self, result: Mapping[str, Any], status: int = 502) -> None:
+        """Finish with an ``{"error": ...}``, with its ``status``, or a default."""
+        self.set_status(result.get("status") or status)
+        self.finish({"error": result["error"]})
+
+    def not_modified(self, etag: str, modified: Optional[float] = None) -> bool:
+        """Set the ``ETag`` and ``Last-Modified`` of a response.
+
+        If the client already has this version, finish with ``304``, and return
+        ``True``.
+        """
+        self.set_header("Cache-Control", C.APP_INFO_CACHE_CONTROL)
+        self.set_header("Etag", f'"{etag}"')
+        if modified:
+            self.set_header(
+                "Last-Modified", datetime.fromtimestamp(modified, timezone.utc)
+            )
+        if not self.check_etag_header():
+            return False
+        self.set_status(304)
+        self.finish()
+        return True
+
+
+class CommandListHandler(_BaseAPIHandler):
+    """List commands."""
+
     @authenticated
     async def get(self) -> None:
-        """Get the information about running/known apps."""
-        apps = await self.command_manager.get_apps()
-        self.write({"apps": apps})
-
+        """Get the information about running/known apps, or search their commands."""
+        refresh = self.get_bool_argument("refresh")
+        query = self.get_argument("q", None)
+        if query is not None:
+            await self.search(query, refresh)
+            return
+        timeout = self.get_float_argument("timeout")
+        first = self.get_bool_argument("first")
+        fields = self.get_fields_argument()
+        if timeout is None and not first:
+            apps = await self.command_manager.get_apps(refresh=refresh, fields=fields)
+            version: Optional[Tuple[str, Optional[float]]]
+            if fields is None:
+                version = self.command_manager.get_apps_version()
+            else:
+                # some fields may come straight from the apps, so hash what was found
+                version = hash_json(apps), None
+            if version is not None and self.not_modified(*version):
+                return
+            self.write({"apps": apps})
+            return
+        apps, timed_out = await self.command_manager.get_apps_within(
+            timeout=timeout, first=first, refresh=refresh, fields=fields
+        )
+        self.write({"apps": apps, "timed_out": timed_out})
 
-class CommandHandler(APIHandler):
-    """Handle request for a single command."""
+    async def search(self, query: str, refresh: bool) -> None:
+        """Find commands by id or label, like ``?q=open&match=fuzzy&limit=10``."""
+        match = self.get_argument("match", None)
+        if match is not None and match not in C.SEARCH_MATCHES:
+            raise HTTPError(400, f"expected a match in {C.SEARCH_MATCHES}")
+        limit = self.get_count_argument("limit")
+        commands = await self.command_manager.search_commands(
+            query,
+            match=match,
+            limit=C.SEARCH_LIMIT if limit is None else limit,
+            refresh=refresh,
+        )
+        if self.not_modified(hash_json(commands)):
+            return
+        self.write({"commands": commands})
 
-    command_manager: "CommandManager"
 
-    def initialize(
-        self, command_manager: "CommandManager", *args: Any, **kwargs: Any
-    ) -> None:
-        """Prepare the handler."""
-        self.command_manager = command_manager
-        super().initialize(*args, **kwargs)
+class CommandHandler(_BaseAPIHandler):
+    """Handle request for a single command."""
 
     @authenticated
     async def get(self, command_id: str) -> None:
         """Get the information about a single command."""
-        apps = await self.command_manager.get_apps()
-        # TODO: handle multiple apps
-        if not apps:
-            self.set_status(404)
-            self.write({"error": "no apps found"})
+        refresh = self.get_bool_argument("refresh")
+        fields = self.get_fields_argument()
+        app_id = self.get_argument("app", None)
+        command = await self.command_manager.get_command_info(
+            command_id, app_id=app_id, refresh=refresh, fields=fields
+        )
+        if command is None:
+            self.finish_error({"error": "command not found"}, 404)
             return
-        app = apps[0]
-        if command_id not in app["commands"]:
-            self.set_status(404)
-            self.write({"error": "command not found"})
+        if "error" in command:
+            self.finish_error(command)
             return
-        self.write(app["commands"][command_id])
+        if self.not_modified(hash_json(command)):
+            return
+        self.write(command)
 
     @authenticated
     async def post(self, command_id: str) -> None:
         """Run a single command."""
         args = json_decode(self.request.body)
-        result = await self.command_manager.run(command_id, args)
-        self.write({"response": result})
+        app_id = self.get_argument("app", None)
+        result = await self.command_manager.run(
+            command_id, args, app_id=app_id, raw=True
+        )
+        if "status" in result:
+            self.finish_error(result)
+            return
+        if "error" in result:
+            self.write({"response": {"error": result["error"]}})
+            return
+        content = result.get("content")
+        if isinstance(content, RawJSON):
+            # splice the app's JSON, checked to be one value, into the response
+            self.set_header("Content-Type", "application/json; charset=UTF-8")
+            self.finish(f'{{"response": {content}}}')
+            return
+        self.write({"response": content})
+
+
+class BatchHandler(_BaseAPIHandler):
+    """Handle requests for many commands."""
+
+    @authenticated
+    async def post(self) -> None:
+        """Run many commands in one request to an app."""
+        body = json_decode(self.request.body)
+        items = body.get("items") if isinstance(body, dict) else None
+        mode = body.get("mode", C.SEQUENTIAL) if isinstance(body, dict) else None
+
+        if not isinstance(items, list) or not all(
+            isinstance(item, dict) and isinstance(item.get("id"), str) for item in items
+        ):
+            raise HTTPError(400, "expected a list of items like {id, args}")
+        if mode not in C.RUN_BATCH_MODES:
+            raise HTTPError(400, f"expected a mode in {C.RUN_BATCH_MODES}")
+
+        app_id = self.get_argument("app", None)
+        result = await self.command_manager.run_batch(items, mode, app_id=app_id)
+        if isinstance(result, dict) and "status" in result:
+            self.finish_error(result)
+        elif isinstance(result, dict):
+            self.write({"error": result["error"]})
+        else:
+            self.write({"responses": result})
+
+
+class AppsHandler(_BaseAPIHandler):
+    """List connected apps, without their commands."""
+
+    @authenticated
+    async def get(self) -> None:
+        """Get the metadata of connected apps, optionally by ``url`` or ``plugin``."""
+        registry = self.command_manager.registry
+        url = self.get_argument("url", None)
+        plugin = self.get_argument("plugin", None)
+        records = tuple(registry) if url is None else registry.by_url(url)
+        if plugin is not None:
+            with_plugin = {record.app_id for record in registry.by_plugin(plugin)}
+            records = tuple(r for r in records if r.app_id in with_plugin)
+        self.write({"apps": [record.to_json() for record in records]})
+
+
+class IconHandler(_BaseAPIHandler):
+    """Serve the SVG icons of commands, which never change for a given hash."""
+
+    @authenticated
+    async def get(self, icon_hash: str) -> None:
+        """Get an SVG icon by the hash of its content."""
+        svgstr = self.command_manager.get_icon(icon_hash)
+        if svgstr is None:
+            self.set_status(404)
+            self.write({"error": "icon not found"})
+            return
+        self.set_header("Cache-Control", C.ICON_CACHE_CONTROL)
+        self.finish(svgstr, set_content_type="image/svg+xml")
+
+    def compute_etag(self) -> Optional[str]:
+        """Use the hash of the icon, rather than hashing it again."""
+        icon_hash = self.path_kwargs.get("icon_hash")
+        return f'"{icon_hash}"' if self.get_status() == 200 and icon_hash else None
+
+
+class StatsHandler(_BaseAPIHandler):
+    """Report statistics."""
+
+    @authenticated
+    async def get(self) -> None:
+        """Get the statistics of the command manager."""
+        self.write({"stats": self.command_manager.get_stats()})
 
 
 class CommandWebSocketHandler(WebSocketMixin, WebSocketHandler, JupyterHandler):  # type: ignore
@@ -78,55 +289,179 @@ class CommandWebSocketHandler(WebSocketMixin, WebSocketHandler, JupyterHandler):
 
     command_manager: "CommandManager"
 
+    #: a stable id for the app, preferably provided by the app
+    app_id: str
+
+    #: the ``time.monotonic`` of the last message from the app
+    last_response: float
+
+    #: the ``time.monotonic`` of the last message or pong from the app
+    last_seen: float
+
+    #: the smoothed round trip time of pings to the app, in seconds
+    rtt: Optional[float]
+
+    #: the subprotocol chosen for encoding messages, if any
+    subprotocol: Optional[str]
+
     def initialize(
         self, command_manager: "CommandManager", *args: Any, **kwargs: Any
     ) -> None:
         """Prepare the handler."""
         self._responses = {}
         self.command_manager = command_manager
+        self.app_id = ""
+        self.last_response = self.last_seen = time.monotonic()
+        self.rtt = None
+        self.subprotocol = None
         if hasattr(super(), "initialize"):
             super().initialize(*args, **kwargs)
 
+    @property
+    def outstanding(self) -> int:
+        """Get the number of requests waiting for a response."""
+        return len(self._responses)
+
+    def select_subprotocol(self, subprotocols: List[str]) -> Optional[str]:
+        """Choose how to encode messages, from the subprotocols offered by the app."""
+        return select_subprotocol(subprotocols)
+
     @authenticated
     def open(self, *args: str, **kwargs: str) -> None:
         """Handle a new websocket."""
         super().open(*args, **kwargs)
-        self.command_manager.subscribe(self)
+        self.subprotocol = self.selected_subprotocol
+        app_id = self.get_argument("app_id", "") or str(uuid4())
+        if self.command_manager.get_handler(app_id) is not None:
+            # a duplicated browser tab may reuse an id
+            app_id = f"{app_id}-{uuid4().hex[:8]}"
+        self.app_id = app_id
+        metadata = {field: self.get_argument(field, "") for field in CONNECT_FIELDS}
+        self.command_manager.subscribe(self, **metadata)
 
     async def on_message(self, raw_message: Any) -> None:
         """Handle a WebSocket message from the client."""
-        message: M.AnyResponse = json_decode(raw_message)
+        self.last_response = self.last_seen = time.monotonic()
+        message: Any
+        message, is_raw = decode_message(raw_message, self.subprotocol)
+        if message.get("request_type") in C.EVENTS:
+            if is_raw:
+                message["content"] = message["content"].decode()
+            self.command_manager.on_event(self, cast(M.AnyEvent, message))
+            return
         request_id = message["request_id"]
-        request = self._responses.pop(request_id)
+        request = self._responses.pop(request_id, None)
+        if request is None or request.done():
+            self.log.debug("ignoring late response %s", request_id)
+            return
         request.set_result(message)
 
     def on_close(self) -> None:
-        """Handle the WebSocket closing."""
+        """Handle the WebSocket closing, failing any outstanding requests."""
         self.command_manager.unsubscribe(self)
+        self.fail_outstanding(f"app {self.app_id} closed")
+
+    def fail_outstanding(self, error: str) -> None:
+        """Resolve all outstanding requests with an error."""
+        responses, self._responses = self._responses, {}
+        for request_id, request in responses.items():
+            if not request.done():
+                response = {"request_id": request_id, "error": error, "status": 502}
+                request.set_result(cast(M.ErrorResponse, response))
+
+    @property
+    def ping_interval(self) -> float:
+        """Turn off the pings of ``WebSocketMixin``: the manager's heartbeat pings."""
+        return 0
+
+    def send_heartbeat(self) -> None:
+        """Send a ping with the current time, to measure the round trip time."""
+        try:
+            self.ping(repr(time.monotonic()).encode("utf-8"))
+        except WebSocketClosedError:
+            pass
+
+    def on_pong(self, data: bytes) -> None:
+        """Handle a pong, updating the round trip time if it was a heartbeat."""
+        super().on_pong(data)
+        self.last_seen = now = time.monotonic()
+        try:
+            sample = now - float(data.decode("utf-8"))
+        except ValueError:
+            return
+        self.rtt = sample if self.rtt is None else (0.75 * self.rtt + 0.25 * sample)
+
+    def evict(self) -> None:
+        """Stop waiting on an unresponsive app, and close its WebSocket."""
+        self.fail_outstanding(f"app {self.app_id} stopped responding")
+        self.close()
 
     async def jyg_request(
-        self, request_type: M.AnyMessageType, content: M.AnyContent = None
-    ) -> Any:
-        """Make a jyg request and wait for the response."""
+        self,
+        request_type: M.AnyMessageType,
+        content: Union[
+            M.AnyContent, M.AppInfoRequestContent, M.CommandInfoRequestContent
+        ] = None,
+        timeout: Optional[float] = None,
+        raw: bool = False,
+    ) -> M.RunBatchResult:
+        """Make a jyg request and wait for the response.
+
+        Waits at most ``timeout`` seconds, or ``CommandManager.request_timeout``. With
+        ``raw``, the content may be returned as undecoded ``RawJSON``.
+
+        Returns the ``{"content": ...}`` of the response, or an ``{"error": ...}`` if
+        the app reported one, or with the ``status`` for the REST API if the app has
+        too many outstanding requests (``503``), doesn't answer in time (``504``), or
+        closes (``502``).
+        """
+        manager = self.command_manager
+        max_outstanding = manager.max_outstanding_requests
+        if max_outstanding and self.outstanding >= max_outstanding:
+            return {
+                "error": f"app {self.app_id} has {self.outstanding} outstanding requests",
+                "status": 503,
+            }
+
+        timeout = manager.request_timeout if timeout is None else timeout
         request_id = str(uuid4())
         request = dict(
             request_id=request_id,
             request_type=str(request_type),
             content=content or {},
         )
-        self._responses[request_id] = asyncio.Future()
-        self.write_message(request)
-        response = await self._responses[request_id]
+        future: "asyncio.Future[M.AnyResponse]" = asyncio.Future()
+        self._responses[request_id] = future
+        try:
+            encoded = encode_message(request, self.subprotocol)
+            self.write_message(encoded, binary=isinstance(encoded, bytes))
+            response = await asyncio.wait_for(future, timeout or None)
+        except WebSocketClosedError:
+            return {"error": f"app {self.app_id} closed", "status": 502}
+        except asyncio.TimeoutError:
+            return {
+                "error": f"app {self.app_id} timed out after {timeout}s",
+                "status": 504,
+            }
+        finally:
+            self._responses.pop(request_id, None)
         if "error" in response:
-            return {"error": cast(M.ErrorResponse, response)["error"]}
-        else:
-            return cast(M.AnyValidResponse, response)["content"]
+            error = cast(Dict[str, Any], response)
+            return cast(
+                M.RunBatchResult,
+                {key: error[key] for key in ("error", "status") if key in error},
+            )
+        result: Any = cast(M.AnyValidResponse, response)["content"]
+        if isinstance(result, RawJSON) and not raw:
+            return {"content": result.decode()}
+        return {"content": result}
 
 
 def add_handlers(nbapp: ServerApp, command_manager: "CommandManager") -> None:
     """Add Command routes to the notebook server web application."""
     jyg_url = ujoin(nbapp.base_url, "jyg")
     re_command = "(?P<command_id>.+)"
+    re_icon = "(?P<icon_hash>[0-9a-f]+)"
 
     opts = {"command_manager": command_manager}
 
@@ -135,6 +470,10 @@ def add_handlers(nbapp: ServerApp, command_manager: "CommandManager") -> None:
         [
             (ujoin(jyg_url, "commands"), CommandListHandler, opts),
             (ujoin(jyg_url, "commands", re_command), CommandHandler, opts),
+            (ujoin(jyg_url, "batch"), BatchHandler, opts),
+            (ujoin(jyg_url, "apps"), AppsHandler, opts),
+            (ujoin(jyg_url, "icons", re_icon), IconHandler, opts),
+            (ujoin(jyg_url, "stats"), StatsHandler, opts),
             (ujoin(jyg_url, "ws"), CommandWebSocketHandler, opts),
         ],
     )
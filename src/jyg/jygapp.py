@@ -1,16 +1,28 @@
-"""Command line apps for jyg."""
+"""Command line apps for jyg.
+
+Modules only needed by some subcommands are imported when used, to keep the CLI
+quick to start.
+"""
 import json
-import urllib.request
-from typing import Any, Dict, List, Optional, cast
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, cast
 
-import jinja2 as J
 import traitlets as T
 from jupyter_core.application import JupyterApp
 
 from ._version import __version__
-from .schema import msg_v0 as M
 from .utils import parse_command_args
 
+if TYPE_CHECKING:  # pragma: no cover
+    from concurrent.futures import Future
+
+    from .client import Client
+    from .schema import msg_v0 as M
+
 
 class _BaseApp(JupyterApp):
     """A base app for jyg."""
@@ -25,8 +37,24 @@ class _APIApp(_BaseApp):
     """An app that uses the jyg REST API."""
 
     running_servers: List[Dict[str, Any]] = T.List().tag(config=False)
+    url: str = T.Unicode(
+        help="the URL of a jupyter server, instead of finding running local servers"
+    ).tag(config=True)
+    token: str = T.Unicode(help="the token of the server at url").tag(config=True)
+    servers: List[Dict[str, str]] = T.List(
+        T.Dict(),
+        help="jupyter servers, each with a url and token, instead of finding local ones",
+    ).tag(config=True)
+    client: "Client" = T.Instance("jyg.client.Client").tag(config=False)
     mimetype: Any = T.Unicode("text/plain").tag(config=True)
     mime_templates: Any = T.Dict().tag(config=True)
+    servers_mime_templates: Any = T.Dict().tag(config=True)
+    all_servers: bool = T.Bool(False, help="make requests to all running servers").tag(
+        config=True
+    )
+    deadline: float = T.Float(
+        10, help="seconds to wait for all servers to answer, with all_servers"
+    ).tag(config=True)
 
     flags = {
         **_BaseApp.flags,
@@ -34,10 +62,17 @@ class _APIApp(_BaseApp):
             {"_AsyncApp": {"mimetype": "application/json"}},
             "output json",
         ),
+        "all-servers": (
+            {"_APIApp": {"all_servers": True}},
+            "make requests to all running servers at once",
+        ),
     }
     aliases = {
         **_BaseApp.aliases,
         "mime": "_AsyncApp.mimetype",
+        "deadline": "_APIApp.deadline",
+        "url": "_APIApp.url",
+        "token": "_APIApp.token",
     }
 
     @T.default("mime_templates")
@@ -48,28 +83,108 @@ class _APIApp(_BaseApp):
             "application/json": "{{ dumps(report, sort_keys=True)  }}",
         }
 
+    @T.default("servers_mime_templates")
+    def _default_servers_mime_templates(self) -> Dict[str, str]:
+        """Build output template patterns for the reports of all servers."""
+        return {
+            "text/plain": """
+            {%- for server in report.servers -%}
+                {{ "\n\n" if not loop.first }}# {{ server.url }}{{ "\n" -}}
+                {%- if server.error %}ERROR: {{ server.error }}
+                {%- else %}{{ render(server.report) | trim }}{% endif -%}
+            {%- endfor -%}
+            """,
+            "application/json": "{{ dumps(report, sort_keys=True)  }}",
+        }
+
     def start(self) -> None:
         """Start the request activities."""
-        report = self.report_json()
-
         if self.mimetype not in self.mime_templates:  # pragma: no cover
             raise NotImplementedError(self.mimetype)
 
-        tmpl = J.Template(self.mime_templates[self.mimetype])
-        # TODO: async?
-        result = tmpl.render(report=report, _=self, dumps=json.dumps)
+        import jinja2
+
+        tmpl = jinja2.Template(self.mime_templates[self.mimetype])
+
+        def render(report: Any) -> str:
+            return str(tmpl.render(report=report, _=self, dumps=json.dumps))
+
+        if self.all_servers:
+            servers_tmpl = jinja2.Template(self.servers_mime_templates[self.mimetype])
+            result = servers_tmpl.render(
+                report=self.report_all_servers(),
+                _=self,
+                dumps=json.dumps,
+                render=render,
+            )
+        else:
+            result = render(self.report_json())
         print(result)
 
-    def report_json(self) -> Any:
+    def report_json(self, client: Optional["Client"] = None) -> Any:
         raise NotImplementedError()
 
+    def report_all_servers(self) -> Dict[str, Any]:
+        """Make the request to all running servers at once, within the deadline.
+
+        Each server's ``report``, or ``error``, is labelled with its ``url``, in the
+        order the servers were found. Servers which don't answer in time are reported
+        with an error, and left to finish in the background.
+        """
+        from .client import Client, ConnectionPool
+
+        pool = ConnectionPool(timeout=self.deadline)
+        deadline = time.monotonic() + self.deadline
+        results: Dict[int, Dict[str, Any]] = {}
+
+        def report(index: int, client: Client) -> None:
+            try:
+                results[index] = {"report": self.report_json(client)}
+            except Exception as err:
+                results[index] = {"error": f"{type(err).__name__}: {err}"}
+
+        threads = []
+        for index, server in enumerate(self.running_servers):
+            client = Client(server["url"], server["token"], pool=pool)
+            thread = threading.Thread(target=report, args=(index, client), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+        timeout = {"error": f"no answer within {self.deadline}s"}
+        return {
+            "servers": [
+                {"url": server["url"], **results.get(index, timeout)}
+                for index, server in enumerate(self.running_servers)
+            ]
+        }
+
+    @T.default("token")
+    def _default_token(self) -> str:
+        return os.environ.get("JYG_TOKEN", "")
+
     @T.default("running_servers")
     def _default_running_servers(self) -> List[Dict[str, Any]]:
-        """Get running jupyter servers.
+        """Get the configured remote servers, or running local jupyter servers.
 
-        Try to use the jupyter_server implementation if available.
+        Read the server info files directly, which finds both ``jupyter_server`` and
+        ``notebook`` servers, and only try their (slow to import) implementations
+        if none are found.
         """
-        running_servers: List[Dict[str, Any]] = []
+        if self.url:
+            return [{"url": self.url, "token": self.token}]
+
+        if self.servers:
+            return [{"token": "", **server} for server in self.servers]
+
+        from .utils import fallback_list_running_servers
+
+        running_servers: List[Dict[str, Any]] = [*fallback_list_running_servers()]
+
+        if running_servers:
+            return running_servers
 
         try:
             from jupyter_server import serverapp
@@ -85,36 +200,99 @@ class _APIApp(_BaseApp):
         except:
             pass
 
-        if not running_servers:
-            from .utils import fallback_list_running_servers
-
-            running_servers += [*fallback_list_running_servers()]
-
         return running_servers
 
-    def jyg_url(self, *bits: str) -> str:
-        """Get the jyg API URL."""
-        from jupyter_server.utils import url_path_join as ujoin
+    @T.default("client")
+    def _default_client(self) -> "Client":
+        """Get a client for the first running server, sharing connections."""
+        from .client import Client
 
-        # TODO: handle multiple servers
         server = self.running_servers[0]
-        url = ujoin(server["url"], "jyg", *bits) + f"""?token={server["token"]}"""
-        return f"{url}"
+        return Client(server["url"], server["token"])
 
-    def jyg_request(self, *bits: str, **request_kwargs: Any) -> M.AnyResponse:
-        """Make a jyg request."""
-        url = self.jyg_url(*bits)
-        request = urllib.request.Request(url, **request_kwargs)
-        response = urllib.request.urlopen(request)
-        return cast(M.AnyResponse, json.load(response))
+    def jyg_url(self, *bits: str, query: Optional[Dict[str, str]] = None) -> str:
+        """Get the jyg API URL."""
+        return self.client.api_url(*bits, query=query)
+
+    def jyg_request(
+        self,
+        *bits: str,
+        query: Optional[Dict[str, str]] = None,
+        client: Optional["Client"] = None,
+        **request_kwargs: Any,
+    ) -> "M.AnyResponse":
+        """Make a jyg request, by default to the first running server."""
+        client = client or self.client
+        return cast(
+            "M.AnyResponse", client.request(*bits, query=query, **request_kwargs)
+        )
 
 
 class JygListApp(_APIApp):
     """List jupyter app commands."""
 
-    def report_json(self) -> Any:
-        """Fetch the app info from a running jupyter app."""
-        return self.jyg_request("commands")
+    refresh: bool = T.Bool(
+        False, help="ask the apps for fresh info, rather than the server cache"
+    ).tag(config=True)
+    timeout: float = T.Float(
+        0, help="seconds to wait for apps to answer: 0 waits for all apps"
+    ).tag(config=True)
+    first: bool = T.Bool(False, help="only wait for the first app to answer").tag(
+        config=True
+    )
+    fields: str = T.Unicode(
+        help=(
+            "comma-separated command info fields to get, like `label,caption`: "
+            "by default, `label` for text/plain, otherwise all fields"
+        )
+    ).tag(config=True)
+    search: str = T.Unicode(
+        help="only list the best commands matching a query, by id or label"
+    ).tag(config=True)
+    match: str = T.Unicode(
+        help="how to match the search query: prefix, glob or fuzzy, or by its content"
+    ).tag(config=True)
+
+    flags = {
+        **_APIApp.flags,
+        "refresh": (
+            {"JygListApp": {"refresh": True}},
+            "skip the server's cached app info",
+        ),
+        "first": (
+            {"JygListApp": {"first": True}},
+            "only wait for the first app to answer",
+        ),
+    }
+    aliases = {
+        **_APIApp.aliases,
+        "timeout": "JygListApp.timeout",
+        "fields": "JygListApp.fields",
+        "search": "JygListApp.search",
+        "match": "JygListApp.match",
+    }
+
+    @T.default("fields")
+    def _default_fields(self) -> str:
+        return "label" if self.mimetype == "text/plain" else ""
+
+    def report_json(self, client: Optional["Client"] = None) -> Any:
+        """Fetch the app info from a running jupyter app, or search its commands."""
+        query: Dict[str, str] = {}
+        if self.refresh:
+            query["refresh"] = "1"
+        if self.search:
+            query["q"] = self.search
+            if self.match:
+                query["match"] = self.match
+            return self.jyg_request("commands", query=query, client=client)
+        if self.timeout:
+            query["timeout"] = str(self.timeout)
+        if self.first:
+            query["first"] = "1"
+        if self.fields:
+            query["fields"] = self.fields
+        return self.jyg_request("commands", query=query, client=client)
 
     @T.default("mime_templates")
     def _default_mime_templates(self) -> Any:
@@ -123,6 +301,14 @@ class JygListApp(_APIApp):
         mime_templates.update(
             {
                 "text/plain": """
+            {%- if report.commands is defined -%}
+            {%- set max_len = report.commands | map(attribute="id")
+                | map("count") | max -%}
+            {%- for cmd in report.commands -%}
+               {{- "\n" if not loop.first }}{{ cmd.id }}
+               {{- (max_len - (cmd.id | count)) * " " }}\t{{ cmd.label }}
+            {%- endfor %}
+            {%- else -%}
             {%- set id_lens = [] %}
             {%- for id in report.apps[0].commands -%}
                 {{ id_lens.append(id | count) or "" }}{%- endfor -%}
@@ -130,6 +316,7 @@ class JygListApp(_APIApp):
             {%- for id, cmd in report.apps[0].commands.items() | sort -%}
                {{- "\n" + id }}{{ (max_len - (id | count)) * " " }}\t{{ cmd.label }}
             {%- endfor %}
+            {%- endif %}
             """,
             }
         )
@@ -141,6 +328,28 @@ class JygRunApp(_APIApp):
 
     command_id: str = T.Unicode(help="the command to run").tag(config=True)
     command_args: Dict[str, Any] = T.Dict().tag(config=False)
+    app_id: str = T.Unicode(
+        help="the id of the app to run the command, otherwise chosen by the server"
+    ).tag(config=True)
+    stdin: bool = T.Bool(
+        False, help="run newline-delimited JSON `{id, args}` commands from stdin"
+    ).tag(config=True)
+    window: int = T.Int(
+        8, min=1, help="the most commands from stdin to have in flight at once"
+    ).tag(config=True)
+
+    flags = {
+        **_APIApp.flags,
+        "stdin": (
+            {"JygRunApp": {"stdin": True}},
+            "run newline-delimited JSON commands from stdin",
+        ),
+    }
+    aliases = {
+        **_APIApp.aliases,
+        "app": "JygRunApp.app_id",
+        "window": "JygRunApp.window",
+    }
 
     def parse_command_line(self, argv: Optional[List[str]] = None) -> None:
         """Parse extra args as Jupyter command arguments."""
@@ -149,14 +358,58 @@ class JygRunApp(_APIApp):
             self.command_id = self.extra_args[0]
             self.command_args = parse_command_args(self.extra_args[1:])
 
-    def report_json(self) -> M.AnyResponse:
-        """Run a command."""
-        if not self.command_id:
+    def start(self) -> None:
+        """Run one command, or stream commands from stdin."""
+        if not (self.stdin or self.command_id):
             self.log.error("need a command id")
             self.exit(1)
+        if self.stdin:
+            self.run_stdin()
+        else:
+            super().start()
+
+    def run_stdin(self) -> None:
+        """Run commands from stdin, writing one JSON result line per command.
+
+        Results are written as they arrive, which may not be the order of the input,
+        so each has the ``line`` of its command.
+        """
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        from .client import Client, ConnectionPool
+        from .session import Session
+
+        client = Client(
+            self.client.url, self.client.token, pool=ConnectionPool(self.window)
+        )
+        session = Session(client)
+        pending: Set["Future[Dict[str, Any]]"] = set()
+        with ThreadPoolExecutor(self.window) as executor:
+            for line, text in enumerate(sys.stdin, 1):
+                if not text.strip():
+                    continue
+                if len(pending) >= self.window:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.write_results(done)
+                pending.add(executor.submit(session.run_line, line, text, self.app_id))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                self.write_results(done)
+        client.pool.close()
+
+    def write_results(self, done: Set["Future[Dict[str, Any]]"]) -> None:
+        """Write the results of finished commands, in the order of their lines."""
+        for result in sorted((f.result() for f in done), key=lambda r: r["line"]):
+            print(json.dumps(result, sort_keys=True), flush=True)
+
+    def report_json(self, client: Optional["Client"] = None) -> "M.AnyResponse":
+        """Run a command."""
         bits = "commands", self.command_id
+        query = {"app": self.app_id} if self.app_id else None
         return self.jyg_request(
             *bits,
+            query=query,
+            client=client,
             method="POST",
             headers={"Content-Type": "application/json; charset=utf-8"},
             data=json.dumps(self.command_args).encode("utf-8"),
@@ -177,6 +430,67 @@ class JygRunApp(_APIApp):
         return mime_templates
 
 
+class JygShellApp(_APIApp):
+    """Run jupyter app commands in an interactive shell."""
+
+    def start(self) -> None:
+        """Run the shell until it is quit."""
+        from .session import Session, SessionShell
+
+        SessionShell(Session(self.client)).cmdloop()
+
+
+class JygDaemonApp(_APIApp):
+    """Run jupyter app commands sent as lines of JSON to a local socket."""
+
+    socket_path: str = T.Unicode(
+        help="the socket file to listen on, defaulting to one in the runtime dir"
+    ).tag(config=True)
+    port: int = T.Int(
+        0, help="the local TCP port to listen on, where socket files are unavailable"
+    ).tag(config=True)
+    token_path: str = T.Unicode(
+        help="the file for the token TCP clients must send first, only owner-readable"
+    ).tag(config=True)
+
+    aliases = {
+        **_APIApp.aliases,
+        "socket": "JygDaemonApp.socket_path",
+        "port": "JygDaemonApp.port",
+        "token-path": "JygDaemonApp.token_path",
+    }
+
+    @T.default("socket_path")
+    def _default_socket_path(self) -> str:
+        return str(Path(self.runtime_dir) / "jyg-daemon.sock")
+
+    @T.default("token_path")
+    def _default_token_path(self) -> str:
+        return str(Path(self.runtime_dir) / "jyg-daemon.token")
+
+    def start(self) -> None:
+        """Serve until interrupted."""
+        from .session import Session, make_server, write_token
+
+        path = None if self.port else Path(self.socket_path)
+        server = make_server(Session(self.client), path, self.port)
+        token_path = Path(self.token_path)
+        if server.token:
+            write_token(token_path, server.token)
+            self.log.info("jyg daemon token written to %s", token_path)
+        self.log.info("jyg daemon listening on %s", server.server_address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:  # pragma: no cover
+            pass
+        finally:
+            server.server_close()
+            if isinstance(server.server_address, str):
+                Path(server.server_address).unlink(missing_ok=True)
+            if server.token:
+                token_path.unlink(missing_ok=True)
+
+
 class JygApp(_BaseApp):
     """Work with jupyter apps from the command line."""
 
@@ -188,7 +502,13 @@ class JygApp(_BaseApp):
             .strip(),
         )
         for k, v in dict(
-            list=JygListApp, ls=JygListApp, l=JygListApp, run=JygRunApp, r=JygRunApp
+            list=JygListApp,
+            ls=JygListApp,
+            l=JygListApp,
+            run=JygRunApp,
+            r=JygRunApp,
+            shell=JygShellApp,
+            daemon=JygDaemonApp,
         ).items()
     }
 
@@ -1,6 +1,19 @@
 """Manage the remote Jupyter App commands."""
 import asyncio
-from typing import TYPE_CHECKING, Any, Tuple
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
 
 import traitlets as T
 from traitlets.config import LoggingConfigurable
@@ -9,38 +22,614 @@ if TYPE_CHECKING:  # pragma: no cover
     from .handlers import CommandWebSocketHandler
 
 from . import constants as C
+from .messages import hash_icon, hash_json
+from .registry import AppRegistry
+from .routing import ROUTERS, Router
+from .schema import msg_v0 as M
+from .search import CommandIndex
+
+
+def project_command_info(info: Any, fields: Set[str]) -> Any:
+    """Copy command info, keeping only some fields."""
+    return {field: value for field, value in info.items() if field in fields}
+
+
+def project_app_info(app_info: Any, fields: Set[str]) -> Any:
+    """Copy app info, keeping only some fields of each command."""
+    if "error" in app_info:
+        return app_info
+    commands = {
+        command_id: project_command_info(info, fields)
+        for command_id, info in app_info.get("commands", {}).items()
+    }
+    return {**app_info, "commands": commands}
 
 
 class CommandManager(LoggingConfigurable):
     """A manager for remote Jupyter App commands."""
 
-    handlers: Tuple["CommandWebSocketHandler", ...] = T.Tuple().tag(config=False)
+    registry: AppRegistry = T.Instance(AppRegistry)
+
+    app_info_max_age: float = T.Float(
+        300.0,
+        help=(
+            "seconds to serve a cached app info before asking the app again: "
+            "apps also invalidate the cache when their commands change. "
+            "0 disables the cache"
+        ),
+    ).tag(config=True)
+
+    request_timeout: float = T.Float(
+        60.0,
+        help="seconds to wait for an app to respond to a request: 0 waits forever",
+    ).tag(config=True)
+
+    max_outstanding_requests: int = T.Int(
+        100,
+        help=(
+            "requests an app may have outstanding before new requests fail fast "
+            "with 503: 0 allows any number"
+        ),
+    ).tag(config=True)
+
+    heartbeat_interval: float = T.Float(
+        10.0, help="seconds between pings to each app: 0 disables the heartbeat"
+    ).tag(config=True)
+
+    heartbeat_timeout: float = T.Float(
+        30.0,
+        help="seconds without a message or pong before an app is unsubscribed",
+    ).tag(config=True)
+
+    router: str = T.Unicode(
+        "least-outstanding",
+        help="the name of the routing policy for requests which don't name an app",
+    ).tag(config=True)
+
+    routers: Dict[str, Type[Router]] = T.Dict(
+        value_trait=T.Type(klass=Router),
+        help="named routing policies, as ``Router`` subclasses or import strings",
+    ).tag(config=True)
+
+    _router: Optional[Router] = T.Instance(Router, allow_none=True)
+    _app_info_cache: Dict["CommandWebSocketHandler", Tuple[float, M.AppInfo]] = T.Dict()
+    _app_info_generation: Dict["CommandWebSocketHandler", int] = T.Dict()
+    _app_info_versions: Dict["CommandWebSocketHandler", Tuple[str, float]] = T.Dict()
+    _command_indexes: Dict["CommandWebSocketHandler", CommandIndex] = T.Dict()
+    _apps_modified: float = T.Float(0.0)
+    _app_info_inflight: Dict[
+        "CommandWebSocketHandler", Tuple[int, "asyncio.Future[Any]"]
+    ] = T.Dict()
+    _icons: Dict[str, str] = T.Dict()
+    _icon_refs: Dict["CommandWebSocketHandler", Set[str]] = T.Dict()
+    _icon_requests: int = T.Int(0)
+    _icons_stale: bool = T.Bool(False)
+    _stats: Dict[str, int] = T.Dict()
+    _heartbeat: Optional["asyncio.Future[None]"] = T.Any(None, allow_none=True)
+
+    @T.default("registry")
+    def _default_registry(self) -> AppRegistry:
+        return AppRegistry(parent=self)
+
+    @property
+    def handlers(self) -> Tuple["CommandWebSocketHandler", ...]:
+        """Get the handlers of all subscribed apps, in the order they connected."""
+        return self.registry.handlers
+
+    @T.default("routers")
+    def _default_routers(self) -> Dict[str, Type[Router]]:
+        return dict(ROUTERS)
+
+    @T.observe("router", "routers")
+    def _on_router_change(self, change: Any) -> None:
+        self._router = None
+
+    def get_router(self) -> Router:
+        """Get the configured routing policy."""
+        if self._router is None:
+            if self.router not in self.routers:
+                raise ValueError(f"unknown router {self.router} in {[*self.routers]}")
+            self._router = self.routers[self.router](parent=self)
+        return self._router
+
+    def get_handler(
+        self, app_id: Optional[str] = None
+    ) -> Optional["CommandWebSocketHandler"]:
+        """Get the handler for an app by id, or as chosen by the routing policy."""
+        if app_id is not None:
+            record = self.registry.get(app_id)
+            return None if record is None else record.handler
+        if not self.handlers:
+            return None
+        return self.get_router().choose(self.handlers)
+
+    def count(self, stat: str, increment: int = 1) -> None:
+        """Increment a named statistic."""
+        self._stats[stat] = self._stats.get(stat, 0) + increment
 
-    def subscribe(self, handler: "CommandWebSocketHandler") -> None:
-        """Subscribe to an app."""
-        self.log.debug("handler subscribed %s", handler)
-        self.handlers += (*self.handlers, handler)
+    def get_stats(self) -> Dict[str, Any]:
+        """Get statistics about the manager's requests."""
+        stats: Dict[str, Any] = dict(self._stats)
+        requested = stats.get("app_info_requests", 0)
+        coalesced = stats.get("app_info_coalesced", 0)
+        stats["app_info_coalescing_rate"] = (
+            coalesced / (requested + coalesced) if coalesced else 0.0
+        )
+        stats["icons"] = len(self._icons)
+        now = time.monotonic()
+        stats["apps"] = {
+            handler.app_id: {
+                "rtt": handler.rtt,
+                "outstanding": handler.outstanding,
+                "idle": now - handler.last_seen,
+                "subprotocol": handler.subprotocol,
+            }
+            for handler in self.handlers
+        }
+        return stats
+
+    def subscribe(self, handler: "CommandWebSocketHandler", **metadata: str) -> None:
+        """Subscribe to an app, and start filling its app info cache."""
+        self.log.debug("handler subscribed %s %s", handler, metadata)
+        self.registry.add(handler, **metadata)
+        self._apps_modified = time.time()
+        if self.app_info_max_age > 0:
+            asyncio.ensure_future(self.refresh_app_info(handler))
+        if self.heartbeat_interval > 0 and (
+            self._heartbeat is None or self._heartbeat.done()
+        ):
+            self._heartbeat = asyncio.ensure_future(self._heartbeat_loop())
 
     def unsubscribe(self, handler: "CommandWebSocketHandler") -> None:
         """Unsubscribe from an app."""
         self.log.debug("handler unsubscribed %s", handler)
-        self.handlers = tuple(h for h in self.handlers if h != handler)
+        self.registry.remove(handler)
+        self.invalidate_app_info(handler)
+        self._app_info_generation.pop(handler, None)
+        self._app_info_versions.pop(handler, None)
+        self._command_indexes.pop(handler, None)
+        self.forget_icons(handler)
+        self._apps_modified = time.time()
+
+    async def _heartbeat_loop(self) -> None:
+        """Send heartbeats until there are no apps."""
+        while self.handlers and self.heartbeat_interval > 0:
+            await asyncio.sleep(self.heartbeat_interval)
+            self.heartbeat()
+
+    def heartbeat(self) -> None:
+        """Ping each app, unsubscribing any which haven't been seen for too long."""
+        now = time.monotonic()
+        for handler in self.handlers:
+            idle = now - handler.last_seen
+            if idle > self.heartbeat_timeout:
+                self.log.warning("app %s idle for %ss, evicting", handler.app_id, idle)
+                self.count("evicted")
+                self.unsubscribe(handler)
+                handler.evict()
+            else:
+                handler.send_heartbeat()
+
+    def on_event(self, handler: "CommandWebSocketHandler", message: M.AnyEvent) -> None:
+        """Handle an unrequested message from an app."""
+        request_type = message["request_type"]
+        self.log.debug("event %s from %s", request_type, handler)
+        if request_type == C.APP_INFO_CHANGED:
+            self.invalidate_app_info(handler)
+        elif request_type == C.COMMANDS_CHANGED:
+            content = cast(M.CommandsChangedEvent, message)["content"]
+            self.apply_commands_changed(handler, content)
+        else:  # pragma: no cover
+            self.log.warning("unexpected event %s from %s", request_type, handler)
+
+    def add_icons(
+        self,
+        handler: "CommandWebSocketHandler",
+        icons: Optional[M.IconsInfo],
+        commands: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Keep the SVG icons sent by an app, and note those its commands use.
+
+        Icons which don't match their hash are ignored, so an app can't replace
+        the icons of other apps.
+        """
+        refs = self._icon_refs.setdefault(handler, set())
+        for icon_hash, svgstr in (icons or {}).items():
+            if not isinstance(svgstr, str) or hash_icon(svgstr) != icon_hash:
+                self.log.warning("ignoring icon %s from %s", icon_hash, handler.app_id)
+                self.count("icons_rejected")
+                continue
+            self._icons[icon_hash] = svgstr
+            refs.add(icon_hash)
+        for info in (commands or {}).values():
+            icon = info.get("icon")
+            if isinstance(icon, str) and icon in self._icons:
+                refs.add(icon)
+
+    def forget_icons(self, handler: "CommandWebSocketHandler") -> None:
+        """Forget the icons of an app, unless another app uses them.
+
+        Apps may still answer app info requests which told them some icons were
+        known, so icons are only forgotten once no such requests are pending.
+        """
+        self._icon_refs.pop(handler, None)
+        self._icons_stale = True
+        if not self._icon_requests:
+            self._forget_unused_icons()
+
+    def _forget_unused_icons(self) -> None:
+        self._icons_stale = False
+        used = set().union(*self._icon_refs.values())
+        for icon_hash in [*self._icons]:
+            if icon_hash not in used:
+                self._icons.pop(icon_hash)
+
+    def get_icon(self, icon_hash: str) -> Optional[str]:
+        """Get an SVG icon by the hash of its content, if any app has sent it."""
+        return self._icons.get(icon_hash)
+
+    def invalidate_app_info(
+        self, handler: Optional["CommandWebSocketHandler"] = None
+    ) -> None:
+        """Forget the cached app info for one, or all, apps."""
+        handlers = self.handlers if handler is None else (handler,)
+        for a_handler in handlers:
+            self._app_info_cache.pop(a_handler, None)
+            self._app_info_generation[a_handler] = (
+                self._app_info_generation.get(a_handler, 0) + 1
+            )
+
+    def apply_commands_changed(
+        self, handler: "CommandWebSocketHandler", content: M.CommandsChangedContent
+    ) -> None:
+        """Update the cached app info with only the changed fields of some commands.
+
+        The app info, its commands and each changed command are copied, so
+        previously-returned app info is not modified. A field with a value of ``None``
+        is removed.
+        """
+        self.add_icons(handler, content.get("icons"), content.get("changed"))
+        entry = self._app_info_cache.get(handler)
+        if entry is None:
+            return
+        fetched, app_info = entry
+        commands = dict(app_info["commands"])
+        index = self._command_indexes.get(handler)
+        for command_id in content.get("removed", []):
+            commands.pop(command_id, None)
+            if index is not None:
+                index.discard(command_id)
+        for command_id, fields in content.get("changed", {}).items():
+            info: Dict[str, Any] = dict(commands.get(command_id, {}))
+            for field, value in fields.items():
+                if value is None:
+                    info.pop(field, None)
+                else:
+                    info[field] = value
+            commands[command_id] = cast(M.CommandInfo, info)
+            if index is not None and (
+                "label" in fields or command_id not in index.labels
+            ):
+                index.add(command_id, info.get("label"))
+        app_info = cast(M.AppInfo, {**app_info, "commands": commands})
+        self._app_info_cache[handler] = (fetched, app_info)
+        self._update_app_info_version(handler, app_info)
+
+    def _update_app_info_version(
+        self, handler: "CommandWebSocketHandler", app_info: M.AppInfo
+    ) -> bool:
+        """Hash the app info of an app, noting the time if it changed.
 
-    async def get_apps(self) -> Tuple[Any, ...]:
-        """Get all info from subscribed apps."""
+        Returns whether it changed.
+        """
+        digest = hash_json({k: v for k, v in app_info.items() if k != "id"})
+        old = self._app_info_versions.get(handler)
+        if old is not None and old[0] == digest:
+            return False
+        self._app_info_versions[handler] = (digest, time.time())
+        return True
+
+    def get_apps_version(self) -> Optional[Tuple[str, float]]:
+        """Get the hash, and ``time.time`` of the last change, of all apps' info.
+
+        Only known after the info of every app has been fetched without an error.
+        """
+        versions = []
+        modified = self._apps_modified
+        for handler in self.handlers:
+            version = self._app_info_versions.get(handler)
+            if version is None:
+                return None
+            versions.append([handler.app_id, version[0]])
+            modified = max(modified, version[1])
+        return hash_json(versions), modified
+
+    def cached_app_info(
+        self, handler: "CommandWebSocketHandler"
+    ) -> Optional[M.AppInfo]:
+        """Get the app info for an app if it is cached, and not too old."""
+        entry = self._app_info_cache.get(handler)
+        if entry is None:
+            return None
+        fetched, app_info = entry
+        if time.monotonic() - fetched > self.app_info_max_age:
+            self._app_info_cache.pop(handler, None)
+            return None
+        return app_info
+
+    async def refresh_app_info(self, handler: "CommandWebSocketHandler") -> Any:
+        """Request the app info from an app, sharing any identical request in flight."""
+        generation = self._app_info_generation.get(handler, 0)
+        inflight = self._app_info_inflight.get(handler)
+
+        if inflight and inflight[0] == generation and not inflight[1].done():
+            self.count("app_info_coalesced")
+            return await asyncio.shield(inflight[1])
+
+        self.count("app_info_requests")
+        future = asyncio.ensure_future(self._fetch_app_info(handler, generation))
+        self._app_info_inflight[handler] = (generation, future)
+
+        def forget(done: "asyncio.Future[Any]") -> None:
+            # only when the fetch ends, not when a caller gives up on it
+            if self._app_info_inflight.get(handler, (0, None))[1] is done:
+                self._app_info_inflight.pop(handler, None)
+
+        future.add_done_callback(forget)
+        return await asyncio.shield(future)
+
+    async def _fetch_app_info(
+        self,
+        handler: "CommandWebSocketHandler",
+        generation: int,
+        fields: Optional[Set[str]] = None,
+    ) -> Any:
+        """Request the app info from an app, caching it if nothing changed meanwhile.
+
+        Icons are kept apart from the app info, so the app only sends new ones. With
+        ``fields``, only those fields of each command are requested, and not cached.
+        """
+        content: M.AppInfoRequestContent = {"known_icons": sorted(self._icons)}
+        if fields is not None:
+            content["fields"] = sorted(fields)
+        self._icon_requests += 1
+        try:
+            response = await handler.jyg_request(C.APP_INFO, content)
+            if "error" in response:
+                if fields is None:
+                    # the current info is an error, so no longer matches any version
+                    self._app_info_versions.pop(handler, None)
+                return response
+            app_info: Any = response["content"]
+            self.add_icons(
+                handler, app_info.pop("icons", None), app_info.get("commands")
+            )
+        finally:
+            self._icon_requests -= 1
+            if self._icons_stale and not self._icon_requests:
+                self._forget_unused_icons()
+        self.registry.update(handler, app_info)
+        if fields is None and self.registry.get_by_handler(handler) is not None:
+            changed = self._update_app_info_version(handler, app_info)
+            if changed or handler not in self._command_indexes:
+                self._command_indexes[handler] = CommandIndex(app_info["commands"])
+        if (
+            fields is None
+            and self.app_info_max_age > 0
+            and self.registry.get_by_handler(handler) is not None
+            and generation == self._app_info_generation.get(handler, 0)
+        ):
+            self._app_info_cache[handler] = (time.monotonic(), app_info)
+        return app_info
+
+    async def get_app_info(
+        self,
+        handler: "CommandWebSocketHandler",
+        refresh: bool = False,
+        fields: Optional[Set[str]] = None,
+    ) -> Any:
+        """Get the info from a single app, from the cache if possible.
+
+        With ``fields``, commands only have those fields: if not cached, only those
+        are requested from the app.
+        """
+        app_info = None if refresh else self.cached_app_info(handler)
+        if app_info is None:
+            if fields is None:
+                app_info = await self.refresh_app_info(handler)
+            else:
+                generation = self._app_info_generation.get(handler, 0)
+                app_info = await self._fetch_app_info(handler, generation, fields)
+        if "error" not in app_info:
+            # a copy, so the cached app info is never modified by its callers
+            app_info = {**app_info, "id": handler.app_id}
+        return app_info if fields is None else project_app_info(app_info, fields)
+
+    async def get_apps(
+        self, refresh: bool = False, fields: Optional[Set[str]] = None
+    ) -> Tuple[Any, ...]:
+        """Get all info from subscribed apps, optionally with only some command fields."""
         return tuple(
             await asyncio.gather(
-                *[handler.jyg_request(C.APP_INFO) for handler in self.handlers]
+                *[
+                    self.get_app_info(handler, refresh=refresh, fields=fields)
+                    for handler in self.handlers
+                ]
             )
         )
 
-    async def run(self, command_id: str, args: Any) -> Any:
-        """Run a command."""
-        self.log.debug("execute requested %s %s", command_id, args)
-        # TODO: handle multiple apps
-        if not self.handlers:
-            return {"error": "no handlers"}
+    async def get_command_info(
+        self,
+        command_id: str,
+        app_id: Optional[str] = None,
+        refresh: bool = False,
+        fields: Optional[Set[str]] = None,
+    ) -> Any:
+        """Get the info of one command in an app, by id or as chosen by the router.
+
+        Uses the cached app info if possible, otherwise only asks the app about this
+        command. Returns ``None`` if there is no such command, or ``{"error": ...}``.
+        """
+        handler = self.get_handler(app_id)
+        if handler is None:
+            return self._no_handler_error(app_id)
+
+        app_info = None if refresh else self.cached_app_info(handler)
+        if app_info is not None:
+            info = app_info["commands"].get(command_id)
+        else:
+            content: M.CommandInfoRequestContent = {"ids": [command_id]}
+            if fields is not None:
+                content["fields"] = sorted(fields)
+            response = await handler.jyg_request(C.COMMAND_INFO, content)
+            if "error" in response:
+                return response
+            found = cast(M.CommandInfoResponseContent, response["content"])
+            self.add_icons(handler, found.get("icons"), found.get("commands"))
+            info = found["commands"].get(command_id)
+
+        if info is None or fields is None:
+            return info
+        return project_command_info(info, fields)
+
+    async def search_commands(
+        self,
+        query: str,
+        match: Optional[str] = None,
+        limit: int = C.SEARCH_LIMIT,
+        refresh: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Find the commands of all apps by id or label, best matches first.
+
+        See ``CommandIndex.search`` for how a query matches. Each result has the
+        ``id``, ``label`` and ``score`` of a command, and the ``apps`` which have it.
+        """
+        await self.get_apps(refresh=refresh)
+        results: Dict[str, Dict[str, Any]] = {}
+        for handler in self.handlers:
+            index = self._command_indexes.get(handler)
+            if index is None:
+                continue
+            for command_id, score in index.search(query, match).items():
+                result = results.setdefault(
+                    command_id,
+                    {"id": command_id, "label": index.labels[command_id], "apps": []},
+                )
+                result["score"] = max(score, result.get("score", 0.0))
+                result["apps"].append(handler.app_id)
+        ranked = sorted(results.values(), key=lambda r: (-r["score"], r["id"]))
+        return ranked[:limit] if limit else ranked
+
+    async def get_apps_within(
+        self,
+        timeout: Optional[float] = None,
+        first: bool = False,
+        refresh: bool = False,
+        fields: Optional[Set[str]] = None,
+    ) -> Tuple[Tuple[Any, ...], Tuple[str, ...]]:
+        """Get the info from apps which answer within ``timeout`` seconds.
+
+        With ``first``, return as soon as any app has answered. Returns the info
+        of apps which answered, and the ids of those which didn't: their requests
+        continue in the background, and will fill the cache.
+        """
+        tasks = {
+            asyncio.ensure_future(
+                self.get_app_info(handler, refresh=refresh, fields=fields)
+            ): handler
+            for handler in self.handlers
+        }
+        if not tasks:
+            return (), ()
+
+        done, pending = await asyncio.wait(
+            tasks,
+            timeout=timeout or None,
+            return_when=asyncio.FIRST_COMPLETED if first else asyncio.ALL_COMPLETED,
+        )
+
+        for task in pending:
+            task.cancel()
+
+        apps = tuple(task.result() for task in tasks if task in done)
+        timed_out = tuple(tasks[task].app_id for task in tasks if task in pending)
+        if timed_out:
+            self.log.debug("apps did not answer in time: %s", timed_out)
+            self.count("app_info_timed_out", len(timed_out))
+        return apps, timed_out
+
+    async def run(
+        self,
+        command_id: str,
+        args: Any = None,
+        app_id: Optional[str] = None,
+        raw: bool = False,
+    ) -> M.RunBatchResult:
+        """Run a command in an app, by id or as chosen by the routing policy.
+
+        Returns the ``{"content": ...}`` the command returned, or an
+        ``{"error": ...}``. With ``raw``, the content may be undecoded ``RawJSON``.
+        """
+        self.log.debug("execute requested %s %s %s", command_id, args, app_id)
+        handler = self.get_handler(app_id)
+        if handler is None:
+            return self._no_handler_error(app_id)
+
+        args = {} if args is None else args
+        return await handler.jyg_request(
+            C.RUN, {"id": command_id, "args": args}, raw=raw
+        )
+
+    async def run_many(
+        self,
+        items: Sequence[M.RunRequestContent],
+        mode: M.RunBatchMode = C.SEQUENTIAL,
+        app_id: Optional[str] = None,
+    ) -> List[M.RunBatchResult]:
+        """Run many commands in one app, returning a ``RunBatchResult`` for each.
+
+        Unlike ``run_batch``, if the whole batch fails, its error is returned for
+        every item.
+        """
+        results = await self.run_batch(items, mode, app_id=app_id)
+        if isinstance(results, list):
+            return results
+        return [results for item in items]
+
+    async def run_batch(
+        self,
+        items: Sequence[M.RunRequestContent],
+        mode: M.RunBatchMode = C.SEQUENTIAL,
+        app_id: Optional[str] = None,
+    ) -> Union[List[M.RunBatchResult], M.RunBatchResult]:
+        """Run many commands in a single request, returning each result or error.
+
+        Items may leave out ``args``. Each result has either the ``content`` returned
+        by the command or an ``error``, so a command which returns an ``error`` key
+        is not mistaken for a failure. If the whole batch fails, returns its error.
+        """
+        self.log.debug("batch execute requested %s %s %s", mode, items, app_id)
+        handler = self.get_handler(app_id)
+        if handler is None:
+            return self._no_handler_error(app_id)
+
+        batch: List[M.RunRequestContent] = [
+            {"id": item["id"], "args": item.get("args") or {}} for item in items
+        ]
+        response = await handler.jyg_request(
+            C.RUN_BATCH, {"items": batch, "mode": mode}
+        )
+        if "error" in response:
+            return response
 
-        handler = self.handlers[0]
+        return [
+            {"error": result["error"]}
+            if "error" in result
+            else {"content": result.get("content")}
+            for result in cast(List[M.RunBatchResult], response["content"])
+        ]
 
-        return await handler.jyg_request(C.RUN, {"id": command_id, "args": args})
+    def _no_handler_error(self, app_id: Optional[str] = None) -> M.RunBatchResult:
+        if app_id is None:
+            return {"error": "no handlers", "status": 503}
+        return {"error": f"app {app_id} not found", "status": 404}
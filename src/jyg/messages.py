@@ -0,0 +1,103 @@
+"""Encoding and decoding messages between the server and apps."""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple, Union, cast
+
+from . import constants as C
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+#: what separates the envelope of a message from its ``content``, if sent last
+CONTENT_KEY = ',"content":'
+
+_DECODER = json.JSONDecoder()
+
+
+class RawJSON(str):
+    """JSON text which is passed through without being decoded."""
+
+    def decode(self) -> Any:
+        """Decode the JSON text."""
+        return json.loads(self)
+
+
+def split_envelope(raw_message: Union[str, bytes]) -> Tuple[Dict[str, Any], bool]:
+    """Read a message, only decoding its envelope if its ``content`` is last.
+
+    Returns the message, and whether its ``content`` is ``RawJSON``. Messages which
+    aren't compact JSON with ``content`` as their last key are decoded in full.
+    """
+    if isinstance(raw_message, bytes):
+        raw_message = raw_message.decode("utf-8")
+
+    # quotes in strings are escaped, so the first match is either the top-level key
+    # after the envelope, or nested in a leading ``content``, which fails to decode
+    index = raw_message.find(CONTENT_KEY)
+    envelope: Optional[Dict[str, Any]] = None
+    if index != -1 and raw_message.endswith("}"):
+        try:
+            envelope = json.loads(raw_message[:index] + "}")
+            # the content must be the whole rest of the message, not followed by keys
+            start = index + len(CONTENT_KEY)
+            end = _DECODER.raw_decode(raw_message, start)[1]
+        except ValueError:
+            envelope = None
+        else:
+            if end != len(raw_message) - 1:
+                envelope = None
+
+    if not isinstance(envelope, dict):
+        return json.loads(raw_message), False
+
+    envelope["content"] = RawJSON(raw_message[start:-1])
+    return envelope, True
+
+
+def select_subprotocol(subprotocols: List[str]) -> Optional[str]:
+    """Choose the subprotocol the server prefers of those offered by an app.
+
+    MessagePack is only chosen if the optional ``msgpack`` package is installed.
+    """
+    for subprotocol in C.SUBPROTOCOLS:
+        if subprotocol == C.MSGPACK_SUBPROTOCOL and msgpack is None:
+            continue
+        if subprotocol in subprotocols:
+            return subprotocol
+    return None
+
+
+def encode_message(
+    message: Any, subprotocol: Optional[str] = None
+) -> Union[str, bytes]:
+    """Encode a message, as MessagePack ``bytes`` or JSON text."""
+    if subprotocol == C.MSGPACK_SUBPROTOCOL:
+        assert msgpack is not None, "only chosen if msgpack is installed"
+        return cast(bytes, msgpack.packb(message, use_bin_type=True))
+    return json.dumps(message)
+
+
+def decode_message(
+    raw_message: Union[str, bytes], subprotocol: Optional[str] = None
+) -> Tuple[Dict[str, Any], bool]:
+    """Decode a message, returning it and whether its ``content`` is ``RawJSON``.
+
+    Binary messages are MessagePack, which is decoded in full.
+    """
+    if isinstance(raw_message, bytes) and subprotocol == C.MSGPACK_SUBPROTOCOL:
+        assert msgpack is not None, "only chosen if msgpack is installed"
+        return msgpack.unpackb(raw_message, raw=False), False
+    return split_envelope(raw_message)
+
+
+def hash_icon(svgstr: str) -> str:
+    """Get the hash an app gives an SVG icon: 16 hex digits of its SHA-256."""
+    return hashlib.sha256(svgstr.encode("utf-8")).hexdigest()[:16]
+
+
+def hash_json(value: Any) -> str:
+    """Get a short, stable hash of a JSON-compatible value, ignoring key order."""
+    text = json.dumps(value, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
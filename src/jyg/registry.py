@@ -0,0 +1,155 @@
+"""An indexed registry of connected apps."""
+import hashlib
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional, Tuple
+
+import traitlets as T
+from traitlets.config import LoggingConfigurable
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .handlers import CommandWebSocketHandler
+
+from .schema import msg_v0 as M
+
+#: the metadata fields an app may report when it connects
+CONNECT_FIELDS = ("url", "name", "version", "title")
+
+
+def hash_plugins(plugins: Tuple[str, ...]) -> str:
+    """Get a short, stable hash of a set of plugin ids."""
+    return hashlib.sha256("\n".join(sorted(plugins)).encode("utf-8")).hexdigest()[:16]
+
+
+class AppRecord(T.HasTraits):
+    """What is known about a connected app."""
+
+    handler: "CommandWebSocketHandler" = T.Any()
+    app_id: str = T.Unicode()
+    url: str = T.Unicode()
+    name: str = T.Unicode()
+    version: str = T.Unicode()
+    title: str = T.Unicode()
+    plugins: Tuple[str, ...] = T.Tuple()
+    plugins_hash: str = T.Unicode()
+    connected: float = T.Float(help="the ``time.time`` the app connected")
+
+    def to_json(self) -> Dict[str, Any]:
+        """Get the JSON-compatible metadata of the app."""
+        return {
+            "id": self.app_id,
+            "url": self.url,
+            "name": self.name,
+            "version": self.version,
+            "title": self.title,
+            "plugins_hash": self.plugins_hash,
+            "connected": self.connected,
+        }
+
+
+class AppRegistry(LoggingConfigurable):
+    """Connected apps, by id, with indexes by url and plugin."""
+
+    _records: Dict[str, AppRecord] = T.Dict()
+    _by_handler: Dict["CommandWebSocketHandler", AppRecord] = T.Dict()
+    # dicts with ``None`` values are used as insertion-ordered sets
+    _by_url: Dict[str, Dict[str, None]] = T.Dict()
+    _by_plugin: Dict[str, Dict[str, None]] = T.Dict()
+    _handlers: Optional[Tuple["CommandWebSocketHandler", ...]] = T.Any(
+        None, allow_none=True
+    )
+
+    def __len__(self) -> int:
+        """Get the number of apps."""
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[AppRecord]:
+        """Iterate over a snapshot of the apps, in the order they connected."""
+        return iter(tuple(self._records.values()))
+
+    @property
+    def handlers(self) -> Tuple["CommandWebSocketHandler", ...]:
+        """Get the handlers of all apps, in the order they connected."""
+        if self._handlers is None:
+            self._handlers = tuple(record.handler for record in self._records.values())
+        return self._handlers
+
+    def add(self, handler: "CommandWebSocketHandler", **metadata: str) -> AppRecord:
+        """Add an app, replacing any existing app with the same id."""
+        if handler.app_id in self._records:
+            self.remove(self._records[handler.app_id].handler)
+        record = AppRecord(
+            handler=handler,
+            app_id=handler.app_id,
+            connected=time.time(),
+            **{k: v for k, v in metadata.items() if k in CONNECT_FIELDS and v},
+        )
+        self._records[record.app_id] = record
+        self._by_handler[handler] = record
+        self._handlers = None
+        self._index(record)
+        return record
+
+    def remove(self, handler: "CommandWebSocketHandler") -> Optional[AppRecord]:
+        """Remove an app, if registered."""
+        record = self._by_handler.pop(handler, None)
+        if record is None:
+            return None
+        self._records.pop(record.app_id, None)
+        self._handlers = None
+        self._unindex(record)
+        return record
+
+    def get(self, app_id: str) -> Optional[AppRecord]:
+        """Get an app by id."""
+        return self._records.get(app_id)
+
+    def get_by_handler(self, handler: "CommandWebSocketHandler") -> Optional[AppRecord]:
+        """Get the record of an app by its handler."""
+        return self._by_handler.get(handler)
+
+    def by_url(self, url: str) -> Tuple[AppRecord, ...]:
+        """Get all apps at a URL."""
+        return tuple(self._records[i] for i in self._by_url.get(url, {}))
+
+    def by_plugin(self, plugin: str) -> Tuple[AppRecord, ...]:
+        """Get all apps with a plugin."""
+        return tuple(self._records[i] for i in self._by_plugin.get(plugin, {}))
+
+    def update(self, handler: "CommandWebSocketHandler", app_info: M.AppInfo) -> None:
+        """Update the metadata of an app from its app info, re-indexing as needed."""
+        record = self._by_handler.get(handler)
+        if record is None:
+            return
+        plugins = tuple(app_info.get("plugins", record.plugins))
+        url = app_info.get("url", record.url)
+        if url == record.url and plugins == record.plugins:
+            record.title = app_info.get("title", record.title)
+            return
+        self._unindex(record)
+        record.url = url
+        record.plugins = plugins
+        record.plugins_hash = hash_plugins(plugins)
+        for field in ("name", "version", "title"):
+            setattr(record, field, app_info.get(field, getattr(record, field)))
+        self._index(record)
+
+    def _index(self, record: AppRecord) -> None:
+        if record.url:
+            self._by_url.setdefault(record.url, {})[record.app_id] = None
+        for plugin in record.plugins:
+            self._by_plugin.setdefault(plugin, {})[record.app_id] = None
+
+    def _unindex(self, record: AppRecord) -> None:
+        self._discard(self._by_url, record.url, record.app_id)
+        for plugin in record.plugins:
+            self._discard(self._by_plugin, plugin, record.app_id)
+
+    def _discard(
+        self, index: Dict[str, Dict[str, None]], key: str, app_id: str
+    ) -> None:
+        app_ids = index.get(key)
+        if app_ids is None:
+            return
+        app_ids.pop(app_id, None)
+        if not app_ids:
+            index.pop(key, None)
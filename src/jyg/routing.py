@@ -0,0 +1,85 @@
+"""Policies for choosing which app handles a request."""
+from typing import TYPE_CHECKING, Dict, Sequence, Type
+
+import traitlets as T
+from traitlets.config import LoggingConfigurable
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .handlers import CommandWebSocketHandler
+
+
+class Router(LoggingConfigurable):
+    """A base policy for choosing an app, when a request doesn't name one."""
+
+    def choose(
+        self, handlers: Sequence["CommandWebSocketHandler"]
+    ) -> "CommandWebSocketHandler":
+        """Choose one of a non-empty sequence of handlers."""
+        raise NotImplementedError()
+
+
+class FirstRouter(Router):
+    """Always choose the app which connected first."""
+
+    def choose(
+        self, handlers: Sequence["CommandWebSocketHandler"]
+    ) -> "CommandWebSocketHandler":
+        """Choose the first handler."""
+        return handlers[0]
+
+
+class RoundRobinRouter(Router):
+    """Choose each app in turn."""
+
+    _next: int = T.Int(0)
+
+    def choose(
+        self, handlers: Sequence["CommandWebSocketHandler"]
+    ) -> "CommandWebSocketHandler":
+        """Choose the next handler, wrapping around."""
+        handler = handlers[self._next % len(handlers)]
+        self._next = (self._next + 1) % len(handlers)
+        return handler
+
+
+class LeastOutstandingRouter(Router):
+    """Choose the app waiting on the fewest requests, preferring the first."""
+
+    def choose(
+        self, handlers: Sequence["CommandWebSocketHandler"]
+    ) -> "CommandWebSocketHandler":
+        """Choose the handler with the fewest outstanding requests."""
+        return min(handlers, key=lambda handler: handler.outstanding)
+
+
+class MostRecentlyResponsiveRouter(Router):
+    """Choose the app which most recently sent any message."""
+
+    def choose(
+        self, handlers: Sequence["CommandWebSocketHandler"]
+    ) -> "CommandWebSocketHandler":
+        """Choose the handler with the latest response."""
+        return max(handlers, key=lambda handler: handler.last_response)
+
+
+class LowestLatencyRouter(Router):
+    """Choose the app with the lowest measured round trip time."""
+
+    def choose(
+        self, handlers: Sequence["CommandWebSocketHandler"]
+    ) -> "CommandWebSocketHandler":
+        """Choose the handler with the lowest round trip time, if measured."""
+        return min(
+            handlers,
+            key=lambda handler: float("inf") if handler.rtt is None else handler.rtt,
+        )
+
+
+#: the named routing policies available by default
+ROUTERS: Dict[str, Type[Router]] = {
+    "first": FirstRouter,
+    "round-robin": RoundRobinRouter,
+    "least-outstanding": LeastOutstandingRouter,
+    "most-recently-responsive": MostRecentlyResponsiveRouter,
+    "lowest-latency": LowestLatencyRouter,
+}
@@ -10,13 +10,77 @@ MessageTypeAppInfo = Literal["app_info"]
 MessageTypeRun = Literal["run"]
 
 
-AnyMessageType = Union[MessageTypeRun, MessageTypeAppInfo]
+MessageTypeAppInfoChanged = Literal["app_info_changed"]
+
+
+MessageTypeCommandsChanged = Literal["commands_changed"]
+
+
+MessageTypeRunBatch = Literal["run_batch"]
+
+
+MessageTypeCommandInfo = Literal["command_info"]
+
+
+AnyMessageType = Union[
+    MessageTypeRun,
+    MessageTypeAppInfo,
+    MessageTypeAppInfoChanged,
+    MessageTypeCommandsChanged,
+    MessageTypeRunBatch,
+    MessageTypeCommandInfo,
+]
+
+
+class AppInfoChangedEvent(TypedDict, total=False):
+    """app info changed event.
+
+    sent by an app when its commands may have changed since the last app info
+    """
+
+    content: AnyContent
+    request_id: str
+    request_type: MessageTypeAppInfoChanged
+
+
+IconsInfo = Dict[str, str]
+
+
+class CommandsChangedContent(TypedDict, total=False):
+    """commands changed content.
+
+    only the fields of commands which changed since last reported
+    """
+
+    changed: Dict[str, Dict[str, Any]]
+    icons: IconsInfo
+    removed: List[str]
+
+
+class CommandsChangedEvent(TypedDict, total=False):
+    """commands changed event."""
+
+    content: CommandsChangedContent
+    request_id: str
+    request_type: MessageTypeCommandsChanged
+
+
+AnyEvent = Union[AppInfoChangedEvent, CommandsChangedEvent]
+
+
+class AppInfoRequestContent(TypedDict, total=False):
+    """app info request content."""
+
+    #: only get these fields of each command, rather than all of them
+    fields: List[str]
+    #: hashes of icons the server already has, which the app may leave out of `icons`
+    known_icons: List[str]
 
 
 class AppInfoRequest(TypedDict, total=False):
     """app info request."""
 
-    content: AnyContent
+    content: AppInfoRequestContent
     request_id: str
     request_type: MessageTypeAppInfo
 
@@ -36,7 +100,41 @@ class RunRequest(TypedDict, total=False):
     request_type: MessageTypeRun
 
 
-AnyRequest = Union[AppInfoRequest, RunRequest]
+RunBatchMode = Literal["sequential", "concurrent"]
+
+
+class RunBatchRequestContent(TypedDict, total=False):
+    """run batch request content."""
+
+    items: List[RunRequestContent]
+    mode: RunBatchMode
+
+
+class RunBatchRequest(TypedDict, total=False):
+    """run batch request."""
+
+    content: RunBatchRequestContent
+    request_id: str
+    request_type: MessageTypeRunBatch
+
+
+class CommandInfoRequestContent(TypedDict, total=False):
+    """command info request content."""
+
+    #: only get these fields of each command, rather than all of them
+    fields: List[str]
+    ids: List[str]
+
+
+class CommandInfoRequest(TypedDict, total=False):
+    """command info request."""
+
+    content: CommandInfoRequestContent
+    request_id: str
+    request_type: MessageTypeCommandInfo
+
+
+AnyRequest = Union[AppInfoRequest, RunRequest, RunBatchRequest, CommandInfoRequest]
 
 
 class CommandInfo(TypedDict, total=False):
@@ -45,6 +143,7 @@ class CommandInfo(TypedDict, total=False):
     caption: str
     className: str
     dataset: Dict[str, Any]
+    #: the first 16 hex digits of the SHA-256 of the command's SVG icon, in `icons`
     icon: Union[str, None]
     iconClass: str
     iconLabel: str
@@ -64,6 +163,9 @@ class AppInfo(TypedDict, total=False):
     """app info."""
 
     commands: CommandsInfo
+    icons: IconsInfo
+    #: a stable id for this app, added by the server
+    id: str
     name: str
     plugins: List[str]
     title: str
@@ -87,7 +189,44 @@ class RunResponse(TypedDict, total=False):
     request_type: MessageTypeAppInfo
 
 
-AnyValidResponse = Union[AppInfoResponse, RunResponse]
+class RunBatchResult(TypedDict, total=False):
+    """run batch result."""
+
+    content: AnyContent
+    error: str
+    #: the HTTP status of an error from the server, rather than the app
+    status: int
+
+
+class RunBatchResponse(TypedDict, total=False):
+    """run batch response."""
+
+    content: List[RunBatchResult]
+    request_id: str
+    request_type: MessageTypeRunBatch
+
+
+class CommandInfoResponseContent(TypedDict, total=False):
+    """command info response content.
+
+    the info of the requested commands which exist, and their icons
+    """
+
+    commands: CommandsInfo
+    icons: IconsInfo
+
+
+class CommandInfoResponse(TypedDict, total=False):
+    """command info response."""
+
+    content: CommandInfoResponseContent
+    request_id: str
+    request_type: MessageTypeCommandInfo
+
+
+AnyValidResponse = Union[
+    AppInfoResponse, RunResponse, RunBatchResponse, CommandInfoResponse
+]
 
 
 class ErrorResponse(TypedDict, total=False):
@@ -101,4 +240,4 @@ class ErrorResponse(TypedDict, total=False):
 AnyResponse = Union[AnyValidResponse, ErrorResponse]
 
 
-AnyMessage = Union[AnyRequest, AnyResponse]
+AnyMessage = Union[AnyRequest, AnyResponse, AnyEvent]
@@ -0,0 +1,210 @@
+"""Indexes of command ids and labels, for searching by prefix, glob or fuzzy match."""
+import fnmatch
+import re
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from . import constants as C
+
+#: characters which make a query a glob pattern
+GLOB_CHARS = re.compile(r"[*?\[]")
+
+#: what separates the words of ids and labels
+WORD_SEPARATORS = re.compile(r"[^0-9a-z]+")
+
+#: the scores of each kind of match, where fuzzy matches score less than 1
+EXACT_SCORE = 4.0
+ID_PREFIX_SCORE = 3.0
+WORD_PREFIX_SCORE = 2.0
+GLOB_SCORE = 1.0
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into distinct, lowercase words, in order."""
+    return list(dict.fromkeys(w for w in WORD_SEPARATORS.split(text.lower()) if w))
+
+
+def fuzzy_score(text: str, chars: str) -> float:
+    """Score how tightly some characters appear in order in text, or ``0``.
+
+    The characters are found greedily from the first, so this is linear in the
+    length of the text.
+    """
+    if chars in text:
+        return 1.0
+    start = end = text.find(chars[0])
+    if start == -1:
+        return 0.0
+    for char in chars[1:]:
+        end = text.find(char, end + 1)
+        if end == -1:
+            return 0.0
+    return len(chars) / (end - start + 1)
+
+
+class Trie:
+    """A map of strings to sets of values, which finds values by key prefix."""
+
+    __slots__ = ("_root",)
+
+    #: the key in a node for its values, which can't clash with a single character
+    VALUES = ""
+
+    def __init__(self) -> None:
+        """Make an empty trie."""
+        self._root: Dict[str, Any] = {}
+
+    def add(self, key: str, value: str) -> None:
+        """Add a value for a key."""
+        node = self._root
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault(self.VALUES, set()).add(value)
+
+    def discard(self, key: str, value: str) -> None:
+        """Remove a value for a key, if present, pruning any empty nodes."""
+        node = self._root
+        path: List[Tuple[Dict[str, Any], str]] = []
+        for char in key:
+            if char not in node:
+                return
+            path.append((node, char))
+            node = node[char]
+        values = node.get(self.VALUES)
+        if not values or value not in values:
+            return
+        values.discard(value)
+        if not values:
+            del node[self.VALUES]
+        for parent, char in reversed(path):
+            if parent[char]:
+                break
+            del parent[char]
+
+    def find(self, prefix: str) -> Iterator[Set[str]]:
+        """Yield the sets of values of all keys starting with a prefix."""
+        node = self._root
+        for char in prefix:
+            if char not in node:
+                return
+            node = node[char]
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char == self.VALUES:
+                    yield child
+                else:
+                    stack.append(child)
+
+
+class CommandIndex:
+    """The commands of an app, indexed by id prefix, and by the prefixes of words.
+
+    The words of a command are those of its id and its label.
+    """
+
+    #: the label of each command, by id
+    labels: Dict[str, str]
+
+    _folded: Dict[str, Tuple[str, str]]
+    _ids: Trie
+    _words: Trie
+
+    def __init__(self, commands: Optional[Dict[str, Any]] = None) -> None:
+        """Index some command info, by id."""
+        self.rebuild(commands or {})
+
+    def __len__(self) -> int:
+        """Get the number of commands."""
+        return len(self.labels)
+
+    def rebuild(self, commands: Dict[str, Any]) -> None:
+        """Replace all commands with some command info, by id."""
+        self.labels = {}
+        self._folded = {}
+        self._ids = Trie()
+        self._words = Trie()
+        for command_id, info in commands.items():
+            self.add(command_id, info.get("label"))
+
+    def add(self, command_id: str, label: Optional[str] = None) -> None:
+        """Add, or replace, a command."""
+        self.discard(command_id)
+        label = label if isinstance(label, str) else ""
+        folded = command_id.lower(), " ".join(label.lower().splitlines())
+        self.labels[command_id] = label
+        self._folded[command_id] = folded
+        self._ids.add(folded[0], command_id)
+        for word in tokenize(" ".join(folded)):
+            self._words.add(word, command_id)
+
+    def discard(self, command_id: str) -> None:
+        """Remove a command, if present."""
+        folded = self._folded.pop(command_id, None)
+        if folded is None:
+            return
+        self.labels.pop(command_id)
+        self._ids.discard(folded[0], command_id)
+        for word in tokenize(" ".join(folded)):
+            self._words.discard(word, command_id)
+
+    def search(self, query: str, match: Optional[str] = None) -> Dict[str, float]:
+        """Score the commands which match a query, by id.
+
+        Without a ``match``, a query with ``*``, ``?`` or ``[`` is a glob, and any
+        other query is matched by prefix, or fuzzily if nothing matches by prefix.
+        """
+        query = query.strip().lower()
+        if match is None:
+            if GLOB_CHARS.search(query):
+                return self.search_glob(query)
+            return self.search_prefix(query) or self.search_fuzzy(query)
+        if match == C.GLOB:
+            return self.search_glob(query)
+        if match == C.FUZZY:
+            return self.search_fuzzy(query)
+        return self.search_prefix(query)
+
+    def search_prefix(self, query: str) -> Dict[str, float]:
+        """Find commands whose id starts with a query, or with every query word."""
+        scores: Dict[str, float] = {}
+        for ids in self._ids.find(query):
+            for command_id in ids:
+                exact = self._folded[command_id][0] == query
+                scores[command_id] = EXACT_SCORE if exact else ID_PREFIX_SCORE
+
+        found: Optional[Set[str]] = None
+        for word in tokenize(query):
+            with_word = set().union(*self._words.find(word))
+            found = with_word if found is None else found & with_word
+            if not found:
+                break
+        for command_id in found or ():
+            scores.setdefault(command_id, WORD_PREFIX_SCORE)
+        return scores
+
+    def search_glob(self, query: str) -> Dict[str, float]:
+        """Find commands whose whole id or label matches a glob pattern."""
+        matches = re.compile(fnmatch.translate(query)).match
+        return {
+            command_id: GLOB_SCORE
+            for command_id, folded in self._folded.items()
+            if any(matches(text) for text in folded)
+        }
+
+    def search_fuzzy(self, query: str) -> Dict[str, float]:
+        """Find commands whose id or label has the query's characters in order.
+
+        Only commands with a word starting with the first character are checked,
+        each in linear time. Scores are higher for tighter matches, up to ``1`` for
+        a substring.
+        """
+        chars = query.replace(" ", "")
+        if not chars:
+            return {}
+        scores: Dict[str, float] = {}
+        for command_id in set().union(*self._words.find(chars[0])):
+            score = max(fuzzy_score(text, chars) for text in self._folded[command_id])
+            if score:
+                scores[command_id] = score
+        return scores
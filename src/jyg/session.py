@@ -0,0 +1,248 @@
+"""Long-lived sessions with a jyg server, for the shell and daemon."""
+import cmd
+import hmac
+import json
+import os
+import secrets
+import shlex
+import socket
+import socketserver
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union, cast
+
+from .client import Client
+from .utils import parse_command_args
+
+
+class Session:
+    """A warm connection to one server, with a cached catalog of its apps' commands.
+
+    Safe to share between threads.
+    """
+
+    client: Client
+
+    _apps: Optional[List[Dict[str, Any]]]
+    _lock: threading.Lock
+
+    def __init__(self, client: Client) -> None:
+        """Prepare a session, fetching the catalog when first needed."""
+        self.client = client
+        self._apps = None
+        self._lock = threading.Lock()
+
+    @property
+    def apps(self) -> List[Dict[str, Any]]:
+        """Get the cached app info of all apps."""
+        with self._lock:
+            if self._apps is None:
+                self._apps = self.client.request("commands")["apps"]
+            return self._apps
+
+    def refresh(self) -> List[Dict[str, Any]]:
+        """Fetch fresh app info from the apps, skipping the server cache."""
+        response = self.client.request("commands", query={"refresh": "1"})
+        apps = cast(List[Dict[str, Any]], response["apps"])
+        with self._lock:
+            self._apps = apps
+        return apps
+
+    def command_ids(self) -> List[str]:
+        """Get the sorted ids of the commands of all apps."""
+        return sorted({i for app in self.apps for i in app.get("commands", {})})
+
+    def run(
+        self,
+        command_id: str,
+        args: Optional[Dict[str, Any]] = None,
+        app_id: str = "",
+    ) -> Any:
+        """Run a command, returning its response."""
+        return self.client.post_json(
+            "commands",
+            command_id,
+            body=args or {},
+            query={"app": app_id} if app_id else None,
+        )["response"]
+
+    def run_line(self, line: int, text: str, app_id: str = "") -> Dict[str, Any]:
+        """Handle a line of JSON, returning a JSON-compatible result.
+
+        A line is either a command to run, like ``{"id", "args", "app"}``, or
+        ``{"op": "list"}`` to get the catalog, with ``"refresh": true`` to update it.
+        """
+        result: Dict[str, Any] = {"line": line}
+        try:
+            record = json.loads(text)
+            op = record.get("op", "run")
+            if op == "list":
+                result["apps"] = self.refresh() if record.get("refresh") else self.apps
+            elif op == "run":
+                result["id"] = record["id"]
+                result["response"] = self.run(
+                    record["id"], record.get("args"), record.get("app", app_id)
+                )
+            else:
+                raise ValueError(f"unknown op {op}")
+        except Exception as err:
+            result["error"] = f"{type(err).__name__}: {err}"
+        return result
+
+
+class SessionShell(cmd.Cmd):
+    """An interactive shell for running commands in a session."""
+
+    intro = "jyg shell: type `help` or `?` to list shell commands, `quit` to exit."
+    prompt = "jyg> "
+
+    session: Session
+
+    def __init__(self, session: Session, **kwargs: Any) -> None:
+        """Prepare a shell for a session."""
+        super().__init__(**kwargs)
+        self.session = session
+
+    def precmd(self, line: str) -> str:
+        """Treat a line starting with a jupyter command id as ``run``."""
+        first = line.strip().split(" ", 1)[0]
+        return f"run {line}" if ":" in first else line
+
+    def emptyline(self) -> bool:
+        """Do nothing on an empty line, rather than repeating the last command."""
+        return False
+
+    def do_list(self, arg: str) -> None:
+        """List the commands starting with a prefix: list [prefix]."""
+        labels: Dict[str, str] = {}
+        for app in self.session.apps:
+            for command_id, command in app.get("commands", {}).items():
+                if command_id.startswith(arg.strip()):
+                    labels.setdefault(command_id, command.get("label", ""))
+        width = max(map(len, labels), default=0)
+        for command_id, label in sorted(labels.items()):
+            self.stdout.write(f"{command_id.ljust(width)}\t{label}\n")
+
+    def do_apps(self, arg: str) -> None:
+        """List the connected apps: apps."""
+        for app in self.session.apps:
+            self.stdout.write(f"{app.get('id', '')}\t{app.get('title', '')}\n")
+
+    def do_refresh(self, arg: str) -> None:
+        """Fetch fresh commands from the apps: refresh."""
+        self.session.refresh()
+
+    def do_run(self, arg: str) -> None:
+        """Run a command: run <id> [--arg=value ...] or [<id>] '{"arg": "value"}'."""
+        try:
+            command_id, *argv = shlex.split(arg)
+            response = self.session.run(command_id, parse_command_args(argv))
+        except Exception as err:
+            self.stdout.write(f"ERROR: {err}\n")
+            return
+        self.stdout.write(f"{json.dumps(response, indent=2, sort_keys=True)}\n")
+
+    def complete_run(self, text: str, line: str, begidx: int, endidx: int) -> List[str]:
+        """Complete command ids."""
+        # readline splits words on ``:``, so complete whole ids, then trim
+        word = line[:endidx].split(" ")[-1]
+        trim = len(word) - len(text)
+        return [i[trim:] for i in self.session.command_ids() if i.startswith(word)]
+
+    complete_list = complete_run
+
+    def do_quit(self, arg: str) -> bool:
+        """Exit the shell: quit."""
+        return True
+
+    do_EOF = do_quit
+
+
+class SessionRequestHandler(socketserver.StreamRequestHandler):
+    """Answer each line of JSON from a daemon client with a line of JSON.
+
+    If the server has a ``token``, the first line must be ``{"token": ...}``, or the
+    connection is closed.
+    """
+
+    @property
+    def session_server(self) -> "SessionServer":
+        """Get the daemon server which accepted this client."""
+        return cast(SessionServer, self.server)
+
+    def handle(self) -> None:
+        """Handle lines until the client closes the connection."""
+        server = self.session_server
+        authenticated = not server.token
+        for line, text in enumerate(self.rfile, 1):
+            if not text.strip():
+                continue
+            if authenticated:
+                result = server.session.run_line(line, text.decode("utf-8"))
+            else:
+                authenticated = server.check_token(text)
+                result = {"line": line, "authenticated": authenticated}
+            self.wfile.write(json.dumps(result, sort_keys=True).encode("utf-8") + b"\n")
+            self.wfile.flush()
+            if not authenticated:
+                return
+
+
+class SessionServer(socketserver.ThreadingMixIn):
+    """A mixin for daemon servers, which handle each client in a thread."""
+
+    daemon_threads = True
+    session: Session
+    #: a secret each client must send first, if any
+    token: str = ""
+
+    def check_token(self, text: bytes) -> bool:
+        """Check whether a line of JSON is ``{"token": ...}`` with the token."""
+        try:
+            token = json.loads(text)["token"]
+        except Exception:
+            return False
+        return isinstance(token, str) and hmac.compare_digest(
+            token.encode("utf-8"), self.token.encode("utf-8")
+        )
+
+
+class TCPSessionServer(SessionServer, socketserver.TCPServer):
+    """A daemon server on a local TCP port, where socket files are unavailable.
+
+    Any local user may connect to the port, so clients must first send the token.
+    """
+
+    allow_reuse_address = True
+
+
+if hasattr(socket, "AF_UNIX"):
+
+    class UnixSessionServer(SessionServer, socketserver.UnixStreamServer):
+        """A daemon server on a local socket file."""
+
+
+def make_server(
+    session: Session, socket_path: Optional[Path] = None, port: int = 0
+) -> Union[TCPSessionServer, "UnixSessionServer"]:
+    """Make a daemon server for a session, on a socket file if possible.
+
+    A TCP server gets a new random ``token``, which its clients must send first.
+    """
+    server: Union[TCPSessionServer, UnixSessionServer]
+    if socket_path is not None and hasattr(socket, "AF_UNIX"):
+        socket_path.unlink(missing_ok=True)
+        server = UnixSessionServer(str(socket_path), SessionRequestHandler)
+    else:
+        server = TCPSessionServer(("127.0.0.1", port), SessionRequestHandler)
+        server.token = secrets.token_urlsafe(32)
+    server.session = session
+    return server
+
+
+def write_token(path: Path, token: str) -> None:
+    """Write a daemon token to a file which only its owner can read."""
+    path.unlink(missing_ok=True)
+    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as fp:
+        fp.write(token)
@@ -1,8 +1,11 @@
 """Suite-level test configuration for jyg."""
+import json
 import os
 import platform
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Callable, Iterator
+from typing import Any, Callable, Dict, Iterator, List
 from unittest import mock
 
 import pytest
@@ -13,6 +16,16 @@ pytest_plugins = [
 
 WIN = platform.system() == "Windows"
 
+FAKE_APPS: List[Dict[str, Any]] = [
+    {
+        "id": "an-app",
+        "commands": {
+            "help:about": {"label": "About"},
+            "help:licenses": {"label": "Licenses"},
+        },
+    }
+]
+
 
 class TScriptResult:
     """A type for script_runner results."""
@@ -35,3 +48,82 @@ def tmp_home(tmp_path: Path) -> Iterator[Path]:
     home = tmp_path / "__home__"
     with mock.patch.dict(os.environ, {"HOME": str(home)}):
         yield home
+
+
+class FakeServer(ThreadingHTTPServer):
+    """A server which records the client port of each request."""
+
+    ports: List[int]
+    dropped: List[str]
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Answer with a little JSON, keeping the connection alive."""
+
+    protocol_version = "HTTP/1.1"
+    server: FakeServer
+
+    def do_GET(self) -> None:
+        """Handle a GET, answering with the apps, or some of their commands."""
+        self.server.ports.append(self.client_address[1])
+        path = self.path.split("?")[0]
+        body: Dict[str, Any] = {
+            "path": self.path,
+            "authorization": self.headers.get("Authorization"),
+            "apps": FAKE_APPS,
+        }
+        if self.drop():
+            return
+        if "q=" in self.path:
+            body["commands"] = [
+                {"id": i, "label": c["label"], "score": 1.0, "apps": ["an-app"]}
+                for i, c in FAKE_APPS[0]["commands"].items()
+            ]
+        elif path.startswith("/jyg/commands/"):
+            body = FAKE_APPS[0]["commands"].get(path.split("/")[-1], {})
+        self.send_json(404 if "missing" in self.path else 200, body)
+
+    def do_POST(self) -> None:
+        """Handle a POST, answering with the args as the response of each command."""
+        self.server.ports.append(self.client_address[1])
+        args = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.drop():
+            return
+        if self.path.startswith("/jyg/batch"):
+            body = {"responses": [{"content": item["args"]} for item in args["items"]]}
+        else:
+            body = {"response": args}
+        self.send_json(404 if "missing" in self.path else 200, body)
+
+    def drop(self) -> bool:
+        """Close the connection unanswered, the first time a ``drop`` path is seen."""
+        if "drop" not in self.path or self.path in self.server.dropped:
+            return False
+        self.server.dropped.append(self.path)
+        self.close_connection = True
+        return True
+
+    def send_json(self, status: int, body: Dict[str, Any]) -> None:
+        """Send a JSON response."""
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: Any) -> None:
+        """Be quiet."""
+
+
+@pytest.fixture
+def a_server() -> Iterator[FakeServer]:
+    """Run a server in a thread."""
+    server = FakeServer(("127.0.0.1", 0), FakeHandler)
+    server.ports = []
+    server.dropped = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
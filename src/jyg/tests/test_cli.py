@@ -1,4 +1,6 @@
 """Tests for the jyg CLI."""
+import json
+import subprocess
 import sys
 from typing import List
 
@@ -19,6 +21,18 @@ LISTS = [
     ["ls"],
     ["l"],
 ]
+#: a module, and modules it must not import, to keep the CLI quick to start
+IMPORT_UNWANTED = [
+    ("jyg", ["traitlets", "jinja2"]),
+    ("jyg.__main__", ["traitlets", "jupyter_core.application"]),
+    ("jyg.client", ["traitlets", "jinja2", "tornado"]),
+    ("jyg.jygapp", ["jinja2", "jupyter_server", "notebook", "jyg.session"]),
+]
+LIST_IMPORTS = """
+import importlib, json, sys
+importlib.import_module(sys.argv[1])
+print(json.dumps(sorted(sys.modules)))
+"""
 
 
 @pytest.mark.parametrize("argv", ARGVS)
@@ -29,3 +43,11 @@ def test_cli_version(script_runner: TScriptRunner, argv: List[str]) -> None:
     if WIN:  # pragma: no cover
         return
     assert __version__ in ret.stdout
+
+
+@pytest.mark.parametrize("module,unwanted", IMPORT_UNWANTED)
+def test_import_unwanted(module: str, unwanted: List[str]) -> None:
+    """Verify modules the CLI needs to start don't import slow modules."""
+    out = subprocess.check_output([sys.executable, "-c", LIST_IMPORTS, module])
+    modules = json.loads(out)
+    assert not {*unwanted} & {*modules}, f"{module} imports too much"
@@ -0,0 +1,262 @@
+"""Tests for the jyg HTTP client."""
+import asyncio
+import http.client
+import io
+import json
+import socket
+import sys
+from typing import Any, Optional
+from urllib.error import HTTPError
+
+import pytest
+
+from jyg.client import AsyncClient, Client, ConnectionPool, to_result
+from jyg.jygapp import JygListApp, JygRunApp
+
+from .conftest import FAKE_APPS, FakeServer
+
+
+def test_client_reuses_connections(a_server: FakeServer) -> None:
+    """Verify sequential requests share a connection."""
+    pool = ConnectionPool()
+    client = Client(f"http://127.0.0.1:{a_server.server_port}/", "secret", pool=pool)
+    for i in range(5):
+        response = client.request("commands", query={"i": str(i)})
+        assert response["path"] == f"/jyg/commands?i={i}"
+        assert response["authorization"] == "token secret"
+    assert len(set(a_server.ports)) == 1, "expected one kept-alive connection"
+
+    with pytest.raises(HTTPError) as info:
+        client.request("missing")
+    assert info.value.code == 404
+    pool.close()
+
+
+def test_client_retries(a_server: FakeServer) -> None:
+    """Verify only requests which are safe to repeat are retried."""
+    client = Client(f"http://127.0.0.1:{a_server.server_port}/", pool=ConnectionPool())
+    client.request("commands")
+    assert (
+        client.request("commands", query={"drop": "1"})["path"]
+        == "/jyg/commands?drop=1"
+    )
+    client.request("commands")
+    with pytest.raises(http.client.RemoteDisconnected):
+        client.post_json("commands", "drop:run", body={})
+    assert a_server.dropped == ["/jyg/commands?drop=1", "/jyg/commands/drop:run"]
+    assert client.post_json("commands", "drop:run", body={}) == {"response": {}}
+    client.pool.close()
+
+
+def test_async_client(a_server: FakeServer) -> None:
+    """Verify concurrent async requests, in more than one event loop."""
+    client = AsyncClient(f"http://127.0.0.1:{a_server.server_port}/", "s", 2)
+
+    async def go() -> Any:
+        return await asyncio.gather(
+            client.request("commands"),
+            *[client.post_json("commands", "a:b", body={"i": i}) for i in range(4)],
+        )
+
+    pools = []
+    for i in range(2):
+        listed, *ran = asyncio.run(go())
+        assert listed["authorization"] == "token s"
+        assert [r["response"]["i"] for r in ran] == [0, 1, 2, 3]
+        pools.append(client._pool)
+    assert pools[0] is not pools[1], "expected a pool per loop"
+
+    async def missing() -> Any:
+        async with client:
+            return await client.request("missing")
+
+    with pytest.raises(HTTPError) as info:
+        asyncio.run(missing())
+    assert info.value.code == 404
+    assert client._pool is None
+
+
+def test_async_client_retries(a_server: FakeServer) -> None:
+    """Verify the async client only retries requests which are safe to repeat."""
+    client = AsyncClient(f"http://127.0.0.1:{a_server.server_port}/")
+
+    async def go() -> Any:
+        async with client:
+            await client.request("commands")
+            dropped = await client.request("commands", query={"drop": "1"})
+            assert dropped["path"] == "/jyg/commands?drop=1"
+            await client.request("commands")
+            with pytest.raises(http.client.RemoteDisconnected):
+                await client.post_json("commands", "drop:run", body={})
+            return await client.post_json("commands", "drop:run", body={})
+
+    assert asyncio.run(go()) == {"response": {}}
+    assert a_server.dropped == ["/jyg/commands?drop=1", "/jyg/commands/drop:run"]
+    assert len(set(a_server.ports)) == 3, "expected a new connection after each drop"
+
+
+def test_remote_servers(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Verify servers can be configured, instead of found."""
+    monkeypatch.setenv("JYG_TOKEN", "from-env")
+    app = JygListApp(url="https://example.com/user/a/")
+    assert app.running_servers == [
+        {"url": "https://example.com/user/a/", "token": "from-env"}
+    ]
+    assert app.client.api_url("commands") == "https://example.com/user/a/jyg/commands"
+
+    servers = [{"url": "https://example.com/user/b/", "token": "b"}]
+    app = JygListApp(servers=servers)
+    assert app.running_servers == servers
+    assert app.client.auth_headers() == {"Authorization": "token b"}
+
+
+def test_remote_async_reuses_connections(a_server: FakeServer) -> None:
+    """Verify the async client reuses connections to a remote server and token."""
+    app = JygRunApp(url=f"http://127.0.0.1:{a_server.server_port}/", token="remote")
+    client = AsyncClient(app.client.url, app.client.token, max_concurrency=2)
+    items = [{"id": "help:about", "args": {"i": i}} for i in range(4)]
+
+    async def go() -> Any:
+        async with client:
+            ran = [await client.run("help:about", {"i": i}) for i in range(5)]
+            sequential_ports = set(a_server.ports)
+            listed = await client.request("commands")
+            await asyncio.gather(
+                *[client.run("help:about", {"i": i}) for i in range(10)],
+                client.run_many(items, mode="concurrent", batch_size=1),
+            )
+            return ran, sequential_ports, listed
+
+    ran, sequential_ports, listed = asyncio.run(go())
+    assert ran == [{"content": {"i": i}} for i in range(5)]
+    assert listed["authorization"] == "token remote"
+    assert len(sequential_ports) == 1, "expected one kept-alive connection"
+    assert len(a_server.ports) == 20
+    assert len(set(a_server.ports)) == 2, "expected at most max_concurrency"
+
+
+@pytest.mark.parametrize(
+    "mimetype, fields, expected",
+    [
+        ["text/plain", None, "?fields=label"],
+        ["application/json", None, ""],
+        ["application/json", "label,caption", "?fields=label%2Ccaption"],
+        ["text/plain", "", ""],
+    ],
+)
+def test_list_fields(
+    a_server: FakeServer, mimetype: str, fields: Optional[str], expected: str
+) -> None:
+    """Verify only the fields shown are listed, unless asked for."""
+    kwargs = {} if fields is None else {"fields": fields}
+    url = f"http://127.0.0.1:{a_server.server_port}/"
+    app = JygListApp(url=url, mimetype=mimetype, **kwargs)
+    assert app.report_json()["path"] == f"/jyg/commands{expected}"
+
+
+@pytest.mark.parametrize(
+    "match, expected", [["", "?q=lic%2A"], ["glob", "?q=lic%2A&match=glob"]]
+)
+def test_list_search(a_server: FakeServer, match: str, expected: str) -> None:
+    """Verify commands are searched for, instead of listing all fields of apps."""
+    url = f"http://127.0.0.1:{a_server.server_port}/"
+    app = JygListApp(url=url, mimetype="text/plain", search="lic*", match=match)
+    report = app.report_json()
+    assert report["path"] == f"/jyg/commands{expected}"
+    assert [c["id"] for c in report["commands"]] == ["help:about", "help:licenses"]
+
+
+def test_client_api(a_server: FakeServer) -> None:
+    """Verify the sync and async clients have typed methods."""
+    url = f"http://127.0.0.1:{a_server.server_port}/"
+    client = Client(url)
+    items = [{"id": "help:about", "args": {"i": i}} for i in range(5)]
+    assert client.list_apps(refresh=True, fields=["label"]) == FAKE_APPS
+    assert client.get_command("help:about") == {"label": "About"}
+    assert client.search_commands("lic", "fuzzy", 5)[1]["label"] == "Licenses"
+    assert client.run("help:about", {"x": 1}) == {"content": {"x": 1}}
+    assert client.run_many(items, batch_size=2) == [
+        {"content": {"i": i}} for i in range(5)
+    ]
+
+    async def go() -> Any:
+        async with AsyncClient(url, max_concurrency=2) as aclient:
+            return await asyncio.gather(
+                aclient.list_apps(first=True),
+                aclient.search_commands("about"),
+                aclient.get_command("help:licenses"),
+                aclient.run("help:about"),
+                aclient.run_many(items, mode="concurrent", batch_size=2),
+            )
+
+    apps, found, command, result, results = asyncio.run(go())
+    assert apps == FAKE_APPS
+    assert found[0]["apps"] == ["an-app"]
+    assert command == {"label": "Licenses"}
+    assert result == {"content": {}}
+    assert results == [{"content": {"i": i}} for i in range(5)]
+
+    assert to_result({"error": "no apps"}) == {"error": "no apps"}
+    assert to_result({"error": "no apps", "x": 1}) == {
+        "content": {"error": "no apps", "x": 1}
+    }
+
+
+def test_run_stdin(
+    a_server: FakeServer, monkeypatch: pytest.MonkeyPatch, capsys: Any
+) -> None:
+    """Verify commands from stdin each get a result line."""
+    records = [{"id": "help:about", "args": {"i": i}} for i in range(20)]
+    lines = [json.dumps(r) for r in records]
+    lines[3] = "not json"
+    lines[5] = json.dumps({"id": "missing"})
+    monkeypatch.setattr(sys, "stdin", io.StringIO("\n".join(lines) + "\n\n"))
+
+    app = JygRunApp(
+        stdin=True,
+        window=4,
+        client=Client(f"http://127.0.0.1:{a_server.server_port}/"),
+    )
+    app.start()
+
+    results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(r["line"] for r in results) == list(range(1, 21))
+    by_line = {r["line"]: r for r in results}
+    assert "JSONDecodeError" in by_line[4]["error"]
+    assert "HTTPError" in by_line[6]["error"]
+    assert by_line[20] == {"line": 20, "id": "help:about", "response": {"i": 19}}
+    assert len(set(a_server.ports)) <= 4, "expected at most a window of connections"
+
+
+def test_all_servers(a_server: FakeServer, capsys: Any) -> None:
+    """Verify all servers are asked at once, and slow servers don't block."""
+    url = f"http://127.0.0.1:{a_server.server_port}/"
+    with socket.socket() as dead, socket.socket() as slow:
+        dead.bind(("127.0.0.1", 0))
+        slow.bind(("127.0.0.1", 0))
+        slow.listen()
+        running_servers = [
+            {"url": url, "token": ""},
+            {"url": f"http://127.0.0.1:{dead.getsockname()[1]}/", "token": ""},
+            {"url": f"http://127.0.0.1:{slow.getsockname()[1]}/", "token": ""},
+            {"url": url, "token": "again"},
+        ]
+        app = JygListApp(
+            all_servers=True,
+            deadline=0.5,
+            mimetype="application/json",
+            running_servers=running_servers,
+        )
+        app.start()
+    servers = json.loads(capsys.readouterr().out)["servers"]
+    assert [s["url"] for s in servers] == [s["url"] for s in running_servers]
+    assert servers[0]["report"]["apps"] == servers[3]["report"]["apps"]
+    assert "ConnectionRefusedError" in servers[1]["error"]
+    assert "no answer within 0.5s" in servers[2]["error"]
+
+    app.mimetype = "text/plain"
+    app.running_servers = [running_servers[0], running_servers[1]]
+    app.start()
+    out = capsys.readouterr().out
+    assert f"# {url}" in out and "help:licenses\tLicenses" in out
+    assert "ERROR: ConnectionRefusedError" in out
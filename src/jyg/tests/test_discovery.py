@@ -0,0 +1,75 @@
+"""Tests for finding running servers."""
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+from unittest import mock
+
+import pytest
+
+from jyg import utils
+
+#: a pid which is very unlikely to be running
+DEAD_PID = 2**22 + 1
+
+
+@pytest.fixture
+def a_runtime_dir(tmp_path: Path) -> Iterator[Path]:
+    """Use empty runtime and cache dirs."""
+    runtime_dir = tmp_path / "runtime"
+    runtime_dir.mkdir()
+    env = {
+        "JUPYTER_RUNTIME_DIR": str(runtime_dir),
+        "XDG_CACHE_HOME": str(tmp_path / "cache"),
+    }
+    with mock.patch.dict(os.environ, env):
+        yield runtime_dir
+
+
+def write_info(runtime_dir: Path, name: str, pid: int) -> None:
+    """Write a server info file."""
+    info = {"pid": pid, "url": f"http://localhost/{name}/", "token": name}
+    (runtime_dir / f"{name}.json").write_text(json.dumps(info), encoding="utf-8")
+
+
+def list_servers(**kwargs: Any) -> List[Dict[str, Any]]:
+    """List the servers, counting the server info files read."""
+    with mock.patch.object(
+        utils, "_scan_running_servers", wraps=utils._scan_running_servers
+    ) as scan:
+        servers = [*utils.fallback_list_running_servers(**kwargs)]
+    return [{**s, "scanned": scan.call_count} for s in servers]
+
+
+def test_discovery_cache(a_runtime_dir: Path) -> None:
+    """Verify servers are only scanned when the runtime dir changes."""
+    write_info(a_runtime_dir, "jpserver-1", os.getpid())
+    write_info(a_runtime_dir, "nbserver-2", DEAD_PID)
+    (a_runtime_dir / "kernel-1.json").write_text("{}", encoding="utf-8")
+
+    servers = list_servers()
+    assert [(s["token"], s["scanned"]) for s in servers] == [("jpserver-1", 1)]
+    servers = list_servers()
+    assert [(s["token"], s["scanned"]) for s in servers] == [("jpserver-1", 0)]
+
+    cache_path = utils.discovery_cache_path(a_runtime_dir)
+    assert cache_path.stat().st_mode & 0o777 == 0o600
+
+    write_info(a_runtime_dir, "jpserver-3", os.getpid())
+    servers = list_servers()
+    assert [(s["token"], s["scanned"]) for s in servers] == [
+        ("jpserver-3", 1),
+        ("jpserver-1", 1),
+    ]
+
+    with mock.patch.object(utils, "is_pid_killable", return_value=False):
+        assert not list_servers(), "expected cached servers to be checked"
+
+    servers = list_servers(cache=False)
+    assert [s["scanned"] for s in servers] == [1, 1]
+
+
+def test_discovery_no_runtime_dir(a_runtime_dir: Path) -> None:
+    """Verify a missing runtime dir finds no servers."""
+    a_runtime_dir.rmdir()
+    assert not list_servers()
@@ -0,0 +1,202 @@
+"""Tests for the jyg WebSocket handler."""
+import asyncio
+import json
+from typing import Any, List
+
+import pytest
+from tornado.web import HTTPError
+from tornado.websocket import WebSocketClosedError
+
+from jyg import constants as C
+from jyg.handlers import CommandListHandler, CommandWebSocketHandler
+from jyg.manager import CommandManager
+from jyg.messages import RawJSON
+
+
+class FakeSocket(CommandWebSocketHandler):
+    """A ``CommandWebSocketHandler`` which keeps what it sends, without a connection."""
+
+    def __init__(self, manager: CommandManager, app_id: str = "app") -> None:
+        self.initialize(manager)
+        self.app_id = app_id
+        self.sent: List[Any] = []
+        self.pings: List[bytes] = []
+        self.closed = False
+
+    def write_message(self, message: Any, binary: bool = False) -> Any:
+        if self.closed:
+            raise WebSocketClosedError()
+        self.sent.append(json.loads(message))
+
+    def ping(self, data: Any = b"") -> None:
+        if self.closed:
+            raise WebSocketClosedError()
+        self.pings.append(data)
+
+    def close(self, code: Any = None, reason: Any = None) -> None:
+        self.closed = True
+        self.on_close()
+
+    async def respond(self, index: int = -1, **response: Any) -> None:
+        """Answer a request, as the app would."""
+        request = self.sent[index]
+        message = {"request_id": request["request_id"], **response}
+        await self.on_message(json.dumps(message, separators=(",", ":")))
+
+    async def respond_raw(self, text: str, index: int = -1) -> None:
+        """Answer a request with a JSON message, ``text``, with no ``request_id``."""
+        request_id = json.dumps(self.sent[index]["request_id"])
+        await self.on_message(f'{{"request_id":{request_id},{text[1:]}')
+
+
+@pytest.mark.asyncio
+async def test_request_response() -> None:
+    """Verify responses resolve their request, and late responses are ignored."""
+    socket = FakeSocket(CommandManager(request_timeout=0.01))
+    request = asyncio.ensure_future(socket.jyg_request(C.RUN, {"id": "a:b"}))
+    await asyncio.sleep(0)
+    assert socket.outstanding == 1
+    await socket.respond(request_type=C.RUN, content={"x": 1})
+    assert await request == {"content": {"x": 1}}
+    assert socket.outstanding == 0
+
+    result = await socket.jyg_request(C.RUN, {"id": "a:b"})
+    assert result == {"error": "app app timed out after 0.01s", "status": 504}
+    assert socket.outstanding == 0
+    await socket.respond(request_type=C.RUN, content={"late": True})
+
+    request = asyncio.ensure_future(socket.jyg_request(C.RUN, {"id": "a:b"}, 1))
+    await asyncio.sleep(0)
+    await socket.respond(request_type=C.RUN, error="a:b failed")
+    assert await request == {"error": "a:b failed"}
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"request_type":"run","content":{"status":"ok"}}',
+        '{"content":{"status":"ok"},"request_type":"run"}',
+    ],
+)
+@pytest.mark.asyncio
+async def test_content_with_status(text: str) -> None:
+    """Verify a command may return a ``status``, without it looking like an error."""
+    manager = CommandManager()
+    socket = FakeSocket(manager)
+    manager.subscribe(socket)
+    for raw in [True, False]:
+        request = asyncio.ensure_future(manager.run("a:b", raw=raw))
+        await asyncio.sleep(0)
+        await socket.respond_raw(text)
+        result = await request
+        assert [*result] == ["content"]
+        content = result["content"]
+        if isinstance(content, RawJSON):
+            content = content.decode()
+        assert content == {"status": "ok"}
+
+
+@pytest.mark.asyncio
+async def test_max_outstanding_requests() -> None:
+    """Verify a busy app gets no more requests, without raising."""
+    socket = FakeSocket(CommandManager(max_outstanding_requests=1))
+    first = asyncio.ensure_future(socket.jyg_request(C.RUN, {"id": "a:b"}))
+    await asyncio.sleep(0)
+    busy = await socket.jyg_request(C.RUN, {"id": "a:c"})
+    assert busy == {"error": "app app has 1 outstanding requests", "status": 503}
+    assert len(socket.sent) == 1
+    await socket.respond(request_type=C.RUN, content=None)
+    assert await first == {"content": None}
+    assert await socket.jyg_request(C.RUN, {"id": "a:c"}, 0.01) == {
+        "error": "app app timed out after 0.01s",
+        "status": 504,
+    }
+
+
+@pytest.mark.asyncio
+async def test_close_fails_outstanding() -> None:
+    """Verify closing fails outstanding requests, and later ones."""
+    socket = FakeSocket(CommandManager())
+    requests = [
+        asyncio.ensure_future(socket.jyg_request(C.RUN, {"id": f"a:{i}"}))
+        for i in range(2)
+    ]
+    await asyncio.sleep(0)
+    socket.close()
+    closed = {"error": "app app closed", "status": 502}
+    assert await asyncio.gather(*requests) == [closed, closed]
+    assert socket.outstanding == 0
+    assert await socket.jyg_request(C.RUN, {"id": "a:b"}) == closed
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_rtt() -> None:
+    """Verify pongs to heartbeats update the smoothed round trip time."""
+    socket = FakeSocket(CommandManager())
+    assert socket.ping_interval == 0, "expected only the manager's heartbeat"
+    socket.send_heartbeat()
+    sent = float(socket.pings[-1])
+    socket.on_pong(repr(sent - 1).encode("utf-8"))
+    assert socket.rtt == pytest.approx(1, abs=0.1)
+    socket.on_pong(repr(sent - 5).encode("utf-8"))
+    assert socket.rtt == pytest.approx(2, abs=0.1)
+
+    seen = socket.last_seen
+    socket.on_pong(b"")
+    assert socket.rtt == pytest.approx(2, abs=0.1), "expected only heartbeats timed"
+    assert socket.last_seen >= seen
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_evict() -> None:
+    """Verify an idle app is evicted, failing its outstanding requests."""
+    manager = CommandManager(heartbeat_interval=0, heartbeat_timeout=1)
+    socket = FakeSocket(manager)
+    manager.subscribe(socket)
+    request = asyncio.ensure_future(socket.jyg_request(C.RUN, {"id": "a:b"}))
+    await asyncio.sleep(0)
+
+    manager.heartbeat()
+    assert len(socket.pings) == 1 and not socket.closed
+
+    socket.last_seen -= 2
+    manager.heartbeat()
+    assert socket.closed
+    assert await request == {"error": "app app stopped responding", "status": 502}
+    assert manager.handlers == ()
+    socket.send_heartbeat()
+
+
+class FakeQuery(CommandListHandler):
+    """A ``CommandListHandler`` which only has query arguments, without a request."""
+
+    def __init__(self, **query: str) -> None:
+        self.query = query
+
+    def get_argument(self, name: str, default: Any = None, strip: bool = True) -> Any:
+        return self.query.get(name, default)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        [None, None],
+        ["0", 0],
+        ["10", 10],
+        ["-1", 400],
+        ["1.5", 400],
+        ["nan", 400],
+        ["inf", 400],
+        ["1e99", 400],
+        ["\u00b2", 400],
+    ],
+)
+def test_count_argument(value: Any, expected: Any) -> None:
+    """Verify counts like ``?limit=`` are whole numbers, or answered with ``400``."""
+    handler = FakeQuery() if value is None else FakeQuery(limit=value)
+    if expected == 400:
+        with pytest.raises(HTTPError) as info:
+            handler.get_count_argument("limit")
+        assert info.value.status_code == 400
+    else:
+        assert handler.get_count_argument("limit") == expected
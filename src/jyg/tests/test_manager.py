@@ -0,0 +1,536 @@
+"""Tests for the jyg command manager."""
+import asyncio
+import time
+from copy import deepcopy
+from typing import Any, Dict, List
+
+import pytest
+
+from jyg import constants as C
+from jyg.manager import CommandManager
+from jyg.messages import hash_icon
+
+APP_INFO: Dict[str, Any] = {
+    "url": "http://localhost:8888/lab",
+    "version": "3.5.3",
+    "plugins": ["@deathbeds/jyg:plugin"],
+    "name": "JupyterLab",
+    "title": "lab - JupyterLab",
+    "commands": {"help:licenses": {"label": "Licenses", "isEnabled": True}},
+}
+APP_INFO_WITH_ID = {**APP_INFO, "id": "app"}
+ICON = "<svg/>"
+ICON_HASH = hash_icon(ICON)
+
+
+class FakeHandler:
+    """A stand-in for a ``CommandWebSocketHandler``."""
+
+    delay = 0.0
+
+    def __init__(self, app_id: str = "app") -> None:
+        self.requests: List[Any] = []
+        self.app_id = app_id
+        self.outstanding = 0
+        self.last_response = self.last_seen = time.monotonic()
+        self.rtt: Any = None
+        self.subprotocol = None
+        self.heartbeats = 0
+        self.evicted = False
+
+    def send_heartbeat(self) -> None:
+        self.heartbeats += 1
+
+    def evict(self) -> None:
+        self.evicted = True
+
+    async def jyg_request(
+        self, request_type: str, content: Any = None, raw: bool = False
+    ) -> Any:
+        self.requests += [(request_type, content)]
+        await asyncio.sleep(self.delay)
+        if request_type == C.APP_INFO:
+            return {"content": deepcopy(APP_INFO)}
+        if request_type == C.COMMAND_INFO:
+            commands = APP_INFO["commands"]
+            found = {i: commands[i] for i in content["ids"] if i in commands}
+            return {"content": {"commands": deepcopy(found)}}
+        if request_type == C.RUN_BATCH:
+            return {
+                "content": [
+                    {"content": item["args"]}
+                    if item["id"] in APP_INFO["commands"]
+                    else {"error": f"""{item["id"]} not found"""}
+                    for item in content["items"]
+                ]
+            }
+        return {"content": content}
+
+
+@pytest.mark.asyncio
+async def test_app_info_cache() -> None:
+    """Verify app info is cached until invalidated."""
+    manager = CommandManager(app_info_max_age=60)
+    handler: Any = FakeHandler()
+    manager.subscribe(handler)
+    await asyncio.sleep(0.01)
+    assert len(handler.requests) == 1, "expected app info on subscribe"
+    assert await manager.get_apps() == (APP_INFO_WITH_ID,)
+    assert await manager.get_apps() == (APP_INFO_WITH_ID,)
+    assert len(handler.requests) == 1, "expected a cached app info"
+
+    manager.on_event(handler, {"request_type": C.APP_INFO_CHANGED})
+    assert await manager.get_apps() == (APP_INFO_WITH_ID,)
+    assert len(handler.requests) == 2, "expected an invalidated app info"
+
+    assert await manager.get_apps(refresh=True) == (APP_INFO_WITH_ID,)
+    assert len(handler.requests) == 3, "expected a forced refresh"
+
+
+@pytest.mark.asyncio
+async def test_app_info_commands_changed() -> None:
+    """Verify command deltas are applied to the cached app info."""
+    manager = CommandManager(app_info_max_age=60)
+    handler: Any = FakeHandler()
+    manager.subscribe(handler)
+    await asyncio.sleep(0.01)
+    before = deepcopy((await manager.get_apps())[0])
+    held = (await manager.get_apps())[0]
+
+    manager.on_event(
+        handler,
+        {
+            "request_type": C.COMMANDS_CHANGED,
+            "content": {
+                "changed": {
+                    "help:licenses": {"isToggled": True, "isEnabled": None},
+                    "help:about": {"label": "About"},
+                }
+            },
+        },
+    )
+    commands = (await manager.get_apps())[0]["commands"]
+    assert commands["help:licenses"] == {"label": "Licenses", "isToggled": True}
+    assert commands["help:about"] == {"label": "About"}
+    assert held == before == APP_INFO_WITH_ID, "expected earlier results unchanged"
+
+    manager.on_event(
+        handler,
+        {"request_type": C.COMMANDS_CHANGED, "content": {"removed": ["help:about"]}},
+    )
+    commands = (await manager.get_apps())[0]["commands"]
+    assert "help:about" not in commands
+    assert held == before, "expected earlier results unchanged"
+    assert len(handler.requests) == 1, "expected only deltas"
+
+
+@pytest.mark.asyncio
+async def test_app_info_version() -> None:
+    """Verify the version of app info only changes with its content."""
+    manager = CommandManager(app_info_max_age=60)
+    assert manager.get_apps_version() is not None, "expected a version of no apps"
+    handler: Any = FakeHandler()
+    manager.subscribe(handler)
+    assert manager.get_apps_version() is None, "expected no version before fetching"
+    await manager.get_apps()
+    version = manager.get_apps_version()
+    assert version is not None
+
+    await manager.get_apps(refresh=True)
+    assert manager.get_apps_version() == version, "expected the same content"
+
+    manager.on_event(
+        handler,
+        {
+            "request_type": C.COMMANDS_CHANGED,
+            "content": {"changed": {"help:licenses": {"isToggled": True}}},
+        },
+    )
+    changed = manager.get_apps_version()
+    assert changed is not None and changed[0] != version[0]
+    assert changed[1] >= version[1]
+
+    manager.unsubscribe(handler)
+    assert manager.get_apps_version() not in [None, version, changed]
+
+
+@pytest.mark.asyncio
+async def test_app_info_version_error() -> None:
+    """Verify there is no version of app info while an app's latest info errored."""
+    manager = CommandManager(app_info_max_age=60)
+    handler: Any = FakeHandler()
+    manager.subscribe(handler)
+    await manager.get_apps()
+    version = manager.get_apps_version()
+    assert version is not None
+
+    jyg_request = handler.jyg_request
+
+    async def broken(request_type: str, content: Any = None, raw: bool = False) -> Any:
+        return {"error": "broken"}
+
+    handler.jyg_request = broken
+    apps = await manager.get_apps(refresh=True)
+    assert "error" in apps[0]
+    assert manager.get_apps_version() is None, "expected no version of an error"
+
+    handler.jyg_request = jyg_request
+    await manager.get_apps(refresh=True)
+    fixed = manager.get_apps_version()
+    assert fixed is not None and fixed[0] == version[0], "expected the same content"
+
+
+@pytest.mark.asyncio
+async def test_app_info_fields() -> None:
+    """Verify only some command fields can be requested, bypassing the cache."""
+    manager = CommandManager(app_info_max_age=0)
+    handler: Any = FakeHandler()
+    manager.subscribe(handler)
+    apps = await manager.get_apps(fields={"label"})
+    assert apps[0]["commands"] == {"help:licenses": {"label": "Licenses"}}
+    assert handler.requests == [
+        (C.APP_INFO, {"known_icons": [], "fields": ["label"]}),
+    ]
+
+    manager.app_info_max_age = 60
+    await manager.get_apps()
+    apps = await manager.get_apps(fields={"isEnabled"})
+    assert apps[0]["commands"] == {"help:licenses": {"isEnabled": True}}
+    assert len(handler.requests) == 2, "expected fields from the cache"
+    assert "label" in (await manager.get_apps())[0]["commands"]["help:licenses"]
+
+
+@pytest.mark.asyncio
+async def test_command_info() -> None:
+    """Verify one command is looked up in the cache, or only asked of the app."""
+    manager = CommandManager(app_info_max_age=0)
+    assert await manager.get_command_info("help:licenses") == {
+        "error": "no handlers",
+        "status": 503,
+    }
+    handler: Any = FakeHandler()
+    manager.subscribe(handler)
+    info = await manager.get_command_info("help:licenses", fields={"label"})
+    assert info == {"label": "Licenses"}
+    assert await manager.get_command_info("help:nope") is None
+    assert handler.requests == [
+        (C.COMMAND_INFO, {"ids": ["help:licenses"], "fields": ["label"]}),
+        (C.COMMAND_INFO, {"ids": ["help:nope"]}),
+    ]
+
+    manager.app_info_max_age = 60
+    await manager.get_apps()
+    info = await manager.get_command_info("help:licenses", app_id="app")
+    assert info == APP_INFO["commands"]["help:licenses"]
+    assert len(handler.requests) == 3, "expected a cached command"
+    assert await manager.get_command_info("help:licenses", app_id="nope") == {
+        "error": "app nope not found",
+        "status": 404,
+    }
+
+
+@pytest.mark.asyncio
+async def test_command_info_router() -> None:
+    """Verify the app asked about a command is chosen by the router."""
+    manager = CommandManager(app_info_max_age=0, router="round-robin")
+    handlers: List[Any] = [FakeHandler(app_id) for app_id in "ab"]
+    for handler in handlers:
+        manager.subscribe(handler)
+    await asyncio.sleep(0.01)
+    for i in range(4):
+        assert await manager.get_command_info("help:licenses") is not None
+    infos = [[r for r in h.requests if r[0] == C.COMMAND_INFO] for h in handlers]
+    assert [len(requests) for requests in infos] == [2, 2]
+
+
+@pytest.mark.asyncio
+async def test_search_commands() -> None:
+    """Verify commands of all apps are searched, and the index follows deltas."""
+    manager = CommandManager(app_info_max_age=60)
+    for app_id in ["app", "other"]:
+        handler: Any = FakeHandler(app_id)
+        manager.subscribe(handler)
+    results = await manager.search_commands("lic")
+    assert results == [
+        {
+            "id": "help:licenses",
+            "label": "Licenses",
+            "score": 2.0,
+            "apps": ["app", "other"],
+        }
+    ]
+    assert [r["score"] for r in await manager.search_commands("*:lic*")] == [1.0]
+    assert await manager.search_commands("about") == []
+
+    handler = manager.handlers[0]
+    manager.on_event(
+        handler,
+        {
+            "request_type": C.COMMANDS_CHANGED,
+            "content": {"changed": {"help:about": {"label": "About"}}},
+        },
+    )
+    results = await manager.search_commands("about")
+    assert [(r["id"], r["apps"]) for r in results] == [("help:about", ["app"])]
+    manager.on_event(
+        handler,
+        {"request_type": C.COMMANDS_CHANGED, "content": {"removed": ["help:about"]}},
+    )
+    assert await manager.search_commands("about") == []
+    assert len(await manager.search_commands("", limit=1)) == 1
+
+
+class FakeIconHandler(FakeHandler):
+    """A stand-in for an app with icons, which only sends those not yet known."""
+
+    icons = {ICON_HASH: ICON}
+
+    async def jyg_request(
+        self, request_type: str, content: Any = None, raw: bool = False
+    ) -> Any:
+        result = await super().jyg_request(request_type, content, raw)
+        if request_type == C.APP_INFO:
+            app_info = result["content"]
+            known = content["known_icons"]
+            app_info["icons"] = {k: v for k, v in self.icons.items() if k not in known}
+            app_info["commands"]["help:licenses"]["icon"] = ICON_HASH
+        return result
+
+
+@pytest.mark.asyncio
+async def test_app_info_icons() -> None:
+    """Verify icons are kept apart from the app info, and only sent once."""
+    manager = CommandManager(app_info_max_age=60)
+    handler: Any = FakeIconHandler()
+    manager.subscribe(handler)
+    apps = await manager.get_apps()
+    assert "icons" not in apps[0]
+    assert apps[0]["commands"]["help:licenses"]["icon"] == ICON_HASH
+    assert manager.get_icon(ICON_HASH) == ICON
+    assert manager.get_icon("def456") is None
+    assert handler.requests[-1] == (C.APP_INFO, {"known_icons": []})
+
+    await manager.get_apps(refresh=True)
+    assert handler.requests[-1] == (C.APP_INFO, {"known_icons": [ICON_HASH]})
+
+    other_icon = "<svg></svg>"
+    manager.on_event(
+        handler,
+        {
+            "request_type": C.COMMANDS_CHANGED,
+            "content": {
+                "changed": {"help:about": {"icon": hash_icon(other_icon)}},
+                "icons": {hash_icon(other_icon): other_icon},
+            },
+        },
+    )
+    assert manager.get_icon(hash_icon(other_icon)) == other_icon
+    assert manager.get_stats()["icons"] == 2
+
+
+@pytest.mark.asyncio
+async def test_app_info_icons_checked() -> None:
+    """Verify icons must match their hash, and are forgotten when no app uses them."""
+    manager = CommandManager(app_info_max_age=60)
+    evil: Any = FakeIconHandler("evil")
+    evil.icons = {ICON_HASH: "<svg><script/></svg>", "def456": "<svg/>"}
+    manager.subscribe(evil)
+    await manager.get_apps()
+    assert manager.get_icon(ICON_HASH) is None
+    assert manager.get_icon("def456") is None
+    assert manager.get_stats()["icons_rejected"] == 2
+
+    honest: Any = FakeIconHandler("honest")
+    manager.subscribe(honest)
+    await manager.get_apps()
+    assert manager.get_icon(ICON_HASH) == ICON
+    await manager.get_apps(refresh=True)
+    assert evil.requests[-1] == (C.APP_INFO, {"known_icons": [ICON_HASH]})
+
+    manager.unsubscribe(honest)
+    assert manager.get_icon(ICON_HASH) == ICON, "expected an icon still in use"
+    manager.unsubscribe(evil)
+    assert manager.get_icon(ICON_HASH) is None
+    assert manager.get_stats()["icons"] == 0
+
+
+@pytest.mark.asyncio
+async def test_app_info_icons_pending() -> None:
+    """Verify icons an app was told are known outlive the app which sent them."""
+    manager = CommandManager(app_info_max_age=60)
+    first: Any = FakeIconHandler("first")
+    manager.subscribe(first)
+    await manager.get_apps()
+
+    slow: Any = FakeIconHandler("slow")
+    slow.delay = 0.05
+    manager.subscribe(slow)
+    await asyncio.sleep(0.01)
+    assert slow.requests[-1] == (C.APP_INFO, {"known_icons": [ICON_HASH]})
+    manager.unsubscribe(first)
+    assert manager.get_icon(ICON_HASH) == ICON, "expected icons kept while pending"
+
+    apps = await manager.get_apps()
+    assert apps[0]["commands"]["help:licenses"]["icon"] == ICON_HASH
+    assert manager.get_icon(ICON_HASH) == ICON, "expected an icon still in use"
+    manager.unsubscribe(slow)
+    assert manager.get_icon(ICON_HASH) is None
+
+
+@pytest.mark.asyncio
+async def test_app_info_coalesced() -> None:
+    """Verify concurrent app info requests are shared."""
+    manager = CommandManager(app_info_max_age=0)
+    handler: Any = FakeHandler()
+    manager.subscribe(handler)
+    results = await asyncio.gather(*[manager.get_apps() for i in range(10)])
+    assert results == [(APP_INFO_WITH_ID,)] * 10
+    assert len(handler.requests) == 1, "expected one shared request"
+    stats = manager.get_stats()
+    assert stats["app_info_requests"] == 1
+    assert stats["app_info_coalesced"] == 9
+    assert stats["app_info_coalescing_rate"] == 0.9
+
+
+@pytest.mark.asyncio
+async def test_app_info_coalesced_after_timeout() -> None:
+    """Verify an app info request outlives a caller which timed out."""
+    manager = CommandManager(app_info_max_age=0)
+    handler: Any = FakeHandler()
+    handler.delay = 0.05
+    manager.subscribe(handler)
+    apps, timed_out = await manager.get_apps_within(timeout=0.01)
+    assert (apps, timed_out) == ((), (handler.app_id,))
+    assert await manager.get_apps() == (APP_INFO_WITH_ID,)
+    assert len(handler.requests) == 1, "expected the slow request to be shared"
+    assert manager.get_stats()["app_info_coalesced"] == 1
+
+
+@pytest.mark.asyncio
+async def test_app_info_no_cache() -> None:
+    """Verify app info is always requested with no max age."""
+    manager = CommandManager(app_info_max_age=0)
+    handler: Any = FakeHandler()
+    manager.subscribe(handler)
+    await manager.get_apps()
+    await manager.get_apps()
+    assert len(handler.requests) == 2, "expected no cache"
+
+
+@pytest.mark.asyncio
+async def test_run_batch() -> None:
+    """Verify a batch is one request, with a result for each item."""
+    manager = CommandManager(app_info_max_age=0)
+    handler: Any = FakeHandler()
+    manager.subscribe(handler)
+    items: Any = [
+        {"id": "help:licenses", "args": {"a": 1}},
+        {"id": "help:licenses", "args": {"error": "a result"}},
+        {"id": "help:nope", "args": {}},
+    ]
+    results = await manager.run_batch(items, C.CONCURRENT)
+    assert results == [
+        {"content": {"a": 1}},
+        {"content": {"error": "a result"}},
+        {"error": "help:nope not found"},
+    ]
+    assert handler.requests == [(C.RUN_BATCH, {"items": items, "mode": C.CONCURRENT})]
+
+
+@pytest.mark.asyncio
+async def test_run_many() -> None:
+    """Verify the in-process API fills in args, and spreads batch errors."""
+    manager = CommandManager(app_info_max_age=0)
+    items: Any = [{"id": "help:licenses"}, {"id": "help:nope", "args": {"b": 2}}]
+    assert (
+        await manager.run_many(items) == [{"error": "no handlers", "status": 503}] * 2
+    )
+    handler: Any = FakeHandler()
+    manager.subscribe(handler)
+    results = await manager.run_many(items)
+    assert results == [{"content": {}}, {"error": "help:nope not found"}]
+    assert handler.requests[-1][1]["items"][0] == {"id": "help:licenses", "args": {}}
+    assert await manager.run("help:licenses") == {
+        "content": {"id": "help:licenses", "args": {}}
+    }
+
+
+@pytest.mark.parametrize(
+    "router, outstanding, expected",
+    [
+        ["first", [0, 0, 0], "aaaaaa"],
+        ["round-robin", [0, 0, 0], "abcabc"],
+        ["least-outstanding", [0, 0, 0], "aaaaaa"],
+        ["least-outstanding", [2, 1, 2], "bbbbbb"],
+        ["most-recently-responsive", [0, 0, 0], "cccccc"],
+        ["lowest-latency", [0, 0, 0], "bbbbbb"],
+    ],
+)
+@pytest.mark.asyncio
+async def test_routers(router: str, outstanding: List[int], expected: str) -> None:
+    """Verify routing policies choose the expected apps."""
+    manager = CommandManager(app_info_max_age=0, router=router)
+    for app_id, count in zip("abc", outstanding):
+        handler: Any = FakeHandler(app_id)
+        handler.outstanding = count
+        handler.rtt = {"a": None, "b": 0.1, "c": 0.2}[app_id]
+        manager.subscribe(handler)
+    chosen = "".join(manager.get_handler().app_id for i in range(6))  # type: ignore
+    assert chosen == expected
+
+
+@pytest.mark.asyncio
+async def test_run_app_id() -> None:
+    """Verify a command can be run in an app by id."""
+    manager = CommandManager(app_info_max_age=0)
+    for app_id in "ab":
+        manager.subscribe(FakeHandler(app_id))  # type: ignore
+    await manager.run("help:licenses", {}, app_id="b")
+    assert [len(h.requests) for h in manager.handlers] == [0, 1]  # type: ignore
+    assert await manager.run("help:licenses", {}, app_id="c") == {
+        "error": "app c not found",
+        "status": 404,
+    }
+
+
+@pytest.mark.parametrize(
+    "delays, timeout, first, expected, expected_timed_out",
+    [
+        [[0, 0], 1, False, "ab", ""],
+        [[0, 10], 0.1, False, "a", "b"],
+        [[0.1, 0], None, True, "b", "a"],
+    ],
+)
+@pytest.mark.asyncio
+async def test_apps_within(
+    delays: List[float],
+    timeout: Any,
+    first: bool,
+    expected: str,
+    expected_timed_out: str,
+) -> None:
+    """Verify slow apps don't hold back app info."""
+    manager = CommandManager(app_info_max_age=0)
+    for app_id, delay in zip("ab", delays):
+        handler: Any = FakeHandler(app_id)
+        handler.delay = delay
+        manager.subscribe(handler)
+    apps, timed_out = await manager.get_apps_within(timeout=timeout, first=first)
+    assert "".join(app["id"] for app in apps) == expected
+    assert "".join(timed_out) == expected_timed_out
+
+
+@pytest.mark.asyncio
+async def test_heartbeat() -> None:
+    """Verify apps which stop responding are evicted."""
+    manager = CommandManager(app_info_max_age=0, heartbeat_timeout=10)
+    alive: Any = FakeHandler("alive")
+    dead: Any = FakeHandler("dead")
+    dead.last_seen -= 60
+    manager.subscribe(alive)
+    manager.subscribe(dead)
+    manager.heartbeat()
+    assert manager.handlers == (alive,)
+    assert alive.heartbeats == 1 and not alive.evicted
+    assert dead.evicted
+    assert [*manager.get_stats()["apps"]] == ["alive"]
@@ -0,0 +1,82 @@
+"""Tests for reading messages from apps."""
+import json
+from typing import Any, List, Optional, Union
+
+import pytest
+
+from jyg import constants as C
+from jyg.messages import (
+    RawJSON,
+    decode_message,
+    encode_message,
+    select_subprotocol,
+    split_envelope,
+)
+
+CONTENT = {"a": [1, {"content": 2}], "content": "x"}
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        {"request_id": "1", "request_type": "run", "content": CONTENT},
+        {"request_id": "1", "request_type": "run", "content": None},
+        {"request_id": "1", "request_type": "run", "content": "}"},
+    ],
+)
+def test_split_envelope(message: Any) -> None:
+    """Verify the content of compact messages, sent last, isn't decoded."""
+    raw = json.dumps(message, separators=(",", ":"))
+    raw_messages: List[Union[str, bytes]] = [raw, raw.encode("utf-8")]
+    for raw_message in raw_messages:
+        envelope, is_raw = split_envelope(raw_message)
+        assert is_raw
+        assert isinstance(envelope["content"], RawJSON)
+        assert envelope["content"].decode() == message["content"]
+        assert {**envelope, "content": message["content"]} == message
+
+
+@pytest.mark.parametrize(
+    "message, separators",
+    [
+        [{"content": CONTENT, "request_id": "1", "request_type": "run"}, (",", ":")],
+        [{"content": {"x": {"content": 1}}, "request_id": "1"}, (",", ":")],
+        [{"request_id": "1", "request_type": "run", "content": CONTENT}, None],
+        [{"request_id": "1", "error": 'a,"content":b'}, (",", ":")],
+        [{"request_id": "1", "content": {"a": 1}, "request_type": "run"}, (",", ":")],
+        [{"request_id": "1", "content": "}", "request_type": "}"}, (",", ":")],
+        [{"request_id": "1", "content": [1, "]"], "error": "x"}, (",", ":")],
+    ],
+)
+def test_split_envelope_fallback(message: Any, separators: Any) -> None:
+    """Verify other messages are decoded in full."""
+    raw = json.dumps(message, separators=separators)
+    assert split_envelope(raw) == (message, False)
+
+
+@pytest.mark.parametrize(
+    "offered, expected",
+    [
+        [[C.JSON_SUBPROTOCOL, C.MSGPACK_SUBPROTOCOL], C.MSGPACK_SUBPROTOCOL],
+        [[C.JSON_SUBPROTOCOL], C.JSON_SUBPROTOCOL],
+        [["other"], None],
+        [[], None],
+    ],
+)
+def test_select_subprotocol(offered: List[str], expected: Optional[str]) -> None:
+    """Verify MessagePack is preferred, when offered."""
+    pytest.importorskip("msgpack")
+    assert select_subprotocol(offered) == expected
+
+
+@pytest.mark.parametrize("subprotocol", [None, *C.SUBPROTOCOLS])
+def test_encode_decode(subprotocol: Optional[str]) -> None:
+    """Verify messages survive encoding."""
+    if subprotocol == C.MSGPACK_SUBPROTOCOL:
+        pytest.importorskip("msgpack")
+    message = {"request_id": "1", "request_type": "app_info", "content": CONTENT}
+    encoded = encode_message(message, subprotocol)
+    assert isinstance(encoded, bytes) == (subprotocol == C.MSGPACK_SUBPROTOCOL)
+    decoded, is_raw = decode_message(encoded, subprotocol)
+    assert decoded == message
+    assert not is_raw
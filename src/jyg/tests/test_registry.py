@@ -0,0 +1,35 @@
+"""Tests for the jyg app registry."""
+from typing import Any
+
+from jyg.registry import AppRegistry
+
+
+class FakeHandler:
+    """A stand-in for a ``CommandWebSocketHandler``."""
+
+    def __init__(self, app_id: str) -> None:
+        self.app_id = app_id
+
+
+def test_registry_indexes() -> None:
+    """Verify apps can be found by id, url and plugin."""
+    registry = AppRegistry()
+    a: Any = FakeHandler("a")
+    b: Any = FakeHandler("b")
+    registry.add(a, url="http://localhost/lab", name="JupyterLab")
+    registry.add(b, url="http://localhost/lab")
+    registry.add(b, url="http://localhost/lab")
+    assert registry.handlers == (a, b), "expected no duplicate apps"
+    assert [r.app_id for r in registry.by_url("http://localhost/lab")] == ["a", "b"]
+
+    registry.update(b, {"url": "http://localhost/retro", "plugins": ["p1", "p2"]})
+    assert [r.app_id for r in registry.by_url("http://localhost/lab")] == ["a"]
+    assert [r.app_id for r in registry.by_plugin("p2")] == ["b"]
+    record = registry.get("b")
+    assert record is not None and len(record.plugins_hash) == 16
+
+    registry.remove(b)
+    assert registry.handlers == (a,)
+    assert registry.by_plugin("p2") == ()
+    assert registry.by_url("http://localhost/retro") == ()
+    assert registry.get("b") is None
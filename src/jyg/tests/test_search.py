@@ -0,0 +1,104 @@
+"""Tests for searching commands by id and label."""
+import time
+from typing import Optional
+
+import pytest
+
+from jyg import constants as C
+from jyg.search import CommandIndex, Trie
+
+COMMANDS = {
+    "help:about": {"label": "About JupyterLab"},
+    "help:licenses": {"label": "Licenses"},
+    "docmanager:save": {"label": "Save File"},
+    "docmanager:save-as": {"label": "Save File As…"},
+    "notebook:run-all-cells": {"label": "Run All Cells"},
+    "console:create": {},
+}
+
+
+def test_trie() -> None:
+    """Verify a trie finds values by prefix, and prunes removed keys."""
+    trie = Trie()
+    trie.add("save", "a")
+    trie.add("save-as", "b")
+    assert sorted(set().union(*trie.find("sa"))) == ["a", "b"]
+    assert [*trie.find("x")] == []
+    trie.discard("save-as", "b")
+    trie.discard("nope", "b")
+    assert [*trie.find("save-")] == []
+    assert [*trie.find("")] == [{"a"}]
+
+
+@pytest.mark.parametrize(
+    "glob,text,matches",
+    [
+        ("help:*", "help:about", True),
+        ("help:*", "xhelp:about", False),
+        ("h?lp:*", "halp:x", True),
+        ("*:save[!-]*", "docmanager:save-as", False),
+        ("*:[rs]*", "docmanager:save", True),
+        ("a.b", "axb", False),
+    ],
+)
+def test_index_glob(glob: str, text: str, matches: bool) -> None:
+    """Verify globs match whole ids, with literal regex characters."""
+    assert bool(CommandIndex({text: {}}).search_glob(glob)) == matches
+
+
+@pytest.mark.parametrize("query", ["e" * 8 + "z", "*e" * 8 + "z"])
+def test_index_pathological(query: str) -> None:
+    """Verify queries which would backtrack badly as regexes still return fast."""
+    commands = {f"x:{i}": {"label": "e" * 40} for i in range(200)}
+    index = CommandIndex(commands)
+    start = time.perf_counter()
+    assert not index.search(query)
+    assert not index.search(query.replace("*", ""), C.FUZZY)
+    assert time.perf_counter() - start < 0.5
+    assert len(index.search("e" * 8, C.FUZZY)) == len(commands)
+
+
+@pytest.mark.parametrize(
+    "query,match,expected",
+    [
+        ("help:about", None, ["help:about"]),
+        ("help:", None, ["help:about", "help:licenses"]),
+        ("save file", None, ["docmanager:save", "docmanager:save-as"]),
+        ("run cells", C.PREFIX, ["notebook:run-all-cells"]),
+        ("*:save*", None, ["docmanager:save", "docmanager:save-as"]),
+        ("save file", C.GLOB, ["docmanager:save"]),
+        ("nbrun", None, ["notebook:run-all-cells"]),
+        ("lic", C.FUZZY, ["help:licenses"]),
+        ("console:", C.PREFIX, ["console:create"]),
+    ],
+)
+def test_index_search(query: str, match: Optional[str], expected: list) -> None:
+    """Verify commands are found by prefix, glob or fuzzy match."""
+    index = CommandIndex(COMMANDS)
+    assert sorted(index.search(query, match)) == expected
+
+
+def test_index_scores() -> None:
+    """Verify exact, prefix, word and fuzzy matches are ranked in that order."""
+    index = CommandIndex(COMMANDS)
+    scores = index.search("docmanager:save")
+    assert scores["docmanager:save"] > scores["docmanager:save-as"]
+    assert index.search("save")["docmanager:save"] > max(
+        index.search_fuzzy("save").values()
+    )
+    fuzzy = index.search_fuzzy("ab")
+    assert fuzzy["help:about"] == 1.0
+
+
+def test_index_update() -> None:
+    """Verify commands can be added, relabelled and removed."""
+    index = CommandIndex(COMMANDS)
+    assert index.search("run all*") == {"notebook:run-all-cells": 1.0}
+    index.add("notebook:run-all-cells", "Run Everything")
+    assert index.labels["notebook:run-all-cells"] == "Run Everything"
+    assert not index.search("run all*")
+    assert [*index.search("everything")] == ["notebook:run-all-cells"]
+    index.discard("notebook:run-all-cells")
+    index.discard("notebook:run-all-cells")
+    assert not index.search("everything") and not index.search("notebook")
+    assert len(index) == len(COMMANDS) - 1
@@ -0,0 +1,116 @@
+"""Tests for jyg sessions, shells and daemons."""
+import io
+import json
+import socket
+import threading
+from pathlib import Path
+
+import pytest
+
+from jyg.client import Client
+from jyg.session import Session, SessionShell, make_server, write_token
+
+from .conftest import FAKE_APPS, WIN, FakeServer
+
+
+@pytest.fixture
+def a_session(a_server: FakeServer) -> Session:
+    """Get a session with the fake server."""
+    return Session(Client(f"http://127.0.0.1:{a_server.server_port}/"))
+
+
+def test_session_catalog(a_server: FakeServer, a_session: Session) -> None:
+    """Verify the catalog is fetched once, until refreshed."""
+    assert a_session.command_ids() == ["help:about", "help:licenses"]
+    assert a_session.apps == FAKE_APPS
+    assert len(a_server.ports) == 1
+    a_session.refresh()
+    assert a_session.command_ids() == ["help:about", "help:licenses"]
+    assert len(a_server.ports) == 2
+
+
+def test_shell(a_session: Session) -> None:
+    """Verify the shell lists, completes and runs commands."""
+    stdout = io.StringIO()
+    shell = SessionShell(a_session, stdin=io.StringIO(), stdout=stdout)
+    shell.use_rawinput = False
+    for line in [
+        "list help:l",
+        "help:about --x=1",
+        "run help:about '{\"y\": 2}'",
+        "run help:about x",
+    ]:
+        shell.onecmd(shell.precmd(line))
+    out = stdout.getvalue()
+    assert "help:licenses\tLicenses" in out and "help:about\t" not in out
+    assert '"x": 1' in out and '"y": 2' in out
+    assert "ERROR: Expected param" in out
+    assert shell.complete_run("l", "run help:l", 4, 10) == ["licenses"]
+    assert shell.onecmd("quit")
+
+
+@pytest.mark.parametrize("use_port", [True, False])
+def test_daemon(a_session: Session, tmp_path: Path, use_port: bool) -> None:
+    """Verify a daemon answers each line with a line, after a TCP client's token."""
+    if not use_port and WIN:  # pragma: no cover
+        pytest.skip("no socket files on windows")
+    sock_path = None if use_port else tmp_path / "jyg.sock"
+    server = make_server(a_session, sock_path)
+    assert bool(server.token) == use_port, "expected a token only for TCP"
+    login = json.dumps({"token": server.token}).encode("utf-8") + b"\n"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    family = socket.AF_INET if use_port else socket.AF_UNIX
+    try:
+        with socket.socket(family) as client:
+            client.connect(server.server_address)
+            client.sendall(
+                (login if use_port else b"")
+                + b'{"op": "list"}\n\n{"id": "help:about", "args": {"x": 1}}\n{}\n'
+            )
+            reader = client.makefile("rb")
+            if use_port:
+                assert json.loads(reader.readline()) == {
+                    "line": 1,
+                    "authenticated": True,
+                }
+            results = [json.loads(reader.readline()) for i in range(3)]
+    finally:
+        server.shutdown()
+        server.server_close()
+    first = 2 if use_port else 1
+    assert results[0] == {"line": first, "apps": FAKE_APPS}
+    assert results[1] == {"line": first + 2, "id": "help:about", "response": {"x": 1}}
+    assert "KeyError" in results[2]["error"]
+
+
+@pytest.mark.parametrize(
+    "login", [b'{"token": "wrong"}\n', b'{"id": "help:about"}\n', b"not json\n"]
+)
+def test_daemon_token(
+    a_server: FakeServer, a_session: Session, tmp_path: Path, login: bytes
+) -> None:
+    """Verify a TCP daemon closes connections which don't send its token first."""
+    server = make_server(a_session)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with socket.socket(socket.AF_INET) as client:
+            client.connect(server.server_address)
+            client.sendall(login + b'{"id": "help:about"}\n')
+            reader = client.makefile("rb")
+            assert json.loads(reader.readline()) == {
+                "line": 1,
+                "authenticated": False,
+            }
+            assert reader.readline() == b"", "expected the connection to close"
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert a_server.ports == [], "expected no command to be run"
+
+    token_path = tmp_path / "jyg-daemon.token"
+    write_token(token_path, server.token)
+    assert token_path.read_text(encoding="utf-8") == server.token
+    if not WIN:
+        assert token_path.stat().st_mode & 0o777 == 0o600
@@ -1,8 +1,15 @@
 """Utilities for jyg."""
+import hashlib
 import json
 import os
 from pathlib import Path
-from typing import Any, Dict, Iterator, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, cast
+
+#: the prefixes of server info files in the jupyter runtime directory
+SERVER_INFO_PREFIXES = ("jpserver-", "nbserver-")
+
+#: bumped when the format of the discovery cache changes
+DISCOVERY_CACHE_VERSION = 1
 
 
 def is_pid_killable(pid: int) -> bool:
@@ -18,13 +25,17 @@ def is_pid_killable(pid: int) -> bool:
         return False
 
 
-def fallback_list_running_servers() -> Iterator[Dict[str, Any]]:
+def fallback_list_running_servers(cache: bool = True) -> Iterator[Dict[str, Any]]:
     """Iterate over the server info files of running Jupyter/notebook servers.
 
     Given a runtime directory, find (nb|jp)server-* files in the security directory,
     and yield dicts of their information, each one pertaining to a currently
     running Jupyter server instance.
 
+    Unless ``cache`` is ``False``, the servers found are kept in a discovery cache,
+    which is reused while the runtime directory and its server info files are the
+    same: only the processes of the cached servers are then checked.
+
     Adapted from:
 
     https://github.com/jupyter-server/jupyter_server/blob/v2.1.0/jupyter_server/serverapp.py#L2922
@@ -32,7 +43,27 @@ def fallback_list_running_servers() -> Iterator[Dict[str, Any]]:
     from jupyter_core.paths import jupyter_runtime_dir
 
     runtime_dir = Path(jupyter_runtime_dir())
+    key = discovery_key(runtime_dir)
+    if key is None:
+        return
+
+    cache_path = discovery_cache_path(runtime_dir)
+    servers = read_discovery_cache(cache_path, key) if cache else None
+
+    if servers is None:
+        servers = [*_scan_running_servers(runtime_dir)]
+        if cache:
+            write_discovery_cache(cache_path, key, servers)
+        yield from servers
+        return
+
+    for info in servers:
+        if is_pid_killable(info["pid"]):
+            yield info
+
 
+def _scan_running_servers(runtime_dir: Path) -> Iterator[Dict[str, Any]]:
+    """Read and check every server info file, newest first."""
     # find info paths in time order order
     info_paths = sorted(
         [
@@ -52,6 +83,69 @@ def fallback_list_running_servers() -> Iterator[Dict[str, Any]]:
             yield info
 
 
+def discovery_key(runtime_dir: Path) -> Optional[Dict[str, Any]]:
+    """Get what the discovery cache of a runtime directory is valid for.
+
+    This is the directory's modification time, which changes as files are added or
+    removed, and the names and inodes of its server info files, which only needs one
+    directory listing.
+    """
+    try:
+        mtime_ns = runtime_dir.stat().st_mtime_ns
+        with os.scandir(runtime_dir) as entries:
+            files = sorted(
+                [entry.name, entry.inode()]
+                for entry in entries
+                if entry.name.endswith(".json")
+                and entry.name.startswith(SERVER_INFO_PREFIXES)
+            )
+    except OSError:
+        return None
+    return {"runtime_dir": str(runtime_dir), "mtime_ns": mtime_ns, "files": files}
+
+
+def discovery_cache_path(runtime_dir: Path) -> Path:
+    """Get the path of the discovery cache of a runtime directory.
+
+    This is outside the runtime directory, so that writing it doesn't invalidate it.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    digest = hashlib.sha256(str(runtime_dir).encode("utf-8")).hexdigest()[:16]
+    return Path(cache_home) / "jyg" / f"servers-{digest}.json"
+
+
+def read_discovery_cache(
+    cache_path: Path, key: Dict[str, Any]
+) -> Optional[List[Dict[str, Any]]]:
+    """Read the cached servers, if still valid for the key."""
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if cached.get("version") != DISCOVERY_CACHE_VERSION or cached.get("key") != key:
+        return None
+    return cast(List[Dict[str, Any]], cached["servers"])
+
+
+def write_discovery_cache(
+    cache_path: Path, key: Dict[str, Any], servers: List[Dict[str, Any]]
+) -> None:
+    """Replace the cached servers, readable only by the current user.
+
+    Failing to write the cache is not an error.
+    """
+    body = {"version": DISCOVERY_CACHE_VERSION, "key": key, "servers": servers}
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}")
+    try:
+        cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+            json.dump(body, tmp)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+
+
 def parse_command_args(argv: List[str]) -> Dict[str, Any]:
     """Parse shell-style tokens to arbitrary JSON."""
     args: Dict[str, Any] = {}